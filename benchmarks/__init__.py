@@ -0,0 +1 @@
+"""Benchmarks of the sync engine on synthetic photo libraries"""
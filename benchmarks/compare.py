@@ -0,0 +1,31 @@
+"""Compare two benchmark result files
+
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import json
+import sys
+
+
+def compare(old, new):
+    lines = [f"{'benchmark':15} {old['commit']:>12} {new['commit']:>12} {'change':>8}"]
+    for name in new["results"]:
+        after = new["results"][name]["seconds"]
+        if name not in old["results"]:
+            lines.append(f"{name:15} {'-':>12} {after:11.3f}s {'-':>8}")
+            continue
+        before = old["results"][name]["seconds"]
+        change = (after - before) / before * 100 if before else 0
+        lines.append(f"{name:15} {before:11.3f}s {after:11.3f}s {change:+7.1f}%")
+    return "\n".join(lines)
+
+
+def main():
+    with open(sys.argv[1]) as infile:
+        old = json.load(infile)
+    with open(sys.argv[2]) as infile:
+        new = json.load(infile)
+    print(compare(old, new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""In-process stand-in for the Google Photos Library API, for offline end-to-end and load tests
+
+    with FakeGPhoto(latency=0.05, page_size=25) as server:
+        remote = GoogleRemote(token_cache, api_url=server.api_url, token_uri=server.token_uri, ...)
+
+Only the endpoints GPhoto uses are implemented, with just enough of the real behaviour to exercise the sync
+paths: paging, short-lived media URLs, upload quota errors and batch media creation.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ACCESS_TOKEN = "fake-access-token"
+REFRESH_TOKEN = "fake-refresh-token"
+
+
+def write_token_cache(path):
+    """Token cache accepted by the fake server, so GPhoto does not ask for an authorization code"""
+    with open(path, "w") as outfile:
+        json.dump({"gphoto_refresh_token": REFRESH_TOKEN}, outfile)
+
+
+class Library:
+    """Media items, albums and uploads held by the fake server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.data = {}
+        self.albums = {}
+        self.uploads = {}
+
+    def add_item(self, filename, data, created=None, mime_type="image/jpeg"):
+        item_id = hashlib.sha1(f"{filename}{len(self.items)}".encode("utf8")).hexdigest()
+        created = created or datetime(2020, 1, 1)
+        with self.lock:
+            self.items[item_id] = {
+                "id": item_id,
+                "filename": filename,
+                "mimeType": mime_type,
+                "productUrl": f"https://photos.example.com/lr/photo/{item_id}",
+                "mediaMetadata": {"creationTime": created.strftime("%Y-%m-%dT%H:%M:%SZ")},
+            }
+            self.data[item_id] = data
+        return item_id
+
+    def add_album(self, title, item_ids=()):
+        album_id = uuid.uuid4().hex
+        with self.lock:
+            self.albums[album_id] = {"id": album_id, "title": title, "items": list(item_ids)}
+        return album_id
+
+
+class FakeGPhoto:
+    """Threaded HTTP server serving a Library on localhost
+
+    latency - seconds added to every request
+    page_size - maximum items per page of search and album listings, whatever the client asks for
+    quota_errors - number of upcoming uploads that fail with a quota error
+    url_ttl - seconds until a baseUrl handed out by the server stops working
+    """
+
+    def __init__(self, library=None, latency=0.0, page_size=100, quota_errors=0, url_ttl=3600):
+        self.library = library or Library()
+        self.latency = latency
+        self.page_size = page_size
+        self.quota_errors = quota_errors
+        self.url_ttl = url_ttl
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def api_url(self):
+        return self.base + "/v1"
+
+    @property
+    def token_uri(self):
+        return self.base + "/token"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def take_quota_error(self):
+        with self.lock:
+            if self.quota_errors > 0:
+                self.quota_errors -= 1
+                return True
+            return False
+
+    def media_item(self, item_id):
+        item = dict(self.library.items[item_id])
+        # The expiry time is part of the URL, like the signature of real media URLs
+        item["baseUrl"] = f"{self.base}/media/{item_id}/{time.time() + self.url_ttl:.3f}"
+        return item
+
+    def page(self, items, page_token):
+        start = int(page_token or 0)
+        result = items[start : start + self.page_size]
+        next_token = str(start + self.page_size) if start + self.page_size < len(items) else None
+        return result, next_token
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Routes requests to the FakeGPhoto handlers"""
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                self._dispatch("GET")
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                self._dispatch("POST")
+
+            def _dispatch(self, method):
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                if url.path == "/token":
+                    server.count("token")
+                    return self._json(200, {"access_token": ACCESS_TOKEN, "expires_in": 3600})
+                if self.headers.get("Authorization") != f"Bearer {ACCESS_TOKEN}":
+                    return self._json(401, {"error": {"code": 401, "message": "Missing or invalid credentials"}})
+                if url.path.startswith("/media/"):
+                    return self._download(url.path)
+                endpoint = url.path[len("/v1/") :]
+                server.count(endpoint.split("/")[0] if ":" not in endpoint else endpoint.split("/")[-1])
+                if endpoint == "uploads" and method == "POST":
+                    return self._upload(body)
+                payload = json.loads(body) if body and method == "POST" else {}
+                routes = {
+                    ("POST", "mediaItems:search"): self._search,
+                    ("POST", "mediaItems:batchCreate"): self._batch_create,
+                    ("GET", "mediaItems:batchGet"): self._batch_get,
+                    ("GET", "albums"): self._albums,
+                    ("POST", "albums"): self._create_album,
+                }
+                if (method, endpoint) in routes:
+                    return routes[(method, endpoint)](payload, query)
+                if method == "POST" and endpoint.startswith("albums/") and endpoint.endswith(":batchAddMediaItems"):
+                    return self._add_to_album(endpoint[len("albums/") : -len(":batchAddMediaItems")], payload)
+                if method == "GET" and endpoint.startswith("mediaItems/"):
+                    item_id = endpoint[len("mediaItems/") :]
+                    if item_id not in server.library.items:
+                        return self._json(404, {"error": {"code": 404, "message": "Not found"}})
+                    return self._json(200, server.media_item(item_id))
+                return self._json(404, {"error": {"code": 404, "message": f"Unknown endpoint {method} {endpoint}"}})
+
+            def _json(self, status, data):
+                body = json.dumps(data).encode("utf8")
+                self._send(status, body, "application/json")
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _download(self, path):
+                server.count("download")
+                _, _, item_id, expires = path.split("/", 3)
+                expires, _, suffix = expires.partition("=")
+                if suffix != "d" or item_id not in server.library.data:
+                    return self._send(404, b"Not found", "text/plain")
+                if time.time() > float(expires):
+                    return self._send(403, b"URL expired", "text/plain")
+                return self._send(200, server.library.data[item_id], "image/jpeg")
+
+            def _upload(self, body):
+                if server.take_quota_error():
+                    return self._json(
+                        429, {"error": {"code": 429, "message": "Quota exceeded for quota metric 'Write requests'"}}
+                    )
+                token = uuid.uuid4().hex
+                with server.library.lock:
+                    server.library.uploads[token] = body
+                return self._send(200, token.encode("utf8"), "text/plain")
+
+            def _search(self, payload, query):  # pylint: disable=unused-argument
+                library = server.library
+                with library.lock:
+                    if "albumId" in payload:
+                        ids = list(library.albums.get(payload["albumId"], {}).get("items", []))
+                    else:
+                        ids = list(library.items)
+                    items, next_token = server.page(ids, payload.get("pageToken", payload.get("page_token")))
+                    data = {"mediaItems": [server.media_item(x) for x in items]}
+                if next_token:
+                    data["nextPageToken"] = next_token
+                return self._json(200, data)
+
+            def _batch_get(self, payload, query):  # pylint: disable=unused-argument
+                results = []
+                for item_id in query.get("mediaItemIds", []):
+                    if item_id in server.library.items:
+                        results.append({"mediaItem": server.media_item(item_id)})
+                    else:
+                        results.append({"status": {"code": 5, "message": "Not found"}})
+                return self._json(200, {"mediaItemResults": results})
+
+            def _batch_create(self, payload, query):  # pylint: disable=unused-argument
+                library = server.library
+                results = []
+                for new_item in payload.get("newMediaItems", []):
+                    token = new_item["simpleMediaItem"]["uploadToken"]
+                    with library.lock:
+                        data = library.uploads.pop(token, None)
+                    if data is None:
+                        results.append(
+                            {"uploadToken": token, "status": {"code": 3, "message": "Invalid upload token"}}
+                        )
+                        continue
+                    item_id = library.add_item(new_item["simpleMediaItem"]["fileName"], data, datetime.now())
+                    if "albumId" in payload:
+                        with library.lock:
+                            library.albums[payload["albumId"]]["items"].append(item_id)
+                    results.append(
+                        {
+                            "uploadToken": token,
+                            "status": {"message": "Success"},
+                            "mediaItem": server.media_item(item_id),
+                        }
+                    )
+                failed = any(x["status"]["message"] != "Success" for x in results)
+                return self._json(207 if failed else 200, {"newMediaItemResults": results})
+
+            def _albums(self, payload, query):  # pylint: disable=unused-argument
+                library = server.library
+                with library.lock:
+                    albums, next_token = server.page(list(library.albums.values()), query.get("page_token", [None])[0])
+                    data = {
+                        "albums": [
+                            {
+                                "id": x["id"],
+                                "title": x["title"],
+                                "productUrl": f"https://photos.example.com/lr/album/{x['id']}",
+                                "mediaItemsCount": str(len(x["items"])),
+                            }
+                            for x in albums
+                        ]
+                    }
+                if next_token:
+                    data["nextPageToken"] = next_token
+                return self._json(200, data)
+
+            def _create_album(self, payload, query):  # pylint: disable=unused-argument
+                album_id = server.library.add_album(payload["album"]["title"])
+                return self._json(
+                    200,
+                    {
+                        "id": album_id,
+                        "title": payload["album"]["title"],
+                        "productUrl": f"https://photos.example.com/lr/album/{album_id}",
+                    },
+                )
+
+            def _add_to_album(self, album_id, payload):
+                library = server.library
+                with library.lock:
+                    if album_id not in library.albums:
+                        return self._json(404, {"error": {"code": 404, "message": "Album not found"}})
+                    missing = [x for x in payload.get("mediaItemIds", []) if x not in library.items]
+                    if missing:
+                        return self._json(400, {"error": {"code": 400, "message": f"Invalid media items {missing}"}})
+                    library.albums[album_id]["items"].extend(payload.get("mediaItemIds", []))
+                return self._json(200, {})
+
+        return Handler
@@ -0,0 +1,122 @@
+"""Load test Google remote pull and push paths against the fake Google Photos Library server
+
+    python -m benchmarks.google --photos 2000 --latency 0.05 --photo-size 1048576
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+from benchmarks.fake_gphoto import FakeGPhoto, Library, write_token_cache
+from benchmarks.run import _commit
+from photoriver2.gphoto_api import GPhoto
+from photoriver2.remote_google import GoogleRemote
+from photoriver2.remote_local import LocalRemote
+
+logger = logging.getLogger("benchmarks")
+
+
+def _google(server, workdir):
+    write_token_cache(os.path.join(workdir, "token.cache"))
+    return GoogleRemote(
+        token_cache=os.path.join(workdir, "token.cache"),
+        name="gphoto",
+        state_dir=workdir,
+        api_url=server.api_url,
+        token_uri=server.token_uri,
+    )
+
+
+def _folder(workdir, name):
+    folder = os.path.join(workdir, name)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    return folder
+
+
+def _timed(results, name, func, items, size):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    results[name] = {"seconds": seconds, "items": items, "bytes": items * size}
+    logger.info(
+        "%-10s %10.3fs %8.1f items/s %8.1f MiB/s", name, seconds, items / seconds, items * size / seconds / 2 ** 20
+    )
+
+
+def run(workdir, options):
+    results = {}
+    library = Library()
+    for i in range(options.photos):
+        library.add_item(
+            f"IMG_{i:07d}.jpeg", os.urandom(options.photo_size), datetime(2020, 1, 1) + timedelta(hours=i)
+        )
+    server = FakeGPhoto(
+        library, latency=options.latency, page_size=options.page_size, quota_errors=options.quota_errors
+    )
+    with server:
+        remote = _google(server, _folder(workdir, "state"))
+        _timed(results, "list", remote.get_new_state, options.photos, 0)
+        pulled = LocalRemote(_folder(workdir, "pulled"), name="pulled", state_dir=workdir)
+        _timed(
+            results,
+            "pull",
+            lambda: pulled.do_updates(pulled.get_merge_updates(remote)),
+            options.photos,
+            options.photo_size,
+        )
+        pulled.get_new_state()
+        # Push the pulled photos into an empty library
+        server.library = Library()
+        remote = _google(server, _folder(workdir, "state"))
+        _timed(
+            results,
+            "push",
+            lambda: remote.do_updates(remote.get_merge_updates(pulled)),
+            options.photos,
+            options.photo_size,
+        )
+        results["requests"] = server.requests
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Photoriver2 Google remote load test")
+    parser.add_argument("--photos", type=int, default=1000, help="Photos in the fake library")
+    parser.add_argument("--photo-size", type=int, default=256 * 1024, help="Bytes per photo")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every API request")
+    parser.add_argument("--page-size", type=int, default=100, help="Items per page of listings")
+    parser.add_argument("--quota-errors", type=int, default=0, help="Uploads failing with a quota error")
+    parser.add_argument("--workdir", help="Folder for pulled photos and states")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "results"), help="Results folder")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("photoriver2").setLevel(logging.WARNING)
+    options = parse_args()
+    GPhoto.quota_wait = 1
+    workdir = options.workdir or tempfile.mkdtemp(prefix="photoriver2-google-")
+    results = {
+        "commit": _commit(),
+        "date": datetime.now().isoformat(),
+        "photos": options.photos,
+        "photo_size": options.photo_size,
+        "latency": options.latency,
+        "results": run(workdir, options),
+    }
+    os.makedirs(options.output, exist_ok=True)
+    output = os.path.join(options.output, f"google-{results['commit']}-{options.photos}.json")
+    with open(output, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+    logger.info("Results written to %s", output)
+
+
+if __name__ == "__main__":
+    main()
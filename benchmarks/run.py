@@ -0,0 +1,216 @@
+"""Run sync engine benchmarks on a synthetic library and store the results
+
+    python -m benchmarks.run --photos 10000
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+from benchmarks.synthetic import make_google_state, make_library
+from photoriver2.main import run_sync
+from photoriver2.remote_base import BaseRemote
+from photoriver2.remote_local import LocalRemote
+from photoriver2.remote_memory import MemoryRemote, SyntheticRemote
+
+logger = logging.getLogger("benchmarks")
+
+BENCHMARKS = {}
+# Options of a plain sync run of photoriver2.main
+SYNC_OPTIONS = {
+    x: False
+    for x in ("skip_sync", "no_state_cache", "sync_only", "fixes_only", "push_only", "pull_only", "dry_run", "fan_out")
+}
+SYNC_OPTIONS.update(plan_file=None, metrics_dir=None)
+
+
+def benchmark(name, destructive=False):
+    """Register a benchmark function(context) returning the number of items it processed"""
+
+    def _register(func):
+        BENCHMARKS[name] = (func, destructive)
+        return func
+
+    return _register
+
+
+class StateRemote(BaseRemote):
+    """Remote that only has a state file, standing in for a Google remote without network access"""
+
+    def load_old_state(self, state_file):
+        with open(state_file) as infile:
+            return json.load(infile)
+
+
+@benchmark("startup")
+def _startup(ctx):
+    """Import of the CLI in a fresh interpreter, paid by every run from cron"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import photoriver2.main"], check=True)
+    ctx["elapsed"] = time.perf_counter() - start
+    return 1
+
+
+@benchmark("scan_photos")
+def _scan_photos(ctx):
+    return len(ctx["base"].get_photos())
+
+
+@benchmark("scan_albums")
+def _scan_albums(ctx):
+    return len(ctx["base"].get_albums())
+
+
+@benchmark("get_fixes")
+def _get_fixes(ctx):
+    return len(ctx["base"].get_fixes())
+
+
+@benchmark("merge_pull")
+def _merge_pull(ctx):
+    return len(ctx["base"].get_merge_updates(ctx["google"]))
+
+
+@benchmark("merge_push")
+def _merge_push(ctx):
+    return len(ctx["google"].get_merge_updates(ctx["base"]))
+
+
+@benchmark("state_save")
+def _state_save(ctx):
+    ctx["base"].saved_hash = None
+    ctx["base"].save_state()
+    return len(ctx["base"].state["photos"])
+
+
+@benchmark("state_load")
+def _state_load(ctx):
+    return len(ctx["base"].load_old_state(ctx["base"].state_file)["photos"])
+
+
+@benchmark("get_new_state")
+def _get_new_state(ctx):
+    return len(ctx["base"].get_new_state()["photos"])
+
+
+@benchmark("do_updates", destructive=True)
+def _do_updates(ctx):
+    mirror_folder = os.path.join(ctx["workdir"], "mirror")
+    shutil.rmtree(mirror_folder, ignore_errors=True)
+    os.makedirs(mirror_folder)
+    mirror = LocalRemote(mirror_folder, name="mirror", state_dir=ctx["workdir"])
+    updates = [x for x in mirror.get_merge_updates(ctx["base"]) if x.action == "new"][: ctx["transfers"]]
+    start = time.perf_counter()
+    mirror.do_updates(updates)
+    ctx["elapsed"] = time.perf_counter() - start
+    return len(updates)
+
+
+@benchmark("sync_memory")
+def _sync_memory(ctx):
+    """Whole sync run from a synthetic base to an empty memory remote, no disk or network involved"""
+    with tempfile.TemporaryDirectory() as state_dir:
+        remotes = {
+            "base": SyntheticRemote(
+                name="base", photos=ctx["photos"], albums=ctx["albums"], photo_size=1024, state_dir=state_dir
+            ),
+            "mirror": MemoryRemote(name="mirror", state_dir=state_dir),
+        }
+        start = time.perf_counter()
+        run_sync(remotes, argparse.Namespace(**SYNC_OPTIONS))
+        ctx["elapsed"] = time.perf_counter() - start
+    return len(remotes["mirror"].data)
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def prepare(workdir, photos, albums, album_size):
+    """Generate the synthetic library once per size, later runs reuse it"""
+    marker = os.path.join(workdir, f".synthetic-{photos}-{albums}-{album_size}")
+    base_folder = os.path.join(workdir, "base")
+    if not os.path.exists(marker):
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.makedirs(base_folder)
+        logger.info("Generating synthetic library of %s photos and %s albums in %s", photos, albums, workdir)
+        names = make_library(base_folder, photos=photos, albums=albums, album_size=album_size)
+        make_google_state(os.path.join(workdir, "google_state.json"), names)
+        with open(marker, "w"):
+            pass
+    return {
+        "workdir": workdir,
+        "base": LocalRemote(base_folder, name="base", state_dir=workdir),
+        "google": StateRemote(name="google", state_dir=workdir),
+    }
+
+
+def run(ctx, names, repeat):
+    results = {}
+    for name in names:
+        func, destructive = BENCHMARKS[name]
+        runs = []
+        for _ in range(1 if destructive else repeat):
+            ctx.pop("elapsed", None)
+            start = time.perf_counter()
+            items = func(ctx)
+            runs.append(ctx.get("elapsed", time.perf_counter() - start))
+        results[name] = {"seconds": min(runs), "runs": runs, "items": items}
+        logger.info("%-15s %10.3fs %10s items", name, min(runs), items)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Photoriver2 benchmarks")
+    parser.add_argument("--photos", type=int, default=10000, help="Photos in the synthetic library (10k/100k/1M)")
+    parser.add_argument("--albums", type=int, default=100, help="Albums in the synthetic library")
+    parser.add_argument("--album-size", type=int, default=50, help="Photos per album")
+    parser.add_argument("--transfers", type=int, default=1000, help="Photos copied in the do_updates benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each benchmark, the fastest one counts")
+    parser.add_argument("--workdir", help="Folder for the synthetic library, kept for reuse between runs")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "results"), help="Results folder")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run: {', '.join(BENCHMARKS)}")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Per-item logging would dominate the timings
+    logging.getLogger("photoriver2").setLevel(logging.WARNING)
+    options = parse_args()
+    workdir = options.workdir or os.path.join(tempfile.gettempdir(), "photoriver2-bench", str(options.photos))
+    ctx = prepare(workdir, options.photos, options.albums, options.album_size)
+    ctx["transfers"] = options.transfers
+    ctx["photos"] = options.photos
+    ctx["albums"] = options.albums
+    results = {
+        "commit": _commit(),
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "photos": options.photos,
+        "albums": options.albums,
+        "results": run(ctx, options.benchmarks or list(BENCHMARKS), options.repeat),
+    }
+    os.makedirs(options.output, exist_ok=True)
+    output = os.path.join(options.output, f"{results['commit']}-{options.photos}.json")
+    with open(output, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+    logger.info("Results written to %s", output)
+
+
+if __name__ == "__main__":
+    main()
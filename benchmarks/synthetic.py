@@ -0,0 +1,62 @@
+"""Generator of synthetic photo libraries for benchmarks"""
+import io
+import json
+import os
+import random
+
+from PIL import Image
+
+from photoriver2.remote_memory import photo_names
+
+TEMPLATE_DATE = b"2000:01:01 00:00:00"
+
+
+def _template():
+    """Tiny JPEG with an EXIF date that can be replaced in place"""
+    exif = Image.Exif()
+    exif[306] = TEMPLATE_DATE.decode("ascii")
+    data = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(data, "JPEG", exif=exif)
+    return data.getvalue()
+
+
+def make_library(folder, photos=1000, albums=10, album_size=20, seed=1, **kwargs):
+    """Create a local library with photos and albums of symlinks, returns the photo names"""
+    template = _template()
+    names = photo_names(photos, seed=seed, **kwargs)
+    made_dirs = set()
+    for name, date in names:
+        path = os.path.join(folder, name)
+        if os.path.dirname(path) not in made_dirs:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            made_dirs.add(os.path.dirname(path))
+        with open(path, "wb") as outfile:
+            outfile.write(template.replace(TEMPLATE_DATE, date.strftime("%Y:%m:%d %H:%M:%S").encode("ascii")))
+    rnd = random.Random(seed)
+    for i in range(albums):
+        album_path = os.path.join(folder, "albums", f"Album {i:04d}")
+        os.makedirs(album_path, exist_ok=True)
+        for name, _ in rnd.sample(names, min(album_size, len(names))):
+            link = os.path.join(album_path, os.path.basename(name))
+            if not os.path.lexists(link):
+                os.symlink(os.path.relpath(os.path.join(folder, name), album_path), link)
+    return [x[0] for x in names]
+
+
+def make_google_state(path, names, overlap=0.9, extra=0.1, seed=1):
+    """Write a Google remote state with a fraction of the given names plus some photos only in Google"""
+    rnd = random.Random(seed)
+    photos = []
+    for i, name in enumerate(names):
+        if rnd.random() < overlap:
+            photos.append({"name": name, "filename": os.path.basename(name), "id": f"id{i:07d}"})
+    for i in range(int(len(names) * extra)):
+        name = f"2021/01/01/GOOGLE_{i:07d}.jpg"
+        photos.append({"name": name, "filename": os.path.basename(name), "id": f"gid{i:07d}"})
+    for photo in photos:
+        photo["created"] = "2021-01-01T00:00:00Z"
+        photo["mime_type"] = "image/jpeg"
+    state = {"photos": sorted(photos, key=lambda x: x["name"]), "albums": []}
+    with open(path, "w") as outfile:
+        json.dump(state, outfile)
+    return state
@@ -0,0 +1,108 @@
+"""Bandwidth limits shared by all transfer threads, with time-of-day schedules"""
+import datetime
+import re
+import threading
+import time
+
+# Bytes that can be sent at once after an idle period
+BURST_SECONDS = 1
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+WINDOW = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(.*)$")
+
+
+def parse_rate(text):
+    """Bytes/s from a rate like 500K or 2M, None means unlimited"""
+    text = text.strip().upper().replace("/S", "").rstrip("B")
+    if text in ("", "0", "UNLIMITED"):
+        return None
+    unit = text[-1] if text[-1] in UNITS else ""
+    try:
+        rate = float(text[: len(text) - len(unit)]) * UNITS[unit]
+    except ValueError:
+        raise RuntimeError(f"Invalid bandwidth limit {text}") from None
+    return rate or None
+
+
+def parse_limit(spec):
+    """Parse a limit like "2M" or "08:00-23:00=1M,23:00-08:00=0", returns (default, [(start, end, rate)])
+
+    Times are minutes of the day in local time, a window ending before it starts continues past midnight.
+    """
+    default = None
+    windows = []
+    for entry in [x.strip() for x in (spec or "").split(",") if x.strip()]:
+        match = WINDOW.match(entry)
+        if not match:
+            default = parse_rate(entry)
+            continue
+        start_hour, start_minute, end_hour, end_minute, rate = match.groups()
+        windows.append(
+            (int(start_hour) * 60 + int(start_minute), int(end_hour) * 60 + int(end_minute), parse_rate(rate))
+        )
+    return default, windows
+
+
+class TokenBucket:
+    """Rate limit shared between threads, consumers wait until their bytes fit in the current rate"""
+
+    def __init__(self, limit=""):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_limit(limit)
+
+    def set_limit(self, limit):
+        self.limit = limit or ""
+        self.default, self.windows = parse_limit(limit)
+
+    def rate(self, now=None):
+        """Bytes/s allowed at the given time (now by default), None if not limited"""
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.windows:
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                return rate
+        return self.default
+
+    def consume(self, amount):
+        """Take amount bytes from the bucket, sleeping as long as needed to keep the rate"""
+        rate = self.rate()
+        if not rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(rate * BURST_SECONDS, self.tokens + (now - self.updated) * rate) - amount
+            self.updated = now
+            # Threads going into debt wait for it to be paid off, so the total rate is kept
+            wait = -self.tokens / rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottledReader:
+    """File-like wrapper that reads through a set of token buckets"""
+
+    def __init__(self, source, buckets, length=None):
+        self.source = source
+        self.buckets = [x for x in buckets if x is not None]
+        if length is not None:
+            # Lets requests send a Content-Length instead of a chunked body
+            self.len = length
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        for bucket in self.buckets:
+            bucket.consume(len(data))
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+# Global limits of network transfers per direction, configured in the [main] section
+LIMITS = {"download": TokenBucket(), "upload": TokenBucket()}
+
+
+def configure(options):
+    LIMITS["download"].set_limit(options.get("download_limit", ""))
+    LIMITS["upload"].set_limit(options.get("upload_limit", ""))
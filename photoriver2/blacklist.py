@@ -0,0 +1,68 @@
+"""Blacklist of paths excluded from a remote"""
+import fnmatch
+import re
+
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+class Blacklist:
+    """Compiled matcher for a comma separated list of path patterns
+
+    Patterns are matched against paths relative to the root of the remote, like "2019/01/01/IMG1.JPG". A path is
+    blacklisted if the pattern matches the path itself or any of its parent folders, so "201*" excludes everything
+    under 2010 to 2019. Plain paths go to a prefix trie of path components, patterns with wildcards are compiled
+    into one regular expression. Results for folders are cached, so that matching all photos of a large state
+    checks every folder only once.
+    """
+
+    def __init__(self, patterns=""):
+        if isinstance(patterns, str):
+            patterns = patterns.split(",")
+        patterns = [x.strip().strip("/") for x in patterns if x.strip().strip("/")]
+        self.patterns = patterns
+        self.trie = {}
+        for pattern in [x for x in patterns if not GLOB_CHARS.search(x)]:
+            node = self.trie
+            for part in pattern.split("/"):
+                node = node.setdefault(part, {})
+            node[None] = True
+        globs = [fnmatch.translate(x) for x in patterns if GLOB_CHARS.search(x)]
+        self.globs = re.compile("|".join(globs)) if globs else None
+        self.folders = {}
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def _in_trie(self, path):
+        node = self.trie
+        for part in path.split("/"):
+            node = node.get(part)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def _matches_self(self, path):
+        return self._in_trie(path) or bool(self.globs and self.globs.match(path))
+
+    def _folder_matches(self, folder):
+        if folder not in self.folders:
+            parent = folder.rpartition("/")[0]
+            self.folders[folder] = (bool(parent) and self._folder_matches(parent)) or self._matches_self(folder)
+        return self.folders[folder]
+
+    def matches(self, path):
+        """True if the path or any of its parent folders is blacklisted"""
+        if not self.patterns:
+            return False
+        path = path.strip("/")
+        folder = path.rpartition("/")[0]
+        return (bool(folder) and self._folder_matches(folder)) or self._matches_self(path)
+
+    def prune(self, dirs, relative_root):
+        """Remove blacklisted folders from the dirs list of os.walk in place, so they are never listed"""
+        if not self.patterns:
+            return
+        prefix = "" if relative_root in ("", ".") else relative_root.strip("/") + "/"
+        dirs[:] = [x for x in dirs if not self._folder_matches(prefix + x)]
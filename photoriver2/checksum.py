@@ -0,0 +1,35 @@
+"""Checksums of photo data, computed while the data passes through a transfer"""
+import hashlib
+
+ALGORITHM = "sha256"
+CHUNK_SIZE = 1024 * 1024
+
+
+def _format(digest):
+    return f"{ALGORITHM}:{digest.hexdigest()}"
+
+
+def copy_hashed(infile, outfile, chunk_size=CHUNK_SIZE):
+    """Copy a file-like object in chunks, returns (bytes copied, checksum of the data)"""
+    digest = hashlib.new(ALGORITHM)
+    size = 0
+    while True:
+        achunk = infile.read(chunk_size)
+        if not achunk:
+            break
+        digest.update(achunk)
+        outfile.write(achunk)
+        size += len(achunk)
+    return size, _format(digest)
+
+
+def data_checksum(data):
+    return _format(hashlib.new(ALGORITHM, data))
+
+
+def file_checksum(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.new(ALGORITHM)
+    with open(path, "rb") as infile:
+        for achunk in iter(lambda: infile.read(chunk_size), b""):
+            digest.update(achunk)
+    return _format(digest)
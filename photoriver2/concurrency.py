@@ -0,0 +1,101 @@
+"""Adaptive number of concurrent transfers, tuned by measured throughput and errors"""
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds of transfers measured before the number of workers is changed
+INTERVAL = 5
+# Fraction of failed or throttled transfers in an interval that halves the number of workers
+ERROR_RATIO = 0.05
+# Throughput changes smaller than this are noise
+TOLERANCE = 0.05
+
+
+class ConcurrencyController:
+    """Limits concurrent transfers to a level that is adjusted while they run
+
+    Errors and throttling (like HTTP 429 or quota errors) halve the level. Otherwise the level climbs a step at
+    a time in the direction that improved throughput in the last interval, and turns back when throughput drops,
+    so it settles around the best level between min_workers and max_workers.
+    """
+
+    def __init__(self, name, min_workers=1, max_workers=10, workers=5, interval=INTERVAL):
+        if min_workers < 1 or max_workers < min_workers:
+            raise RuntimeError(f"Remote {name}: invalid worker bounds {min_workers}-{max_workers}")
+        self.name = name
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.limit = min(max(workers, min_workers), max_workers)
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.active = 0
+        self.direction = 1
+        self.previous_rate = None
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self.window_start = now
+        self.window_bytes = 0
+        self.window_items = 0
+        self.window_errors = 0
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the allowed concurrent transfers, errors raised inside count against the level"""
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        try:
+            yield
+        except Exception:
+            self.record(error=True)
+            raise
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+    def record(self, size=0, error=False):
+        """Account a finished transfer, or an error or throttling response"""
+        with self.condition:
+            self.window_items += 1
+            self.window_bytes += size or 0
+            self.window_errors += 1 if error else 0
+            now = time.monotonic()
+            if now - self.window_start >= self.interval:
+                self._adjust(now)
+
+    def throttled(self):
+        self.record(error=True)
+
+    def _adjust(self, now):
+        rate = self.window_bytes / (now - self.window_start)
+        limit = self.limit
+        if self.window_errors > ERROR_RATIO * self.window_items:
+            limit = limit // 2
+            self.direction = 1
+            # Throughput after backing off is not comparable
+            rate = None
+        elif self.previous_rate is None or rate > self.previous_rate * (1 + TOLERANCE):
+            limit += self.direction
+        elif rate < self.previous_rate * (1 - TOLERANCE):
+            self.direction = -self.direction
+            limit += self.direction
+        limit = min(max(limit, self.min_workers), self.max_workers)
+        if limit != self.limit:
+            logger.info(
+                "Remote %s: %.1f MiB/s with %s workers, %s errors, using %s workers",
+                self.name,
+                self.window_bytes / (now - self.window_start) / 2 ** 20,
+                self.limit,
+                self.window_errors,
+                limit,
+            )
+            self.limit = limit
+            self.condition.notify_all()
+        self.previous_rate = rate
+        self._reset_window(now)
@@ -1,10 +1,96 @@
 """Parses config file and initializes all configured remotes"""
 
 import configparser
+import importlib
 import os
 
-from photoriver2.remote_local import LocalRemote
-from photoriver2.remote_google import GoogleRemote, DataExpired
+from photoriver2.bandwidth import UNITS, parse_limit
+from photoriver2.remote_base import STATE_BACKENDS
+from photoriver2.scheduler import POLICIES
+
+
+def _size(text):
+    """Bytes from a size like 512K or 4M"""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1] if text and text[-1] in UNITS else ""
+    size = int(float(text[: len(text) - len(unit)]) * UNITS[unit])
+    if size <= 0:
+        raise ValueError("must be positive")
+    return size
+
+
+def _int(minimum, maximum=None):
+    def _convert(text):
+        value = int(text)
+        if value < minimum or (maximum is not None and value > maximum):
+            raise ValueError(f"must be between {minimum} and {maximum}" if maximum else f"must be at least {minimum}")
+        return value
+
+    return _convert
+
+
+def _choice(*choices):
+    def _convert(text):
+        if text not in choices:
+            raise ValueError(f"use one of {', '.join(choices)}")
+        return text
+
+    return _convert
+
+
+def _limit(text):
+    parse_limit(text)
+    return text
+
+
+# Options of all remotes with a converter that validates them, unset options keep the defaults of the remote class
+COMMON_OPTIONS = {
+    "blacklist": str,
+    "schedule": _choice(*POLICIES),
+    "bandwidth_limit": _limit,
+    "workers": _int(1),
+    "min_workers": _int(1),
+    "max_workers": _int(1),
+    "large_workers": _int(0),
+    "large_size": _size,
+    "state_backend": _choice(*STATE_BACKENDS),
+}
+
+# Remote classes by the type of the remote in the config with their own options and the required ones among them,
+# a module is only imported when a remote of its type is used
+REMOTE_TYPES = {
+    "local": (
+        "photoriver2.remote_local.LocalRemote",
+        {"folder": str, "chunk_size": _size, "scan_workers": _int(1)},
+        ("folder",),
+    ),
+    "google": (
+        "photoriver2.remote_google.GoogleRemote",
+        {
+            "token_cache": str,
+            "api_url": str,
+            "token_uri": str,
+            "page_size": _int(1, 100),
+            "album_page_size": _int(1, 50),
+        },
+        ("token_cache",),
+    ),
+    "peer": ("photoriver2.remote_peer.PeerRemote", {"url": str, "timeout": _int(1)}, ("url",)),
+    "memory": ("photoriver2.remote_memory.MemoryRemote", {}, ()),
+    "synthetic": (
+        "photoriver2.remote_memory.SyntheticRemote",
+        {"photos": _int(0), "albums": _int(0), "album_size": _int(0), "photo_size": _size, "seed": _int(0)},
+        (),
+    ),
+}
+
+
+def _option_value(value):
+    if value.lower() in ("true", "yes", "on"):
+        return True
+    if value.lower() in ("false", "no", "off"):
+        return False
+    return value
 
 
 def parse_config(config_path="/river/config", config_text=None):
@@ -14,27 +100,56 @@ def parse_config(config_path="/river/config", config_text=None):
     config = configparser.ConfigParser()
     config.read_string(config_text)
 
-    config_data = {"remotes": {}, "config_path": config_path}
+    config_data = {"options": {}, "remotes": {}, "config_path": config_path}
     for section in config.sections():
+        if section == "main":
+            config_data["options"] = {x: _option_value(y) for x, y in config.items(section=section)}
+            continue
         config_data["remotes"][section] = dict(config.items(section=section))
     if not "base" in config_data["remotes"]:
         raise RuntimeError("Configuration must contain a local remote called 'base'")
     return config_data
 
 
+def remote_class(remote_type):
+    if remote_type not in REMOTE_TYPES:
+        raise RuntimeError(f"Unknown remote type {remote_type}, use one of {', '.join(REMOTE_TYPES)}")
+    module, _, name = REMOTE_TYPES[remote_type][0].rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+def remote_options(name, options):
+    """Validated keyword arguments for the remote class from the config section of a remote"""
+    if "type" not in options:
+        raise RuntimeError(f"Remote {name}: missing type")
+    if options["type"] not in REMOTE_TYPES:
+        raise RuntimeError(f"Remote {name}: unknown type {options['type']}, use one of {', '.join(REMOTE_TYPES)}")
+    _, own_options, required = REMOTE_TYPES[options["type"]]
+    known = dict(COMMON_OPTIONS, **own_options)
+    missing = [x for x in required if x not in options]
+    if missing:
+        raise RuntimeError(f"Remote {name}: missing {', '.join(missing)}")
+    kwargs = {}
+    for key, value in options.items():
+        if key == "type":
+            continue
+        if key not in known:
+            raise RuntimeError(f"Remote {name}: unknown option {key} for a {options['type']} remote")
+        try:
+            kwargs[key] = known[key](value)
+        except (ValueError, RuntimeError) as error:
+            raise RuntimeError(f"Remote {name}: invalid {key} {value}: {error}") from None
+    if kwargs.get("min_workers", 1) > kwargs.get("max_workers", 10):
+        raise RuntimeError(f"Remote {name}: min_workers is larger than max_workers")
+    return kwargs
+
+
 def init_remotes(config_data):
     remotes = {}
-    for name in config_data["remotes"]:
-        if config_data["remotes"][name]["type"] == "local":
-            remotes[name] = LocalRemote(
-                name=name,
-                folder=config_data["remotes"][name]["folder"],
-                blacklist=config_data["remotes"][name].get("blacklist", ""),
-            )
-        if config_data["remotes"][name]["type"] == "google":
-            remotes[name] = GoogleRemote(
-                name=name,
-                token_cache=os.path.join(config_data["config_path"], config_data["remotes"][name]["token_cache"]),
-                blacklist=config_data["remotes"][name].get("blacklist", ""),
-            )
+    config_path = config_data.get("config_path", "/river/config")
+    for name, options in config_data["remotes"].items():
+        kwargs = remote_options(name, options)
+        if "token_cache" in kwargs:
+            kwargs["token_cache"] = os.path.join(config_path, kwargs["token_cache"])
+        remotes[name] = remote_class(options["type"])(name=name, state_dir=config_path, **kwargs)
     return remotes
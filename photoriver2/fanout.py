@@ -0,0 +1,139 @@
+"""Fan-out push - read each base photo once and stream it to all remotes that need it"""
+import concurrent.futures
+import logging
+import queue
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class TeeReader:
+    """File-like object that reads chunks fed by a Tee"""
+
+    def __init__(self, depth):
+        self.queue = queue.Queue(maxsize=depth)
+        self.buffer = b""
+        self.eof = False
+        self.closed = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            achunk = self.queue.get()
+            if isinstance(achunk, Exception):
+                raise achunk
+            if not achunk:
+                self.eof = True
+            self.buffer += achunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        """Stop reading - the Tee will not wait for this reader any more"""
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+class Tee:
+    """Split one source file-like object into several readers"""
+
+    def __init__(self, source, count, chunk_size=CHUNK_SIZE, depth=8):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.readers = [TeeReader(depth) for _ in range(count)]
+
+    def _feed(self, achunk):
+        for reader in self.readers:
+            if not reader.closed:
+                reader.queue.put(achunk)
+
+    def pump(self):
+        """Read the source to the end, feeding all readers that are still open"""
+        try:
+            while any(not x.closed for x in self.readers):
+                achunk = self.source.read(self.chunk_size)
+                self._feed(achunk)
+                if not achunk:
+                    break
+        except (OSError, IOError) as error:
+            self._feed(error)
+            raise
+        finally:
+            self.source.close()
+
+
+def _push_one(targets):
+    """Push a single photo to all (remote, update) targets reading the source once, returns errors by id(update)"""
+    if len(targets) == 1:
+        remote, update = targets[0]
+        try:
+            remote.put_data(update)
+        except Exception as error:  # pylint: disable=broad-except
+            return {id(update): error}
+        return {}
+
+    def _consume(remote, update):
+        try:
+            remote.put_data(update)
+        finally:
+            update.stream.close()
+
+    try:
+        tee = Tee(targets[0][1].data(), len(targets))
+    except Exception as error:  # pylint: disable=broad-except
+        return {id(x): error for _, x in targets}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        for (remote, update), reader in zip(targets, tee.readers):
+            update.stream = reader
+        futures = {id(update): executor.submit(_consume, remote, update) for remote, update in targets}
+        try:
+            tee.pump()
+        except (OSError, IOError):
+            # Readers got the error too, it is a result of each of their futures
+            pass
+    return {x: y.exception() for x, y in futures.items() if y.exception()}
+
+
+def fan_out_push(base, remotes):
+    """Push new photos from base to all remotes at once, returns merges per remote
+
+    Photos are read from base once for all remotes, so the base scheduler orders them and runs them in its lanes.
+    Transfers that fail are retried by the scheduler of their remote, with its retry queue.
+    """
+    merges = {}
+    wanted = {}
+    remotes = {x: y for x, y in remotes.items() if not y.read_only}
+    for name, remote in remotes.items():
+        logger.info("Finding push merges for %s", name)
+        merges[name] = remote.get_merge_updates(base)
+        for update in merges[name]:
+            if update.action == "new" and remote.retry.allowed(update):
+                wanted.setdefault(update.name, []).append((remote, update))
+    logger.info("Pushing %s photos from base to %s remotes", len(wanted), len(remotes))
+    # One update per photo stands for all of its targets in the scheduler
+    targets = {id(x[0][1]): x for x in wanted.values()}
+    errors = {}
+
+    def _push(update):
+        errors.update(_push_one(targets[id(update)]))
+
+    base.scheduler.run(_push, [x[0][1] for x in wanted.values()])
+    for name, remote in remotes.items():
+        pushed = [y for x in wanted.values() for r, y in x if r is remote]
+        for update in pushed:
+            if id(update) not in errors:
+                remote.retry.succeeded(update)
+        failed = [x for x in pushed if id(x) in errors]
+        if failed:
+            logger.warning("Remote %s: %s photos failed in the fan-out push, retrying them", name, len(failed))
+            for update in failed:
+                update.stream = None
+            remote.scheduler.run(remote.put_data, failed, retry=remote.retry)
+        remote.retry.save()
+        remote.commit_data()
+        logger.info("Applying album push merges to %s from base", name)
+        remote.do_updates([x for x in merges[name] if x.action != "new"])
+    return merges
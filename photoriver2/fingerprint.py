@@ -0,0 +1,79 @@
+"""Content fingerprints of photo files, used to recognise moved photos"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bytes hashed from the start and from the end of a file
+PARTIAL_SIZE = 64 * 1024
+
+
+def fingerprint(path):
+    """Size and a hash of the head and tail of a file - cheap to compute and unique enough for photos"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, "rb") as infile:
+        digest.update(infile.read(PARTIAL_SIZE))
+        if size > PARTIAL_SIZE:
+            infile.seek(max(PARTIAL_SIZE, size - PARTIAL_SIZE))
+            digest.update(infile.read(PARTIAL_SIZE))
+    return f"{size}:{digest.hexdigest()}"
+
+
+class FingerprintIndex:
+    """Fingerprints of files by name, cached in a JSON file and recomputed only when size or mtime change"""
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        self.changed = False
+        self.entries = {}
+        if os.path.exists(index_file):
+            try:
+                with open(index_file) as infile:
+                    self.entries = json.load(infile)
+            except json.JSONDecodeError:
+                logger.warning("Fingerprint index %s is damaged, starting a new one", index_file)
+
+    def get(self, name, path):
+        """Fingerprint of the file at path, known under name"""
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+        value = fingerprint(path)
+        with self.lock:
+            self.entries[name] = [stat.st_mtime_ns, stat.st_size, value]
+            self.changed = True
+        return value
+
+    def cached(self, name):
+        """Last known fingerprint of a name, also for files that are gone by now"""
+        with self.lock:
+            entry = self.entries.get(name)
+        return entry[2] if entry else None
+
+    def move(self, old_name, new_name):
+        with self.lock:
+            if old_name in self.entries:
+                self.entries[new_name] = self.entries.pop(old_name)
+                self.changed = True
+
+    def forget(self, names):
+        with self.lock:
+            for name in names:
+                if self.entries.pop(name, None):
+                    self.changed = True
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            with open(self.index_file + ".tmp", "w") as outfile:
+                json.dump(self.entries, outfile, separators=(",", ":"))
+            os.replace(self.index_file + ".tmp", self.index_file)
+            self.changed = False
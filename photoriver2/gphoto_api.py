@@ -1,15 +1,19 @@
 """Google Photo API abstraction module"""
-import concurrent.futures
+import io
 import json
 import logging
 import os.path
+import threading
 import time
 
 from io import open
-from datetime import date, datetime, timedelta
+from datetime import date
 
 import requests
 
+from photoriver2.bandwidth import LIMITS, ThrottledReader
+from photoriver2.metrics import METRICS
+
 logger = logging.getLogger(__name__)
 
 AUTH_URL = "https://accounts.google.com/o/oauth2/auth"
@@ -18,9 +22,13 @@ CLIENT_SECRET = "jMX0btH5hLlfJgxXF6-bUgf6"
 REDIRECT_URI = "urn:ietf:wg:oauth:2.0:oob"
 TOKEN_URI = "https://accounts.google.com/o/oauth2/token"
 
-URL_PHOTOS = "https://photoslibrary.googleapis.com/v1/mediaItems:search"
-URL_ALBUMS = "https://photoslibrary.googleapis.com/v1/albums"
+API_URL = "https://photoslibrary.googleapis.com/v1"
+URL_MEDIA = API_URL + "/mediaItems"
+URL_PHOTOS = URL_MEDIA + ":search"
+URL_ALBUMS = API_URL + "/albums"
 AUTH_SCOPE = "https://www.googleapis.com/auth/photoslibrary"
+# Access tokens are valid for an hour, refresh them a bit earlier
+TOKEN_TTL = 50 * 60
 
 
 def chunk(alist, size):
@@ -35,12 +43,36 @@ def chunk(alist, size):
                 return
         yield achunk
 
+
 class GPhoto:
     """Implement the Google Photo Library API"""
 
-    def __init__(self, token_cache=".cache"):
+    # Base wait in seconds before retrying an upload after hitting the quota
+    quota_wait = 60
+    # Token bucket of this remote, shared with the global limits of each direction
+    bandwidth = None
+    # Adaptive limit of concurrent transfers, told about throttling responses
+    concurrency = None
+
+    def __init__(
+        self,
+        token_cache=".cache",
+        name="google",
+        api_url=API_URL,
+        token_uri=TOKEN_URI,
+        page_size=100,
+        album_page_size=50,
+    ):
+        self.name = name
+        self.api_url = api_url
+        self.token_uri = token_uri
+        # Items per listing request, the API allows at most 100 photos and 50 albums
+        self.page_size = page_size
+        self.album_page_size = album_page_size
         self.token_cache = token_cache
         self.token = None
+        self.token_time = time.monotonic()
+        self.token_lock = threading.Lock()
         self.refresh_token = None
 
         logger.debug("Using token cache: %s", token_cache)
@@ -49,7 +81,7 @@ class GPhoto:
             url = f"{AUTH_URL}?client_id={CLIENT_ID}&redirect_uri={REDIRECT_URI}&scope={AUTH_SCOPE}&response_type=code"
             code = input(f"URL: {url}\nPaste authorization code: ")
             token_json = requests.post(
-                TOKEN_URI,
+                self.token_uri,
                 data={
                     "code": code,
                     "client_id": CLIENT_ID,
@@ -61,14 +93,23 @@ class GPhoto:
             self.token = token_json["access_token"]
             self.refresh_token = token_json["refresh_token"]
             self._write_refresh_token()
-        self.headers = {"Authorization": f"Bearer {self.token}"}
+
+    @property
+    def headers(self):
+        """Authorization headers, with the access token refreshed when it is about to expire"""
+        with self.token_lock:
+            if time.monotonic() - self.token_time > TOKEN_TTL:
+                logger.info("Access token is about to expire, refreshing")
+                if not self._refresh_token():
+                    raise RuntimeError("Could not refresh Google access token")
+        return {"Authorization": f"Bearer {self.token}"}
 
     def _refresh_token(self):
         self._read_refresh_token()
         if not self.refresh_token:
             return False
         token_response = requests.post(
-            TOKEN_URI,
+            self.token_uri,
             data={
                 "refresh_token": self.refresh_token,
                 "client_id": CLIENT_ID,
@@ -81,6 +122,7 @@ class GPhoto:
             logger.warning("Refresh token in the cache not accepted by Google")
             return False
         self.token = token_json["access_token"]
+        self.token_time = time.monotonic()
         return True
 
     def _read_refresh_token(self):
@@ -109,7 +151,7 @@ class GPhoto:
 
     def _extract_albums(self, data):
         albums = []
-        logger.info("Received data about %i albums", len(data.get("albums", [])))
+        logger.debug("Received data about %i albums", len(data.get("albums", [])))
         for entry in data.get("albums", []):
             logger.debug("Processing: %s", entry)
             album = {}
@@ -122,13 +164,13 @@ class GPhoto:
 
     def get_albums(self):
         logger.info("Retrieving album list")
-        payload = {"pageSize": 50}
+        payload = {"pageSize": self.album_page_size}
 
-        data = self._load_new_data(URL_ALBUMS, "get", payload)
+        data = self._load_new_data(self.api_url + "/albums", "get", payload)
         albums = self._extract_albums(data)
         while "nextPageToken" in data:
             payload["page_token"] = data["nextPageToken"]
-            data = self._load_new_data(URL_ALBUMS, "get", payload)
+            data = self._load_new_data(self.api_url + "/albums", "get", payload)
             albums.extend(self._extract_albums(data))
 
         logger.info(
@@ -139,6 +181,7 @@ class GPhoto:
         return albums
 
     def _load_new_data(self, url, method, payload):
+        METRICS.add(self.name, "api_calls")
         if method == "get":
             response = requests.get(url, params=payload, headers=self.headers)
         elif method == "post":
@@ -149,29 +192,31 @@ class GPhoto:
         feed = response.text.encode("utf8")
         return json.loads(feed)
 
-    def _extract_photos(self, data):
+    @staticmethod
+    def _extract_photos(data, with_url=False):
+        """Keep only the fields sync needs - the short-lived baseUrl is only kept on request"""
         logger.debug("Received %i items", len(data.get("mediaItems", [])))
         photos = []
         for entry in data.get("mediaItems", []):
             if not entry.get("mediaType", "image/jpeg").startswith("image"):
                 continue
             logger.debug("Processing: %s", entry)
-            photos.append(
-                {
-                    "filename": entry["filename"],
-                    "id": entry["id"],
-                    "description": entry.get("description", entry["filename"]),
-                    "raw": entry,
-                    "modified": datetime.now().isoformat(),
-                }
-            )
+            photo = {
+                "id": entry["id"],
+                "filename": entry["filename"],
+                "created": entry.get("mediaMetadata", {}).get("creationTime"),
+                "mime_type": entry.get("mimeType"),
+            }
+            if with_url:
+                photo["base_url"] = entry["baseUrl"]
+            photos.append(photo)
         return photos
 
     def get_photos(self, album_id=None, start_date=None, end_date=None, archived=False):
-        logger.info("Retrieving photos for album %s or time %s-%s", album_id, start_date, end_date)
-        payload = {"pageSize": "100"}
+        logger.debug("Retrieving photos for album %s or time %s-%s", album_id, start_date, end_date)
+        payload = {"pageSize": str(self.page_size)}
         method = "post"
-        url = URL_PHOTOS
+        url = self.api_url + "/mediaItems:search"
         if album_id:
             payload["albumId"] = album_id
         elif start_date:
@@ -200,100 +245,103 @@ class GPhoto:
             data = self._load_new_data(url, method, payload)
             photos = self._extract_photos(data)
             total_count += len(photos)
-            logger.info("Total photos now retrieved: %s", total_count)
+            logger.debug("Total photos now retrieved: %s", total_count)
             yield from photos
 
-        logger.info(
-            "Retrieving photos - done: found %i photos",
-            total_count,
+        logger.debug("Retrieving photos - done: found %i photos", total_count)
+
+    def get_photos_by_id(self, ids):
+        """Return fresh data (with baseUrl) for up to 50 media items, skipping items that no longer exist"""
+        if not ids:
+            return []
+        METRICS.add(self.name, "api_calls")
+        response = requests.get(
+            self.api_url + "/mediaItems:batchGet", params={"mediaItemIds": list(ids)}, headers=self.headers
+        )
+        response.raise_for_status()
+        results = json.loads(response.text.encode("utf8")).get("mediaItemResults", [])
+        return self._extract_photos(
+            {"mediaItems": [x["mediaItem"] for x in results if "mediaItem" in x]}, with_url=True
         )
 
+    def get_photo(self, photo_id):
+        """Return fresh data (with baseUrl) for a single media item"""
+        METRICS.add(self.name, "api_calls")
+        response = requests.get(self.api_url + "/mediaItems/" + photo_id, headers=self.headers)
+        response.raise_for_status()
+        feed = response.text.encode("utf8")
+        return self._extract_photos({"mediaItems": [json.loads(feed)]}, with_url=True)[0]
+
     def read_photo(self, photo):
         """Return a file-like object that can be read() to get photo file data"""
-        if datetime.now() - datetime.fromisoformat(photo.get("modified", datetime.fromtimestamp(0).isoformat())) > timedelta(minutes=59):
-            logger.warning("Media URL expired, refreshing")
-            response = requests.get(URL_PHOTOS + "/" + photo["id"], headers=self.headers)
-            response.raise_for_status()
-            feed = response.text.encode("utf8")
-            photo = json.loads(feed)
-        response = requests.get(photo["raw"]["baseUrl"] + "=d", headers=self.headers, stream=True)
+        if "base_url" not in photo:
+            logger.debug("No media URL for %s, fetching", photo["id"])
+            photo = self.get_photo(photo["id"])
+        METRICS.add(self.name, "api_calls")
+        response = requests.get(photo["base_url"] + "=d", headers=self.headers, stream=True)
         if response.status_code != 200:
+            self._throttled()
             time.sleep(1)
-            response = requests.get(photo["raw"]["baseUrl"] + "=d", headers=self.headers, stream=True)
+            METRICS.add(self.name, "retries")
+            response = requests.get(photo["base_url"] + "=d", headers=self.headers, stream=True)
             if response.status_code != 200:
                 time.sleep(1)
-                response = requests.get(photo["raw"]["baseUrl"] + "=d", headers=self.headers, stream=True)
+                METRICS.add(self.name, "retries")
+                response = requests.get(photo["base_url"] + "=d", headers=self.headers, stream=True)
         response.raise_for_status()
-        return response.raw
-
-    def download_photo(self, photo, filename):
-        logger.info("Starting download of photo to %s", filename)
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, "wb") as outfile:
-            outfile.write(self.read_photo(photo).read())
-        logger.info("Done with download of photo to %s", filename)
-
-    def batch_downloads(self, filenames_and_photos):
-        """Given a list of (photo, filename) downloads the photos as a batch"""
-        logger.info("Starting batch download of %s images", len(filenames_and_photos))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            upload_tokens = list(executor.map(self.download_photo, filenames_and_photos))
-        logger.info("Batch download completed")
+        return ThrottledReader(response.raw, [LIMITS["download"], self.bandwidth])
+
+    def _throttled(self):
+        if self.concurrency:
+            self.concurrency.throttled()
 
     def create_album(self, title):
-        response = requests.post(URL_ALBUMS, data=json.dumps({"album": {"title": title}}))
+        METRICS.add(self.name, "api_calls")
+        response = requests.post(self.api_url + "/albums", json={"album": {"title": title}}, headers=self.headers)
         response.raise_for_status()
         feed = response.text.encode("utf8")
         return json.loads(feed)
 
     def add_to_album(self, album_id, media_items):
         data = {"mediaItemIds": list(media_items)}
-        response = requests.post(URL_ALBUMS + "/" + album_id + ":batchAddMediaItems", data=json.dumps(data))
+        METRICS.add(self.name, "api_calls")
+        response = requests.post(
+            self.api_url + "/albums/" + album_id + ":batchAddMediaItems", json=data, headers=self.headers
+        )
         response.raise_for_status()
         feed = response.text.encode("utf8")
         return json.loads(feed)
 
-    def batch_upload(self, filenames, album_id=None):
-        logger.info("Starting batch upload of %s images to album %s", len(filenames), album_id)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            upload_futures = [executor.submit(self.upload_media, x) for x in filenames]
-            logger.info("All upload tasks submitted, waiting for processing")
-            results = []
-            errors = []
-            for i, achunk in enumerate(chunk(concurrent.futures.as_completed(upload_futures), 50)):
-                logger.info("Creating media from uploaded data: %s-%s/%s", i * 50, i * 50 + len(achunk), len(filenames))
-                errors.extend([x.exception() for x in achunk if x.exception()])
-                achunk = [x.result() for x in achunk if not x.exception()]
-                logger.info("Creating media with %s successful uploads (errors %s until now)", len(achunk), len(errors))
-                if achunk:
-                    results.extend(self.create_media(achunk, album_id))
-                logger.info("Creating media from uploaded data: %s-%s/%s - done", i * 50, i * 50 + len(achunk), len(filenames))
-        logger.info("Batch upload completed")
-        if errors:
-            logger.warning("Upload errors detected: (%s) %s", len(errors), errors)
-        return results
-
-    def upload_media(self, filename, delay=1):
+    def upload_media(self, filename, delay=1, data=None):
         """Do the media upload step of adding a photo to GPhoto Library - returns a token for batch media creation"""
-        logger.info("Uploading file %s starting", filename)
+        logger.debug("Uploading file %s starting", filename)
         headers = {
             "Content-type": "application/octet-stream",
             "X-Goog-Upload-Content-Type": "image/jpeg",  # TODO: set correct content type for non-JPEG
             "X-Goog-Upload-Protocol": "raw",
         }
         headers.update(self.headers)
-        with open(filename, "rb") as infile:
-            response = requests.post(
-                "https://photoslibrary.googleapis.com/v1/uploads", headers=headers, data=infile.read()
-            )
+        if data is None:
+            with open(filename, "rb") as infile:
+                data = infile.read()
+        METRICS.add(self.name, "api_calls")
+        response = requests.post(
+            self.api_url + "/uploads",
+            headers=headers,
+            data=ThrottledReader(io.BytesIO(data), [LIMITS["upload"], self.bandwidth], len(data)),
+        )
         if response.status_code != requests.codes.ok:
             logger.error("Uploading file %s failed: %s", filename, response.text)
             if "Quota exceeded" in response.text:
                 logger.warning("Upload quota exceeded, waiting for %s minute(s) before re-try", delay)
-                time.sleep(60 * delay)
-                return self.upload_media(filename, delay*2)
+                METRICS.add(self.name, "retries")
+                self._throttled()
+                time.sleep(self.quota_wait * delay)
+                return self.upload_media(filename, delay * 2, data)
         response.raise_for_status()
-        logger.info("Uploading file %s done", filename)
+        METRICS.add(self.name, "items")
+        METRICS.add(self.name, "bytes", len(data))
+        logger.debug("Uploading file %s done", filename)
         return (filename, response.text)
 
     def create_media(self, data_items, album_id=None):
@@ -312,11 +360,10 @@ class GPhoto:
                     }
                 }
             )
-        response = requests.post(
-            "https://photoslibrary.googleapis.com/v1/mediaItems:batchCreate", json=data, headers=self.headers
-        )
+        METRICS.add(self.name, "api_calls")
+        response = requests.post(self.api_url + "/mediaItems:batchCreate", json=data, headers=self.headers)
         if response.status_code == 207:
-            for item in response.json.get("newMediaItemResults", []):
+            for item in response.json().get("newMediaItemResults", []):
                 if item.get("status", {}).get("message", "Failed") != "Success":
                     logger.error("Problem with upload: %s", item)
                     bad_items = [x[0] for x in data_items if x[1] == item.get("uploadToken", "xxx")]
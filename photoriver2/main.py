@@ -1,18 +1,55 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import contextlib
 import logging
 import os
+import signal
+import threading
+import time
 
 from pprint import pprint
 
-from photoriver2.config import parse_config, init_remotes, DataExpired
+from photoriver2 import bandwidth
+from photoriver2.config import parse_config, init_remotes
+from photoriver2.fanout import fan_out_push
+from photoriver2.metrics import METRICS
+from photoriver2.pipeline import bounded
+from photoriver2.profiling import PROFILER
+from photoriver2.progress import PROGRESS
+from photoriver2.plan import PlanInvalid, build_plan, check_plan, execute_plan, load_plan, print_plan, save_plan
 
 logger = logging.getLogger("photoriver2")
 
 
+@contextlib.contextmanager
+def phase(name, remote="all"):
+    """Collect metrics and, with --profile, CPU and memory profiles of a sync phase"""
+    try:
+        with METRICS.phase(name, remote), PROFILER.phase(name, remote):
+            yield
+    finally:
+        PROGRESS.finish(name)
+
+
+def count_actions(updates, remote, name, key=lambda x: x.action):
+    """Count updates or fixes by action for the summary table and log the counts"""
+    for update in updates:
+        PROGRESS.count(remote, name, key(update))
+    log_actions(remote, name)
+
+
+def log_actions(remote, name):
+    counts = ", ".join(f"{y} {x}" for x, y in sorted(PROGRESS.actions.get((remote, name), {}).items()))
+    logger.info("Remote %s %s: %s", remote, name, counts or "nothing to do")
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Photoriver2 photo sync program")
 
+    parser.add_argument(
+        "--config", help="Folder with photoriver2.ini and state files, instead of the default locations"
+    )
     parser.add_argument("--dry-run", action="store_true", help="Do not do any photo changs, print actions to be taken")
     parser.add_argument("--init-only", action="store_true", help="Stop after connecting to all remotes")
     parser.add_argument("--sync-only", action="store_true", help="Stop after fetching new state from all remotes")
@@ -21,87 +58,314 @@ def parse_args():
     parser.add_argument("--no-state-cache", action="store_true", help="Ignore cached state from all remotes")
     parser.add_argument("--pull-only", action="store_true", help="Only pull missing photos from other remotes to base")
     parser.add_argument("--push-only", action="store_true", help="Only push missing photos to other remotes from base")
+    parser.add_argument(
+        "--fan-out", action="store_true", help="Push to all remotes at once, reading each base photo once"
+    )
+    parser.add_argument("--plan-file", help="With --dry-run: save the planned actions to this file")
+    parser.add_argument("--execute-plan", help="Execute actions from a plan file saved by --dry-run --plan-file")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and sync every --interval minutes")
+    parser.add_argument("--interval", type=float, default=60, help="Minutes between sync runs in --daemon mode")
+    parser.add_argument(
+        "--watch", action="store_true", help="Like --daemon, also push new photos in base as they appear"
+    )
+    parser.add_argument(
+        "--quiet-period", type=float, default=30, help="Seconds without changes in base before a --watch push"
+    )
+    parser.add_argument("--metrics-dir", help="Write Prometheus textfile and JSON metrics of each run to this folder")
+    parser.add_argument(
+        "--profile", help="Write CPU profiles, allocation sites and peak memory of each phase to this folder"
+    )
+    parser.add_argument(
+        "--verify", action="store_true", help="Check photos against checksums recorded during transfers"
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="Serve the base remote to peer nodes, for --daemon or --watch. Without HOST only this machine connects",
+    )
+    parser.add_argument("--retry-dead", action="store_true", help="Try again transfers that failed too often before")
+    parser.add_argument("--rate", type=float, default=10, help="Expected transfer rate in MiB/s for plan estimates")
 
     return parser.parse_args()
 
 
-def main():
-    logging.basicConfig(level=logging.INFO)
-    options = parse_args()
-    logger.info("Parsing config")
-    if os.path.exists("/river/config"):
-        config_path = "/river/config"
-    elif os.path.exists(os.path.expanduser("~/.config/photoriver2")):
-        config_path = os.path.expanduser("~/.config/photoriver2")
-    config_data = parse_config(config_path)
-    logger.info("Starting all remotes")
-    remotes = init_remotes(config_data)
-    if options.init_only:
-        logger.info("Init complete - exiting")
+def refresh_states(remotes, names=None, no_state_cache=False):
+    """Get new state of remotes in parallel, returns a dict of remotes that failed with their errors"""
+    names = list(remotes if names is None else names)
+
+    def _refresh(name):
+        start = time.monotonic()
+        with METRICS.phase("state", name):
+            state = remotes[name].get_new_state(no_state_cache=no_state_cache)
+            METRICS.add(name, "items", len(state["photos"]))
+        return time.monotonic() - start
+
+    failed = {}
+    if not names:
+        return failed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as executor:
+        futures = {executor.submit(_refresh, x): x for x in names}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                logger.info("Getting new state for remote %s - done in %.1fs", name, future.result())
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("Getting new state for remote %s failed", name)
+                METRICS.add(name, "errors")
+                failed[name] = error
+    return failed
+
+
+def _drop_failed(remotes, failed):
+    if "base" in failed:
+        raise RuntimeError(f"Could not get new state of the base remote: {failed['base']}")
+    for name in failed:
+        logger.warning("Skipping remote %s for the rest of this run", name)
+        del remotes[name]
+
+
+def run_push(remotes, options, planned=None):
+    """Push new photos and albums from base to all other remotes"""
+    logger.info("Starting pushing new photos from base to remotes")
+    if options.fan_out and not options.dry_run:
+        with phase("push"):
+            fan_out_push(remotes["base"], {x: remotes[x] for x in remotes if x != "base"})
+        return
+    for remote in remotes:
+        if remote == "base":
+            continue
+        with phase("push", remote):
+            logger.info("Finding push merges for %s", remote)
+            merges = remotes[remote].get_merge_updates(remotes["base"])
+            count_actions(merges, remote, "push")
+            if planned is not None:
+                planned["push"][remote] = merges
+            if options.dry_run:
+                print(f"Merges push for {remote}")
+                pprint(merges)
+            else:
+                logger.info("Applying pull merges to %s from base", remote)
+                remotes[remote].do_updates(merges)
+                logger.info("Applying all pull merges - done")
+
+
+def run_verify(remotes):
+    """Audit remotes against checksums recorded in their state, returns problems per remote"""
+    problems = {}
+    for name, remote in remotes.items():
+        with phase("verify", name):
+            problems[name] = remote.verify()
+        for problem in problems[name]:
+            logger.error("Remote %s: %s", name, problem)
+        logger.info("Verification of remote %s - done, %s problems", name, len(problems[name]))
+    return problems
+
+
+def report_dead(remotes):
+    """Log transfers that failed too often and are not tried any more"""
+    for name, remote in remotes.items():
+        dead = remote.retry.dead
+        if dead:
+            logger.warning(
+                "Remote %s: %s transfers failed too often and are skipped until --retry-dead: %s",
+                name,
+                len(dead),
+                sorted(x["name"] for x in dead.values()),
+            )
+
+
+def run_sync(remotes, options, apply_fixes=True):
+    """One sync run over already initialised remotes"""
+    try:
+        # Remotes failing in this run are only skipped in this run
+        _sync(dict(remotes), options, apply_fixes)
+    finally:
+        if options.metrics_dir:
+            METRICS.write(options.metrics_dir)
+        print(PROGRESS.summary(METRICS.summary()))
+
+
+def _stream_pull(remotes, remote, options):
+    """Pull from a remote while it is listed, new photos are transferred while later pages are still loading"""
+    photos = remotes[remote].stream_new_state(no_state_cache=options.no_state_cache)
+    try:
+        updates = remotes["base"].iter_merge_updates(remotes[remote], photos)
+        remotes["base"].do_updates(bounded(PROGRESS.counted(updates, remote, "pull")))
+    except Exception as error:  # pylint: disable=broad-except
+        logger.exception("Pulling from remote %s failed", remote)
+        METRICS.add(remote, "errors")
+        _drop_failed(remotes, {remote: error})
         return
-    logger.info("Getting new state of all remotes")
+    METRICS.add(remote, "items", len(remotes[remote].state["photos"]))
+    log_actions(remote, "pull")
+    remotes["base"].get_new_state(no_state_cache=options.no_state_cache)
+
+
+def _sync(remotes, options, apply_fixes):
+    # Other remotes get their new state while pulling from them, unless the full lists are needed first
+    stream = not (options.skip_sync or options.sync_only or options.push_only or options.dry_run)
+    logger.info("Getting new state of %s", "the base remote" if stream else "all remotes")
     if not options.skip_sync:
-        for remote in remotes:
-            logger.info("Getting new state for remote %s", remote)
-            remotes[remote].get_new_state(no_state_cache=options.no_state_cache)
+        with PROFILER.phase("state"):
+            names = ["base"] if stream else None
+            _drop_failed(remotes, refresh_states(remotes, names, no_state_cache=options.no_state_cache))
     if options.sync_only:
         logger.info("State sync complete - exiting")
         return
-    for remote in remotes:
-        logger.info("Fixes for remote %s", remote)
-        fixes = remotes[remote].get_fixes()
-        if options.dry_run:
-            print(f"Fixes for {remote}")
-            pprint(fixes)
-            print([(x, len([f for f in fixes if f["action"]==x])) for x in set(a["action"] for a in fixes)])
-        else:
-            remotes[remote].do_fixes(fixes)
-            if fixes:
-                remotes[remote].get_new_state()
+    planned = {"fixes": {}, "pull": {}, "push": {}}
+    fixed = []
+    if apply_fixes:
+        for remote in remotes:
+            with phase("fixes", remote):
+                logger.info("Fixes for remote %s", remote)
+                fixes = remotes[remote].get_fixes()
+                METRICS.add(remote, "items", len(fixes))
+                count_actions(fixes, remote, "fixes", key=lambda x: x["action"])
+                planned["fixes"][remote] = fixes
+                if options.dry_run:
+                    print(f"Fixes for {remote}")
+                    pprint(fixes)
+                else:
+                    remotes[remote].do_fixes(fixes)
+                    if fixes:
+                        fixed.append(remote)
+    with PROFILER.phase("state", "after_fixes"):
+        _drop_failed(remotes, refresh_states(remotes, [x for x in fixed if x == "base" or not stream]))
     if options.fixes_only:
         logger.info("Fixes complete - exiting")
         return
     if not options.push_only:
         logger.info("Starting pulling new photos to base from remotes")
-        for remote in remotes:
+        for remote in list(remotes):
             if remote == "base":
                 continue
-            pull_done = False
-            while not pull_done:
-                try:
-                    logger.info("Finding pull merges for %s", remote)
-                    merges = remotes["base"].get_merge_updates(remotes[remote])
-                    if options.dry_run:
-                        print(f"Merges pull for {remote}")
-                        pprint(merges)
-                        print([(x, len([f for f in merges if f.action==x])) for x in set(a.action for a in merges)])
-                        pull_done = True
-                    else:
-                        logger.info("Applying pull merges from %s to base", remote)
-                        remotes["base"].do_updates(merges)
-                        pull_done = True
-                        logger.info("Applying all pull merges - done")
-                        remotes["base"].get_new_state(no_state_cache=options.no_state_cache)
-                except DataExpired:
-                    remotes[remote].get_new_state()
-    if not options.pull_only:
-        logger.info("Starting pushing new photos from base to remotes")
-        for remote in remotes:
-            if remote == "base":
+            if stream:
+                with phase("pull", remote):
+                    logger.info("Pulling from %s while listing it", remote)
+                    _stream_pull(remotes, remote, options)
                 continue
-            logger.info("Finding push merges for %s", remote)
-            merges = remotes[remote].get_merge_updates(remotes["base"])
-            if options.dry_run:
-                print(f"Merges push for {remote}")
-                pprint(merges)
-                print([(x, len([f for f in merges if f.action==x])) for x in set(a.action for a in merges)])
-            else:
-                logger.info("Applying pull merges to %s from base", remote)
-                remotes[remote].do_updates(merges)
-                logger.info("Applying all pull merges - done")
+            with phase("pull", remote):
+                logger.info("Finding pull merges for %s", remote)
+                merges = remotes["base"].get_merge_updates(remotes[remote])
+                count_actions(merges, remote, "pull")
+                planned["pull"][remote] = merges
+                if options.dry_run:
+                    print(f"Merges pull for {remote}")
+                    pprint(merges)
+                else:
+                    # Expired items get refreshed and re-queued individually inside do_updates
+                    logger.info("Applying pull merges from %s to base", remote)
+                    remotes["base"].do_updates(merges)
+                    logger.info("Applying all pull merges - done")
+                    remotes["base"].get_new_state(no_state_cache=options.no_state_cache)
+    if not options.pull_only:
+        run_push(remotes, options, planned)
+    if options.dry_run and options.plan_file:
+        plan = build_plan(remotes, rate=options.rate * 1024 * 1024, **planned)
+        save_plan(plan, options.plan_file)
+        print_plan(plan)
+        logger.info("Plan saved to %s", options.plan_file)
+    report_dead(remotes)
     logger.info("Sync completed")
 
 
+def run_daemon(remotes, options, lock=None):
+    """Keep remotes and their state in memory and sync them every interval until stopped
+
+    Sync runs hold lock, so that the watcher and the peer server do not use the state while it changes.
+    """
+    stop = threading.Event()
+    lock = lock or threading.Lock()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    if options.watch:
+
+        def _on_change(delta):
+            logger.info("Changes in base, pushing %s new photos", len(delta["new"]))
+            with lock:
+                try:
+                    run_push(remotes, options)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Push after changes in base failed")
+
+        watcher = threading.Thread(
+            target=remotes["base"].watch,
+            args=(_on_change,),
+            # Deltas are applied to the base state under the lock of sync runs, which change the same state
+            kwargs={"quiet_period": options.quiet_period, "stop": stop, "lock": lock},
+        )
+        watcher.start()
+    while not stop.is_set():
+        start = time.monotonic()
+        METRICS.reset()
+        PROGRESS.reset()
+        with lock:
+            try:
+                run_sync(remotes, options)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Sync failed, will retry on next run")
+        logger.info("Sync run took %.1fs, next run in %s minutes", time.monotonic() - start, options.interval)
+        stop.wait(options.interval * 60)
+    if options.watch:
+        watcher.join()
+    logger.info("Stopping")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    options = parse_args()
+    PROFILER.folder = options.profile
+    logger.info("Parsing config")
+    if options.config:
+        config_path = options.config
+    elif os.path.exists("/river/config"):
+        config_path = "/river/config"
+    elif os.path.exists(os.path.expanduser("~/.config/photoriver2")):
+        config_path = os.path.expanduser("~/.config/photoriver2")
+    with phase("init"):
+        config_data = parse_config(config_path)
+        bandwidth.configure(config_data["options"])
+        logger.info("Starting all remotes")
+        remotes = init_remotes(config_data)
+    if options.init_only:
+        logger.info("Init complete - exiting")
+        return
+    lock = threading.Lock()
+    if options.serve:
+        from photoriver2.peer import serve  # pylint: disable=import-outside-toplevel
+
+        serve(remotes["base"], options.serve, state_lock=lock)
+    if options.retry_dead:
+        for remote in remotes.values():
+            remote.retry.clear_dead()
+            remote.retry.save()
+    if options.verify:
+        problems = run_verify(remotes)
+        if options.metrics_dir:
+            METRICS.write(options.metrics_dir)
+        if any(problems.values()):
+            raise SystemExit(1)
+        return
+    if options.execute_plan:
+        plan = load_plan(options.execute_plan)
+        try:
+            check_plan(plan, remotes)
+        except PlanInvalid as error:
+            logger.error("Plan %s can not be executed: %s", options.execute_plan, error)
+            return
+        print_plan(plan)
+        if execute_plan(plan, remotes):
+            logger.info("Sync completed")
+            return
+        # Fixes were applied, so continue with a normal run without doing them again
+        _drop_failed(remotes, refresh_states(remotes, [x for x in plan["fixes"] if plan["fixes"][x]]))
+        options.skip_sync = True
+        run_sync(remotes, options, apply_fixes=False)
+    elif options.daemon or options.watch:
+        run_daemon(remotes, options, lock)
+    else:
+        run_sync(remotes, options)
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     main()
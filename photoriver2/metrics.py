@@ -0,0 +1,106 @@
+"""Per-phase timing and throughput metrics with JSON and Prometheus textfile export"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+FIELDS = ("items", "bytes", "api_calls", "retries", "errors")
+HELP = {
+    "seconds": "Wall time spent in the sync phase",
+    "items": "Items processed in the sync phase",
+    "bytes": "Bytes transferred in the sync phase",
+    "api_calls": "Remote API calls made in the sync phase",
+    "retries": "Retried operations in the sync phase",
+    "errors": "Errors in the sync phase",
+}
+
+
+class Metrics:
+    """Thread-safe counters per remote and sync phase
+
+    Counters get attributed to the phase running in the current thread. Phases can run in parallel threads, like
+    the state refresh of several remotes. Threads without a phase of their own, like transfer workers, count to the
+    phase of the main thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.local = threading.local()
+        self.main_phase = "init"
+        self.started = time.time()
+
+    @property
+    def current_phase(self):
+        return getattr(self.local, "phase", None) or self.main_phase
+
+    def reset(self):
+        with self.lock:
+            self.data = {}
+            self.main_phase = "init"
+            self.started = time.time()
+
+    def _entry(self, remote, phase):
+        return self.data.setdefault((remote, phase), dict({"seconds": 0.0}, **{x: 0 for x in FIELDS}))
+
+    def add(self, remote, field, value=1):
+        with self.lock:
+            self._entry(remote, self.current_phase)[field] += value
+
+    @contextlib.contextmanager
+    def phase(self, phase, remote="all"):
+        """Time a phase for a remote, counters added meanwhile go to this phase"""
+        main = threading.current_thread() is threading.main_thread()
+        previous = getattr(self.local, "phase", None), self.main_phase
+        self.local.phase = phase
+        if main:
+            self.main_phase = phase
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._entry(remote, phase)["seconds"] += time.monotonic() - start
+            self.local.phase = previous[0]
+            if main:
+                self.main_phase = previous[1]
+
+    def summary(self):
+        with self.lock:
+            return [
+                dict(remote=remote, phase=phase, **values) for (remote, phase), values in sorted(self.data.items())
+            ]
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = []
+        for field in ("seconds",) + FIELDS:
+            metric = f"photoriver2_phase_{field}"
+            lines.append(f"# HELP {metric} {HELP[field]}")
+            lines.append(f"# TYPE {metric} gauge")
+            for entry in summary:
+                lines.append(f'{metric}{{remote="{entry["remote"]}",phase="{entry["phase"]}"}} {entry[field]}')
+        lines.append("# HELP photoriver2_last_run_timestamp_seconds Start time of the last sync run")
+        lines.append("# TYPE photoriver2_last_run_timestamp_seconds gauge")
+        lines.append(f"photoriver2_last_run_timestamp_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write(path, text):
+        # Write and rename so that a collector never sees a partial file
+        with open(path + ".tmp", "w") as outfile:
+            outfile.write(text)
+        os.replace(path + ".tmp", path)
+
+    def write(self, folder):
+        """Write photoriver2.prom for the Prometheus textfile collector and a photoriver2_metrics.json summary"""
+        os.makedirs(folder, exist_ok=True)
+        self._write(os.path.join(folder, "photoriver2.prom"), self.to_prometheus())
+        self._write(
+            os.path.join(folder, "photoriver2_metrics.json"),
+            json.dumps({"started": self.started, "phases": self.summary()}, indent=2),
+        )
+
+
+METRICS = Metrics()
@@ -0,0 +1,215 @@
+"""HTTP server exposing the state and photos of a remote to peer nodes
+
+GET /state?since=<generation>&epoch=<epoch> returns gzipped JSON with the changes since that generation, or the full
+state if the generation is unknown to this server (first sync, server restart or too old). GET /photo?name=<name>
+streams a photo and supports byte ranges, so that interrupted downloads can be resumed.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Generations of changes kept for deltas, older peers get the full state
+MAX_HISTORY = 1000
+COPY_CHUNK = 1024 * 1024
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class StateHistory:
+    """Numbered generations of changes to the photos and albums of a remote"""
+
+    def __init__(self, remote, max_history=MAX_HISTORY, state_lock=None):
+        self.remote = remote
+        self.max_history = max_history
+        # Held by sync runs while they change the state of the remote
+        self.state_lock = state_lock or threading.Lock()
+        # A new epoch on every start tells peers that generations of an earlier run are meaningless
+        self.epoch = uuid.uuid4().hex
+        self.generation = 0
+        self.changes = []
+        self.photos = {}
+        self.albums = {}
+        self.lock = threading.Lock()
+
+    def _photo(self, photo):
+        """Public part of a photo entry, local filenames stay on this node"""
+        entry = {x: y for x, y in photo.items() if x != "filename"}
+        size = self.remote.get_size(photo)
+        if size is not None:
+            entry["size"] = size
+        checksum = self.remote.get_checksum(photo["name"])
+        if checksum:
+            entry["checksum"] = checksum
+        return entry
+
+    def update(self):
+        """Record the changes of the remote state since the last update as a new generation
+
+        Photos are compared by their published entry, so that a photo rewritten under the same name is published
+        again with its new size and checksum. While a sync holds the state lock, the last generation is served.
+        """
+        with self.lock:
+            if not self.state_lock.acquire(blocking=False):
+                return
+            try:
+                photos = {x["name"]: self._photo(x) for x in self.remote.state["photos"]}
+                albums = {x["name"]: sorted(x["photos"]) for x in self.remote.state["albums"]}
+            finally:
+                self.state_lock.release()
+            added = [y for x, y in photos.items() if self.photos.get(x) != y]
+            removed = sorted(set(self.photos) - set(photos))
+            if not added and not removed and albums == self.albums:
+                return
+            change = {
+                "added": added,
+                "removed": removed,
+                "albums": [{"name": x, "photos": y} for x, y in albums.items() if self.albums.get(x) != y],
+                "removed_albums": sorted(set(self.albums) - set(albums)),
+            }
+            self.photos = photos
+            self.albums = albums
+            self.generation += 1
+            self.changes.append((self.generation, change))
+            del self.changes[: -self.max_history]
+            logger.info(
+                "Serving generation %s of remote %s: %s new, %s removed photos",
+                self.generation,
+                self.remote.name,
+                len(added),
+                len(removed),
+            )
+
+    def delta(self, since=0, epoch=None):
+        """Changes since a generation merged into one, or the full state if that generation is not known"""
+        self.update()
+        with self.lock:
+            result = {"epoch": self.epoch, "generation": self.generation}
+            first = self.changes[0][0] if self.changes else self.generation + 1
+            if epoch != self.epoch or since < first - 1 or since > self.generation:
+                result.update(
+                    full=True,
+                    photos=list(self.photos.values()),
+                    albums=[{"name": x, "photos": y} for x, y in self.albums.items()],
+                )
+                return result
+            added, removed, albums, removed_albums = {}, set(), {}, set()
+            for generation, change in self.changes:
+                if generation <= since:
+                    continue
+                for name in change["removed"]:
+                    added.pop(name, None)
+                    removed.add(name)
+                for photo in change["added"]:
+                    added[photo["name"]] = photo
+                    removed.discard(photo["name"])
+                for name in change["removed_albums"]:
+                    albums.pop(name, None)
+                    removed_albums.add(name)
+                for album in change["albums"]:
+                    albums[album["name"]] = album
+                    removed_albums.discard(album["name"])
+            result.update(
+                full=False,
+                added=list(added.values()),
+                removed=sorted(removed),
+                albums=list(albums.values()),
+                removed_albums=sorted(removed_albums),
+            )
+            return result
+
+
+class PeerHandler(BaseHTTPRequestHandler):
+    """Request handler, the server has the history and remote attributes"""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug("Peer %s: " + format, self.address_string(), *args)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urlparse(self.path)
+        query = {x: y[0] for x, y in parse_qs(url.query).items()}
+        try:
+            if url.path == "/state":
+                self._send_state(int(query.get("since", 0)), query.get("epoch"))
+            elif url.path == "/photo" and "name" in query:
+                self._send_photo(query["name"])
+            else:
+                self.send_error(404)
+        except ValueError:
+            self.send_error(400)
+
+    def _send_state(self, since, epoch):
+        body = gzip.compress(json.dumps(self.server.history.delta(since, epoch), default=str).encode("utf8"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_photo(self, name):
+        # Only photos in the served state, so that no other files can be read
+        photo = self.server.history.photos.get(name)
+        if photo is None:
+            self.send_error(404)
+            return
+        path = os.path.join(self.server.remote.folder, name)
+        try:
+            infile = open(path, "rb")  # pylint: disable=consider-using-with
+        except OSError:
+            self.send_error(404)
+            return
+        with infile:
+            size = os.fstat(infile.fileno()).st_size
+            start, end = 0, size - 1
+            match = RANGE.match(self.headers.get("Range", ""))
+            if match and any(match.groups()):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                else:
+                    start = max(size - int(match.group(2)), 0)
+                if start > end:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            infile.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                achunk = infile.read(min(COPY_CHUNK, remaining))
+                if not achunk:
+                    break
+                self.wfile.write(achunk)
+                remaining -= len(achunk)
+
+
+def serve(remote, address, state_lock=None):
+    """Serve a local remote to peers on "host:port" in a background thread, returns the server
+
+    Without a host only this machine can connect, other nodes need an explicit host like 0.0.0.0. The state of the
+    remote is only read holding state_lock, the lock of the sync runs changing it.
+    """
+    host, _, port = address.rpartition(":")
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), PeerHandler)
+    server.daemon_threads = True
+    server.remote = remote
+    server.history = StateHistory(remote, state_lock=state_lock)
+    threading.Thread(target=server.serve_forever, name="peer-server", daemon=True).start()
+    logger.info("Serving remote %s to peers on %s:%s", remote.name, *server.server_address[:2])
+    return server
@@ -0,0 +1,60 @@
+"""Bounded streams connecting the listing, diff and transfer stages of a sync"""
+import queue
+import threading
+
+# Updates handled together by do_updates, and updates buffered between stages
+WINDOW_SIZE = 500
+
+
+def windows(items, size=WINDOW_SIZE):
+    """Lists of up to size items from an iterable, without reading ahead of the current window"""
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def bounded(items, depth=WINDOW_SIZE):
+    """Iterate items in a background thread, at most depth items ahead of the consumer
+
+    Errors of the producer are raised in the consumer. A consumer that stops early stops the producer too.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for item in items:
+                if not _put(("item", item)):
+                    # Let a generator clean up, like a listing closing its connection
+                    getattr(items, "close", lambda: None)()
+                    return
+        except Exception as error:  # pylint: disable=broad-except
+            _put(("error", error))
+            return
+        _put(("done", None))
+
+    threading.Thread(target=_produce, name="pipeline", daemon=True).start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
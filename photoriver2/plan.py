@@ -0,0 +1,128 @@
+"""Execution plans - save the outcome of a dry run and execute it later without replanning"""
+import gzip
+import json
+import logging
+
+from datetime import datetime, timedelta
+
+from photoriver2.remote_base import Update
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+# Used for the transfer estimate when the source can not tell the size without fetching the photo
+DEFAULT_PHOTO_SIZE = 4 * 1024 * 1024
+
+
+class PlanInvalid(Exception):
+    """The plan no longer matches the state of the remotes"""
+
+
+def update_to_dict(update):
+    data = {"action": update.action, "name": update.name, "source": update.remote.name}
+    if update.album_name:
+        data["album_name"] = update.album_name
+    if update.photo:
+        data["photo"] = update.photo
+    if update.new_name:
+        data["new_name"] = update.new_name
+    return data
+
+
+def update_from_dict(data, remotes):
+    return Update(
+        action=data["action"],
+        remote=remotes[data["source"]],
+        photo=data.get("photo"),
+        name=data["name"],
+        album_name=data.get("album_name"),
+        new_name=data.get("new_name"),
+    )
+
+
+def _summary(updates, remotes):
+    actions = {}
+    for update in updates:
+        actions[update["action"]] = actions.get(update["action"], 0) + 1
+    sizes = [remotes[x["source"]].get_size(x["photo"]) for x in updates if x["action"] == "new" and x.get("photo")]
+    known = [x for x in sizes if x is not None]
+    average = sum(known) / len(known) if known else DEFAULT_PHOTO_SIZE
+    return {
+        "actions": actions,
+        "bytes": int(sum(known) + average * (len(sizes) - len(known))),
+        "estimated": len(sizes) - len(known),
+    }
+
+
+def build_plan(remotes, fixes, pull, push, rate=10 * 1024 * 1024):
+    """Plan from fixes per remote and pull/push updates per remote, rate in bytes/s is used for the ETA"""
+    plan = {
+        "version": PLAN_VERSION,
+        "created": datetime.now().isoformat(),
+        "states": {x: remotes[x].state_digest() for x in remotes},
+        "fixes": fixes,
+        "pull": {x: [update_to_dict(u) for u in pull[x]] for x in pull},
+        "push": {x: [update_to_dict(u) for u in push[x]] for x in push},
+        "summary": {},
+    }
+    for phase in ("pull", "push"):
+        for remote, updates in plan[phase].items():
+            plan["summary"][f"{phase}/{remote}"] = _summary(updates, remotes)
+    for remote, afixes in fixes.items():
+        plan["summary"][f"fixes/{remote}"] = {"actions": {"fix": len(afixes)}, "bytes": 0, "estimated": 0}
+    total = sum(x["bytes"] for x in plan["summary"].values())
+    plan["estimate"] = {"bytes": total, "rate": rate, "seconds": int(total / rate) if rate else None}
+    return plan
+
+
+def save_plan(plan, path):
+    with gzip.open(path, "wt", encoding="utf8") as outfile:
+        json.dump(plan, outfile, separators=(",", ":"), default=str)
+
+
+def load_plan(path):
+    with gzip.open(path, "rt", encoding="utf8") as infile:
+        return json.load(infile)
+
+
+def check_plan(plan, remotes, max_age=timedelta(hours=24)):
+    """Cheap validity check - raises PlanInvalid if remotes changed since the plan was made"""
+    if plan.get("version") != PLAN_VERSION:
+        raise PlanInvalid(f"Unsupported plan version {plan.get('version')}")
+    if datetime.now() - datetime.fromisoformat(plan["created"]) > max_age:
+        raise PlanInvalid(f"Plan created at {plan['created']} is too old")
+    for name, digest in plan["states"].items():
+        if name not in remotes:
+            raise PlanInvalid(f"Remote {name} from the plan is not configured")
+        if remotes[name].state_digest() != digest:
+            raise PlanInvalid(f"State of remote {name} changed since the plan was made")
+
+
+def print_plan(plan):
+    for key, summary in sorted(plan["summary"].items()):
+        print(f"{key}: {sorted(summary['actions'].items())} ({summary['bytes'] / 1024 / 1024:.1f} MiB)")
+    estimate = plan["estimate"]
+    if estimate["seconds"] is not None:
+        print(
+            f"Total transfer: {estimate['bytes'] / 1024 / 1024:.1f} MiB, ETA {timedelta(seconds=estimate['seconds'])}"
+        )
+
+
+def execute_plan(plan, remotes):
+    """Apply a checked plan, returns False if fixes changed the remotes and merges need to be replanned"""
+    fixed = False
+    for remote, fixes in plan["fixes"].items():
+        if fixes:
+            logger.info("Applying %s planned fixes to %s", len(fixes), remote)
+            remotes[remote].do_fixes(fixes)
+            fixed = True
+    if fixed:
+        logger.warning("Fixes changed the remotes, planned merges are outdated")
+        return False
+    for remote, updates in plan["pull"].items():
+        logger.info("Applying %s planned pull merges from %s to base", len(updates), remote)
+        remotes["base"].do_updates([update_from_dict(x, remotes) for x in updates])
+    for remote, updates in plan["push"].items():
+        logger.info("Applying %s planned push merges to %s from base", len(updates), remote)
+        remotes[remote].do_updates([update_from_dict(x, remotes) for x in updates])
+    return True
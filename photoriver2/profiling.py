@@ -0,0 +1,107 @@
+"""CPU and memory profiling of sync phases"""
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+TOP_ALLOCATIONS = 25
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS counter of this process (Linux only), returns False if not supported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as outfile:
+            outfile.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb(was_reset):
+    if was_reset:
+        with open("/proc/self/status") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    # Peak over the whole process lifetime
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Profiler:
+    """Writes cProfile dumps, top allocation sites and peak memory of each phase to a folder"""
+
+    def __init__(self, folder=None):
+        self.folder = folder
+        self.results = []
+        self.thread_profiles = []
+
+    def _profile_thread(self, *args):  # pylint: disable=unused-argument
+        # Called once in every new thread, replaces itself with a per-thread profiler
+        profile = cProfile.Profile()
+        self.thread_profiles.append(profile)
+        profile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, phase, remote="all"):
+        if not self.folder:
+            yield
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        name = f"{phase}-{remote}"
+        was_reset = _reset_peak_rss()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        self.thread_profiles = []
+        # Since Python 3.12 one profiler sees all threads, before that each thread needs its own
+        per_thread = sys.version_info < (3, 12)
+        if per_thread:
+            threading.setprofile(self._profile_thread)
+        start = time.monotonic()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if per_thread:
+                threading.setprofile(None)
+            seconds = time.monotonic() - start
+            stats = pstats.Stats(profile)
+            for thread_profile in self.thread_profiles:
+                thread_profile.create_stats()
+                stats.add(thread_profile)
+            stats.dump_stats(os.path.join(self.folder, name + ".prof"))
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            with open(os.path.join(self.folder, name + ".alloc.txt"), "w") as outfile:
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                    outfile.write(f"{stat}\n")
+            self.results.append(
+                {
+                    "phase": phase,
+                    "remote": remote,
+                    "seconds": seconds,
+                    "peak_rss_kb": _peak_rss_kb(was_reset),
+                    "peak_rss_is_lifetime": not was_reset,
+                    "traced_peak_bytes": traced_peak,
+                }
+            )
+            with open(os.path.join(self.folder, "profile_summary.json"), "w") as outfile:
+                json.dump(self.results, outfile, indent=2)
+            logger.info("Profile of %s written to %s", name, self.folder)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,147 @@
+"""Rate-limited progress reports per remote and phase, and the summary table of a sync run"""
+import collections
+import logging
+import threading
+import time
+
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Seconds between progress lines of the same remote and phase
+INTERVAL = 10
+
+
+class Progress:
+    """Items and bytes done out of the expected ones, logged at most every interval seconds
+
+    Totals can grow while work is done, like when transfers of a streamed listing come in windows.
+    """
+
+    def __init__(self, remote, phase, interval=INTERVAL):
+        self.remote = remote
+        self.phase = phase
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.total_items = 0
+        self.total_bytes = 0
+        self.done_items = 0
+        self.done_bytes = 0
+        self.started = time.monotonic()
+        self.logged = self.started
+
+    def expect(self, items, size=0):
+        with self.lock:
+            self.total_items += items
+            self.total_bytes += size or 0
+
+    def add(self, size=0, items=1):
+        with self.lock:
+            self.done_items += items
+            self.done_bytes += size or 0
+            now = time.monotonic()
+            if now - self.logged < self.interval:
+                return
+            self.logged = now
+            line = self._line(now)
+        logger.info(line)
+
+    def _line(self, now):
+        elapsed = max(now - self.started, 0.001)
+        rate = self.done_bytes / elapsed
+        if not self.total_items:
+            # Nothing expected, like while listing, so no total or ETA either
+            return f"Remote {self.remote} {self.phase}: {self.done_items} items ({self.done_items / elapsed:.1f}/s)"
+        line = f"Remote {self.remote} {self.phase}: {self.done_items}/{self.total_items} items"
+        if self.total_bytes:
+            done, total = self.done_bytes / 2 ** 20, self.total_bytes / 2 ** 20
+            line += f", {done:.1f}/{total:.1f} MiB ({rate / 2 ** 20:.1f} MiB/s)"
+        if self.total_bytes and rate:
+            eta = (self.total_bytes - self.done_bytes) / rate
+        elif self.done_items:
+            eta = (self.total_items - self.done_items) * elapsed / self.done_items
+        else:
+            return line
+        return line + f", ETA {timedelta(seconds=round(max(eta, 0)))}"
+
+    def finish(self):
+        """Log the final numbers, unless nothing was done"""
+        with self.lock:
+            if not self.done_items:
+                return
+            line = self._line(time.monotonic())
+        logger.info(line)
+
+
+class ProgressReports:
+    """Progress and counts of actions of all remotes and phases of the running sync"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reports = {}
+        self.actions = {}
+
+    def reset(self):
+        with self.lock:
+            self.reports = {}
+            self.actions = {}
+
+    def get(self, remote, phase):
+        with self.lock:
+            if (remote, phase) not in self.reports:
+                self.reports[(remote, phase)] = Progress(remote, phase)
+            return self.reports[(remote, phase)]
+
+    def finish(self, phase, remote=None):
+        """Log the final progress of a phase that ended, of one or all remotes"""
+        with self.lock:
+            keys = [x for x in self.reports if x[1] == phase and remote in (None, x[0])]
+            reports = [self.reports.pop(x) for x in keys]
+        for report in reports:
+            report.finish()
+
+    def count(self, remote, phase, action, value=1):
+        with self.lock:
+            self.actions.setdefault((remote, phase), collections.Counter())[action] += value
+
+    def counted(self, updates, remote, phase, key=lambda x: x.action):
+        """Pass through updates, counting them by action"""
+        for update in updates:
+            self.count(remote, phase, key(update))
+            yield update
+
+    def summary(self, metrics):
+        """Table of the metrics and counted actions of the run"""
+        with self.lock:
+            actions = {x: dict(y) for x, y in self.actions.items()}
+        return summary_table(metrics, actions)
+
+
+def summary_table(metrics, actions):
+    """Text table of a sync run from METRICS.summary() rows and {(remote, phase): Counter of actions}"""
+    header = ("Remote", "Phase", "Actions", "Items", "MiB", "Errors", "Seconds")
+    rows = []
+    keys = [(x["remote"], x["phase"]) for x in metrics]
+    keys += [x for x in sorted(actions) if x not in keys]
+    values = {(x["remote"], x["phase"]): x for x in metrics}
+    for key in keys:
+        entry = values.get(key, collections.defaultdict(int))
+        counts = " ".join(f"{x}:{y}" for x, y in sorted(actions.get(key, {}).items())) or "-"
+        rows.append(
+            (
+                key[0],
+                key[1],
+                counts,
+                str(entry["items"]),
+                f"{entry['bytes'] / 2 ** 20:.1f}",
+                str(entry["errors"]),
+                f"{entry['seconds']:.1f}",
+            )
+        )
+    widths = [max(len(x[i]) for x in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(x.ljust(y) for x, y in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * x for x in widths))
+    return "\n".join(lines)
+
+
+PROGRESS = ProgressReports()
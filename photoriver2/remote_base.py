@@ -1,24 +1,47 @@
 """Remotes implementation - state of an instance of a photo collection"""
+import gzip
+import hashlib
 import json
 import logging
 import os
+import time
+
+from photoriver2.bandwidth import TokenBucket
+from photoriver2.blacklist import Blacklist
+from photoriver2.retry import RetryQueue
+from photoriver2.scheduler import LARGE_SIZE, Scheduler
 
 IMAGE_EXTENSIONS = ("JPEG", "JPG", "HEIC", "CR2", "TIFF", "TIF", "GIF", "FLV", "MOV", "MP4", "PNG", "AVI", "3GP", "M4V")
 
 logger = logging.getLogger(__name__)
 
+# State files by backend: plain JSON, or gzipped JSON that is much smaller for large collections
+STATE_BACKENDS = {"json": ("_state.json", open), "gzip": ("_state.json.gz", gzip.open)}
+
+# Seconds a move is remembered, remotes that are not synced for longer copy the photo again instead
+MAX_MOVE_AGE = 90 * 24 * 3600
+
+
+class DataExpired(Exception):
+    """Photo metadata (like a download URL) is no longer valid and needs a refresh"""
+
 
 class Update:
     """Incapsulates information about a change that needs to be applied"""
 
-    def __init__(self, action, remote, photo=None, name=None, album_name=None, *args, **kwargs):
+    def __init__(self, action, remote, photo=None, name=None, album_name=None, *args, new_name=None, **kwargs):
         self.action = action
         self.name = name or photo["name"]
         self.remote = remote
         self.photo = photo.copy() if photo else None
         self.album_name = album_name
+        # Target name of a "mv" update, name is the current one
+        self.new_name = new_name
+        self.stream = None
 
     def data(self):
+        if self.stream is not None:
+            return self.stream
         return self.remote.get_data(self.photo)
 
     def __repr__(self):
@@ -29,28 +52,177 @@ class BaseRemote:
     """Common functionality between local folder remotes and online remotes"""
 
     new_state = None
+    # Whether fingerprint() can tell the content of photos apart
+    has_fingerprints = False
+    # Remotes that photos can not be put into, like peers
+    read_only = False
+    # Moves dict of the state and its reverse index, {new name: set of old names}
+    move_index = (None, {})
 
-    def __init__(self, name="local", *args, **kwargs):
+    def __init__(
+        self,
+        name="local",
+        *args,
+        state_dir="/river/config",
+        blacklist="",
+        schedule="newest",
+        bandwidth_limit="",
+        workers=5,
+        min_workers=1,
+        max_workers=10,
+        large_workers=2,
+        large_size=LARGE_SIZE,
+        state_backend="json",
+        **kwargs,
+    ):
         self.name = name
-        self.state_file = os.path.join("/river/config", name + "_state.json")
+        self.blacklist = Blacklist(blacklist)
+        self.scheduler = Scheduler(
+            name,
+            policy=schedule,
+            workers=workers,
+            min_workers=min_workers,
+            max_workers=max_workers,
+            large_workers=large_workers,
+            large_size=large_size,
+        )
+        self.bandwidth = TokenBucket(bandwidth_limit)
+        self.state_dir = state_dir
+        self.retry = RetryQueue(os.path.join(state_dir, name + "_retry.json"))
+        suffix, self.state_open = STATE_BACKENDS[state_backend]
+        self.state_file = os.path.join(state_dir, name + suffix)
+        self.saved_hash = None
+        # State file of another backend, removed once the state is saved with this one
+        self.old_state_file = None
         self.state = self.load_old_state(self.state_file)
         self.name_cache = self.generate_name_cache()
 
     def load_old_state(self, state_file):
         if os.path.exists(state_file):
-            with open(state_file, "r") as infile:
-                return json.load(infile)
-        else:
-            return self.get_new_state()
+            with self.state_open(state_file, "rt") as infile:
+                text = infile.read()
+            self.saved_hash = hashlib.sha1(text.encode("utf8")).hexdigest()
+            return json.loads(text)
+        # After switching the state backend the state is read from the file of the previous one
+        for suffix, state_open in STATE_BACKENDS.values():
+            old_state_file = os.path.join(self.state_dir, self.name + suffix)
+            if old_state_file != state_file and os.path.exists(old_state_file):
+                logger.info("Remote %s: reading state from %s", self.name, old_state_file)
+                self.old_state_file = old_state_file
+                with state_open(old_state_file, "rt") as infile:
+                    return json.load(infile)
+        return self.get_new_state()
 
     def get_new_state(self, no_state_cache=False):
-        self.state = {"photos": self.get_photos(), "albums": self.get_albums()}
-        with open(self.state_file, "w") as infile:
-            json.dump(self.state, infile, default=str)
+        for _ in self.stream_new_state(no_state_cache):
+            pass
         return self.state
 
+    def iter_photos(self):
+        """Photos of the remote while they are being listed"""
+        return iter(self.get_photos())
+
+    def stream_new_state(self, no_state_cache=False):  # pylint: disable=unused-argument
+        """Yield photos while listing them, the new state is in place once all are yielded"""
+        previous = getattr(self, "state", None) or {}
+        photos = []
+        for photo in self.iter_photos():
+            photos.append(photo)
+            yield photo
+        self.state = {"photos": sorted(photos, key=lambda x: x["name"]), "albums": self.get_albums()}
+        # Moves and aliases are not visible in the photo list, carry them over
+        now = int(time.time())
+        moved_at = {x: previous.get("moved_at", {}).get(x, now) for x in previous.get("moves", {})}
+        moves = {x: y for x, y in previous.get("moves", {}).items() if moved_at[x] > now - MAX_MOVE_AGE}
+        if moves:
+            self.state["moves"] = moves
+            self.state["moved_at"] = {x: moved_at[x] for x in moves}
+        names = set(x["name"] for x in self.state["photos"])
+        aliases = {x: y for x, y in previous.get("aliases", {}).items() if y in names}
+        if aliases:
+            self.state["aliases"] = aliases
+        checksums = {x: y for x, y in previous.get("checksums", {}).items() if x in names or x in aliases}
+        if checksums:
+            self.state["checksums"] = checksums
+        self.detect_moves(previous.get("photos", []))
+        self.name_cache = self.generate_name_cache()
+        self.save_state()
+
+    def save_state(self):
+        """Write state to the state file, unless it is unchanged since the last write"""
+        text = json.dumps(self.state, default=str)
+        text_hash = hashlib.sha1(text.encode("utf8")).hexdigest()
+        if text_hash == self.saved_hash:
+            logger.debug("Remote %s: state unchanged, not saving", self.name)
+            return False
+        with self.state_open(self.state_file, "wt") as outfile:
+            outfile.write(text)
+        self.saved_hash = text_hash
+        if self.old_state_file:
+            os.remove(self.old_state_file)
+            self.old_state_file = None
+        return True
+
+    def state_digest(self):
+        """Short fingerprint of photo and album names in the current state"""
+        digest = hashlib.sha1()
+        for photo in sorted(x["name"] for x in self.state["photos"]):
+            digest.update(photo.encode("utf8") + b"\n")
+        for album in sorted(self.state["albums"], key=lambda x: x["name"]):
+            digest.update(json.dumps([album["name"], sorted(album["photos"])]).encode("utf8") + b"\n")
+        return digest.hexdigest()
+
     def generate_name_cache(self):
-        return set(x["name"].strip().strip("/").upper() for x in self.state["photos"])
+        names = [x["name"] for x in self.state["photos"]] + list(self.state.get("aliases", {}))
+        return set(x.strip().strip("/").upper() for x in names)
+
+    def record_move(self, old_name, new_name):
+        """Remember that a photo of this remote was renamed, so that other remotes can rename it too"""
+        moves = self.state.setdefault("moves", {})
+        moved_at = self.state.setdefault("moved_at", {})
+        if self.move_index[0] is not moves:
+            index = {}
+            for name, target in moves.items():
+                index.setdefault(target, set()).add(name)
+            self.move_index = (moves, index)
+        index = self.move_index[1]
+        # Earlier moves to the old name now end at the new one
+        sources = index.pop(old_name, set()) | {old_name}
+        for name in sources:
+            moves[name] = new_name
+            moved_at[name] = int(time.time())
+        index.setdefault(new_name, set()).update(sources)
+        if new_name in moves:
+            index[moves.pop(new_name)].discard(new_name)
+            moved_at.pop(new_name, None)
+        if old_name in self.state.get("checksums", {}):
+            self.state["checksums"][new_name] = self.state["checksums"].pop(old_name)
+
+    def add_alias(self, alias, name):
+        """Remember that a photo of this remote is known as alias in other remotes"""
+        self.state.setdefault("aliases", {})[alias] = name
+        self.name_cache.add(alias.strip().strip("/").upper())
+
+    def record_checksum(self, name, checksum):
+        """Remember the checksum of photo data that passed through a transfer"""
+        self.state.setdefault("checksums", {})[name] = checksum
+
+    def get_checksum(self, name):
+        """Returns the recorded checksum of a photo or None if it was not recorded"""
+        return self.state.get("checksums", {}).get(name)
+
+    def verify(self):
+        """Check photos against their recorded checksums, returns a list of problems found"""
+        logger.warning("Remote %s: verification is not supported", self.name)
+        return []
+
+    def detect_moves(self, previous_photos):  # pylint: disable=unused-argument
+        """Find photos renamed since the previous state and record them"""
+        return
+
+    def fingerprint(self, photo):  # pylint: disable=unused-argument
+        """Returns a content fingerprint of an individual photo or None if not known"""
+        return None
 
     def get_photos(self):
         raise NotImplementedError
@@ -62,6 +234,22 @@ class BaseRemote:
         """Returns binary data of an individual photo"""
         raise NotImplementedError
 
+    def get_size(self, photo):  # pylint: disable=unused-argument
+        """Returns size of an individual photo in bytes or None if not known without fetching it"""
+        return None
+
+    def put_data(self, update):
+        """Put a photo from other remote into this one"""
+        raise NotImplementedError
+
+    def commit_data(self):
+        """Finish a batch of put_data calls"""
+        return
+
+    def refresh_photos(self, photos):
+        """Return fresh metadata for the given photos, skipping photos that are gone"""
+        return photos
+
     def prepare_data(self, updates):
         """Batch action to prepare for download of photos in the updates"""
         return
@@ -83,34 +271,103 @@ class BaseRemote:
     def find_photo(self, name):
         return name.strip().strip("/").upper() in self.name_cache
 
+    def _find_moves(self, other, new_photos):
+        """Match photos new in other to photos of this remote that other no longer has, returns {new: old name}"""
+        moves = {}
+        moved_from = {y: x for x, y in other.state.get("moves", {}).items()}
+        for aphoto in new_photos:
+            old_name = moved_from.get(aphoto["name"])
+            if old_name and self.find_photo(old_name) and not other.find_photo(old_name):
+                moves[aphoto["name"]] = old_name
+        left = [x for x in new_photos if x["name"] not in moves]
+        if not left or not (self.has_fingerprints and other.has_fingerprints):
+            return moves
+        # Only photos of the same size can match, avoid hashing all the others
+        sizes = set(other.get_size(x) for x in left)
+        taken = set(moves.values())
+        candidates = {}
+        for photo in self.state["photos"]:
+            if photo["name"] in taken or other.find_photo(photo["name"]) or other.blacklist.matches(photo["name"]):
+                continue
+            if self.get_size(photo) not in sizes:
+                continue
+            candidates.setdefault(self.fingerprint(photo), photo["name"])
+        candidates.pop(None, None)
+        for aphoto in left:
+            old_name = candidates.pop(other.fingerprint(aphoto), None)
+            if old_name:
+                moves[aphoto["name"]] = old_name
+        return moves
+
     def get_merge_updates(self, other):
         """Return updates to add items from other remote"""
-        updates = []
-        # Find new photos
-        for aphoto in other.state["photos"]:
-            if not self.find_photo(aphoto["name"]):
-                logger.info("Remote %s: new photo %s found in %s", self.name, aphoto["name"], other.name)
-                updates.append(Update(action="new", photo=aphoto, remote=other))
+        return list(self.iter_merge_updates(other))
+
+    def iter_merge_updates(self, other, photos=None):
+        """Yield updates to add items from other remote, photos are the state of other or a stream of its listing
+
+        Photos that may have been moved are only matched once the listing is complete, the others are yielded
+        as soon as they are listed. With content fingerprints on both sides a new photo could be a move if this
+        remote has a photo of the same size.
+        """
+        known_as = {y: x for x, y in other.state.get("aliases", {}).items()}
+        moved_from = {y: x for x, y in other.state.get("moves", {}).items()}
+        sizes = set()
+        if self.has_fingerprints and other.has_fingerprints:
+            sizes = set(self.get_size(x) for x in self.state["photos"])
+        maybe_moved = []
+        for aphoto in other.state["photos"] if photos is None else photos:
+            if self.blacklist.matches(aphoto["name"]):
+                continue
+            if self.find_photo(aphoto["name"]) or self.find_photo(known_as.get(aphoto["name"], "")):
+                continue
+            if aphoto["name"] in moved_from or (sizes and other.get_size(aphoto) in sizes):
+                maybe_moved.append(aphoto)
+                continue
+            logger.debug("Remote %s: new photo %s found in %s", self.name, aphoto["name"], other.name)
+            yield Update(action="new", photo=aphoto, remote=other)
+        moves = self._find_moves(other, maybe_moved)
+        for aphoto in maybe_moved:
+            if aphoto["name"] in moves:
+                logger.debug(
+                    "Remote %s: photo %s was moved to %s in %s",
+                    self.name,
+                    moves[aphoto["name"]],
+                    aphoto["name"],
+                    other.name,
+                )
+                yield Update(
+                    action="mv", photo=aphoto, remote=other, name=moves[aphoto["name"]], new_name=aphoto["name"]
+                )
+            else:
+                logger.debug("Remote %s: new photo %s found in %s", self.name, aphoto["name"], other.name)
+                yield Update(action="new", photo=aphoto, remote=other)
 
         # Find new albums
         new_albums = set()
-        for album in other.state["albums"]:
+        albums = [x for x in other.state["albums"] if not self.blacklist.matches("albums/" + x["name"])]
+        for album in albums:
             if not self.find_album(album["name"]):
-                logger.info("Remote %s: new album %s found in %s", self.name, album["name"], other.name)
-                updates.append(Update(action="new_album", photo=album, remote=other))
+                logger.debug("Remote %s: new album %s found in %s", self.name, album["name"], other.name)
+                album_photos = [known_as.get(x, x) for x in album["photos"]]
+                album = dict(album, photos=[x for x in album_photos if not self.blacklist.matches(x)])
+                yield Update(action="new_album", photo=album, remote=other)
                 new_albums.add(album["name"])
 
-        # Find added photos to existing albums
-        for album in other.state["albums"]:
+        # Find added photos to existing albums, comparing photos by the names other remotes know them by
+        own_known_as = {y: x for x, y in self.state.get("aliases", {}).items()}
+        for album in albums:
             if album["name"] in new_albums:
                 continue
             old_album = self.find_album(album["name"])
             if not old_album:
                 logger.error("Album not found while trying to add photos to it: %s not in %s", album["name"], self.state["albums"])
                 continue
-            new_photos = set(album["photos"]) - set(old_album["photos"])
+            new_photos = set(known_as.get(x, x) for x in album["photos"]) - set(
+                own_known_as.get(x, x) for x in old_album["photos"]
+            )
             for new_photo in new_photos:
-                logger.info("Remote %s: photo %s was added to album %s", self.name, new_photo, album["name"])
-                updates.append(Update(action="new_album_photo", name=new_photo, remote=other, album_name=album["name"]))
-
-        return updates
+                if self.blacklist.matches(new_photo):
+                    continue
+                logger.debug("Remote %s: photo %s was added to album %s", self.name, new_photo, album["name"])
+                yield Update(action="new_album_photo", name=new_photo, remote=other, album_name=album["name"])
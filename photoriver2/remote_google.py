@@ -1,55 +1,135 @@
 """Remotes implementation - state of a Google Photo Library"""
-import pickle
+import concurrent.futures
 import logging
-import os
-import time
+import threading
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import requests
 
-from photoriver2.remote_base import BaseRemote
-from photoriver2.gphoto_api import GPhoto
+from photoriver2.pipeline import windows
+from photoriver2.progress import PROGRESS
+from photoriver2.remote_base import BaseRemote, DataExpired, Update
+from photoriver2.gphoto_api import API_URL, TOKEN_URI, GPhoto, chunk
 
 logger = logging.getLogger(__name__)
 
-class DataExpired(Exception):
-    pass
+# Google media URLs are valid for 60 minutes, leave a margin for long downloads
+MEDIA_URL_TTL = timedelta(minutes=50)
+# Albums created and filled at the same time
+ALBUM_WORKERS = 4
+
+
+def _key(name):
+    return name.strip().strip("/").upper()
+
 
 class GoogleRemote(BaseRemote):
     """Remote representing a Google Library with photos"""
 
-    def __init__(self, token_cache, *args, **kwargs):
-        self.api = GPhoto(token_cache)
+    def __init__(
+        self, token_cache, *args, api_url=API_URL, token_uri=TOKEN_URI, page_size=100, album_page_size=50, **kwargs
+    ):
+        self.api = GPhoto(
+            token_cache,
+            name=kwargs.get("name", "local"),
+            api_url=api_url,
+            token_uri=token_uri,
+            page_size=page_size,
+            album_page_size=album_page_size,
+        )
+        self.media_urls = {}
+        self.pending_media = []
+        # Media IDs of photos created since the last commit_data, by the names they were uploaded under
+        self.uploaded = {}
+        self.pending_lock = threading.Lock()
+        # Album photos are recorded in the state by albums synced in parallel
+        self.albums_lock = threading.Lock()
         super().__init__(*args, **kwargs)
+        self.api.bandwidth = self.bandwidth
+        self.api.concurrency = self.scheduler.concurrency
+
+    def load_old_state(self, state_file):
+        state = super().load_old_state(state_file)
+        # State files written before slimming kept the full API payload for every photo
+        for photo in state["photos"]:
+            if "raw" in photo:
+                raw = photo.pop("raw")
+                photo.pop("description", None)
+                photo.pop("modified", None)
+                photo["created"] = raw.get("mediaMetadata", {}).get("creationTime")
+                photo["mime_type"] = raw.get("mimeType")
+        return state
+
+    def _photo_id(self, photo):
+        if "id" in photo:
+            return photo["id"]
+        return [x["id"] for x in self.state["photos"] if x["name"] == photo["name"]][0]
+
+    def _cache_media_urls(self, photos):
+        now = datetime.now()
+        for photo in photos:
+            self.media_urls[photo["id"]] = (photo.pop("base_url"), now)
+
+    def _media_url(self, photo_id):
+        base_url, fetched = self.media_urls.get(photo_id, (None, None))
+        if not base_url or datetime.now() - fetched > MEDIA_URL_TTL:
+            self._cache_media_urls([self.api.get_photo(photo_id)])
+            base_url, fetched = self.media_urls[photo_id]
+        return base_url
+
+    def prepare_data(self, updates):
+        """Fetch short-lived media URLs for a batch of photos in chunks of 50"""
+        now = datetime.now()
+        ids = set(self._photo_id(x.photo) for x in updates if x.photo)
+        ids = [x for x in ids if x not in self.media_urls or now - self.media_urls[x][1] > MEDIA_URL_TTL]
+        for achunk in chunk(iter(ids), 50):
+            self._cache_media_urls(self.api.get_photos_by_id(achunk))
 
     def get_data(self, photo):
-        if not "raw" in photo:
-            photo = self.find_photo(photo["name"])
+        photo_id = self._photo_id(photo)
         try:
-            return self.api.read_photo(photo)
+            return self.api.read_photo({"id": photo_id, "base_url": self._media_url(photo_id)})
         except requests.exceptions.HTTPError:
             logger.warning("Error reading photo data, likely the state expired")
+            self.media_urls.pop(photo_id, None)
             raise DataExpired
 
-    def get_photos(self):
-        logger.info("Getting photos list from Google")
-        photos = [x for x in self.api.get_photos(archived=True)]
-        now = datetime.now()
+    def refresh_photos(self, photos):
+        logger.info("Remote %s: refreshing metadata of %s photos", self.name, len(photos))
+        fresh = {}
+        for ids in chunk(iter([self._photo_id(x) for x in photos]), 50):
+            for photo in self.api.get_photos_by_id(ids):
+                photo["name"] = self._get_name(photo)
+                fresh[photo["id"]] = photo
+        self._cache_media_urls(fresh.values())
+        for photo in self.state["photos"]:
+            if photo["id"] in fresh:
+                photo.update(fresh[photo["id"]])
+        return [fresh[x] for x in [self._photo_id(x) for x in photos] if x in fresh]
 
-        for photo in photos:
-            photo["modified"] = now.isoformat()
+    def iter_photos(self):
+        """Photos page by page as the API returns them"""
+        logger.info("Getting photos list from Google")
+        count = 0
+        progress = PROGRESS.get(self.name, "listing")
+        for photo in self.api.get_photos(archived=True):
             photo["name"] = self._get_name(photo)
-        photos = sorted(photos, key=lambda x: x["name"])
-        logger.info("Getting photos list from Google - done, found %s", len(photos))
-        return photos
+            count += 1
+            progress.add()
+            yield photo
+        PROGRESS.finish("listing", self.name)
+        logger.info("Getting photos list from Google - done, found %s", count)
+
+    def get_photos(self):
+        return sorted(self.iter_photos(), key=lambda x: x["name"])
 
     @staticmethod
     def _get_name(photo):
         filename = photo["filename"]
         if not "." in filename:
             filename += ".jpg"
-        path_date = datetime.strptime(photo["raw"]["mediaMetadata"]["creationTime"][:18], "%Y-%m-%dT%H:%M:%S")
+        path_date = datetime.strptime(photo["created"][:19], "%Y-%m-%dT%H:%M:%S")
         local_name = f"{path_date.year:04d}/{path_date.month:02d}/{path_date.day:02d}/{filename}"
         return local_name
 
@@ -59,28 +139,152 @@ class GoogleRemote(BaseRemote):
         for album in albums:
             if "/" in album["name"]:
                 album["name"] = album["name"].replace("/", "_")
-            logger.info("Remote %s: Loading photo info of album %s: ", self.name, album["name"])
+            logger.debug("Remote %s: Loading photo info of album %s: ", self.name, album["name"])
             album["photos"] = sorted([self._get_name(x) for x in self.api.get_photos(album_id=album["id"])])
         logger.info("Getting albums list from Google - done, found %s", len(albums))
         return sorted(albums, key=lambda x: x["name"])
 
-    def do_updates(self, updates):
+    def put_data(self, update):
+        """Upload a photo from other remote, media items get created in batches of 50"""
+        infile = update.data()
+        try:
+            data = infile.read()
+        finally:
+            infile.close()
+        token = self.api.upload_media(update.name, data=data)
+        with self.pending_lock:
+            self.pending_media.append(token)
+            if len(self.pending_media) < 50:
+                return
+            batch, self.pending_media = self.pending_media, []
+        self._create_media(batch)
+
+    def _create_media(self, batch):
+        """Create media items from (name, upload token) and remember their IDs for albums"""
+        for result in self.api.create_media(batch):
+            names = [x[0] for x in batch if x[1] == result.get("uploadToken")]
+            if names and "id" in result.get("mediaItem", {}):
+                with self.pending_lock:
+                    self.uploaded[names[0]] = result["mediaItem"]["id"]
+
+    def commit_data(self):
+        """Create the remaining media items and add all created ones to the state"""
+        with self.pending_lock:
+            batch, self.pending_media = self.pending_media, []
+        if batch:
+            self._create_media(batch)
+        with self.pending_lock:
+            uploaded, self.uploaded = self.uploaded, {}
+        if uploaded:
+            # Until the next listing they are known by the names they were uploaded under
+            for name, media_id in uploaded.items():
+                self.state["photos"].append({"name": name, "id": media_id, "filename": name.rsplit("/", 1)[-1]})
+                self.name_cache.add(_key(name))
+            self.state["photos"].sort(key=lambda x: x["name"])
+        self.save_state()
 
-        # Do the downloads as a batch
-        # TODO this function should not have that much knowledge about local file remote internal data structures
-        new_media = self.api.batch_upload([os.path.join(x.remote.folder, x.name) for x in updates if x.action == "new"])
-        # TODO append to self.state["photos"]
+    def media_ids(self):
+        """Media IDs by the names photos are known by here and in other remotes"""
+        ids = {_key(x["name"]): x["id"] for x in self.state["photos"] if "id" in x}
+        ids.update((_key(x), ids[_key(y)]) for x, y in self.state.get("aliases", {}).items() if _key(y) in ids)
+        with self.pending_lock:
+            ids.update((_key(x), y) for x, y in self.uploaded.items())
+        return ids
 
+    def _missing_media(self, albums, ids):
+        """Uploads of album photos the library does not have yet, from the remote the album came from"""
+        uploads = {}
+        for album in albums.values():
+            source = album["remote"]
+            aliases = source.state.get("aliases", {})
+            photos = None
+            for name in album["photos"]:
+                if _key(name) in ids or _key(name) in uploads:
+                    continue
+                if photos is None:
+                    photos = {x["name"]: x for x in source.state["photos"]}
+                # Album photos are named as this remote knows them, the source may know them under another name
+                photo = photos.get(aliases.get(name, name))
+                if photo is None:
+                    logger.warning(
+                        "Remote %s: photo %s of album %s not found in %s", self.name, name, album["name"], source.name
+                    )
+                    continue
+                uploads[_key(name)] = Update(action="new", photo=photo, remote=source, name=name)
+        return list(uploads.values())
+
+    def _sync_album(self, album, ids):
+        """Create an album if needed and add photos to it by their media IDs, recording them in the state"""
+        with self.albums_lock:
+            entry = ([x for x in self.state["albums"] if x["name"] == album["name"]] or [None])[0]
+        if entry is None:
+            logger.debug("Remote %s: creating album %s", self.name, album["name"])
+            album_id = self.api.create_album(album["name"])["id"]
+            entry = {"name": album["name"], "id": album_id, "photos": []}
+            with self.albums_lock:
+                self.state["albums"].append(entry)
+        # Names by media ID, a photo known by several names is added once
+        media = {}
+        for name in album["photos"]:
+            if _key(name) in ids:
+                media.setdefault(ids[_key(name)], []).append(name)
+        for achunk in chunk(iter(media), 50):
+            if not achunk:
+                continue
+            self.api.add_to_album(entry["id"], achunk)
+            with self.albums_lock:
+                names = set(entry["photos"]).union(*[media[x] for x in achunk])
+                entry["photos"] = sorted(names)
+        logger.debug("Remote %s: added %s photos to album %s", self.name, len(media), album["name"])
+
+    def sync_albums(self, updates):
+        """Apply new_album and new_album_photo updates, albums are independent of each other and done in parallel
+
+        Photos already in the library are added by their media IDs, only photos it does not have yet get uploaded.
+        """
+        albums = {}
         for update in updates:
+            name = update.name if update.action == "new_album" else update.album_name
+            if name not in albums:
+                albums[name] = {"name": name, "photos": [], "remote": update.remote}
             if update.action == "new_album":
-                logger.info("Remote %s: creating album %s", self.name, update.name)
-                album_data = self.api.create_album(update.name)
-                # TODO append to self.state["albums"]
-                new_media = self.api.batch_upload([os.path.join(x.remote.folder, x) for x in update.photo["photos"]], album_data["id"])
-                # TODO append to self.state["photos"]
-
-        new_album_photos = [x for x in updates if x.action == "new_album_photo"]
-        updated_albums = set(x.album_name for x in new_album_photos)
-        for album in updated_albums:
-            album_id = [x["id"] for x in self.state["albums"] if x["name"] == album][0]
-            self.api.batch_upload([os.path.join(x.remote.folder, x.name) for x in new_album_photos if x.album_name == album], album_id)
+                albums[name]["photos"].extend(update.photo["photos"])
+            else:
+                albums[name]["photos"].append(update.name)
+        if not albums:
+            return
+        uploads = self._missing_media(albums, self.media_ids())
+        if uploads:
+            logger.info("Remote %s: uploading %s album photos missing in the library", self.name, len(uploads))
+            self.scheduler.run(self.put_data, uploads, retry=self.retry)
+            self.commit_data()
+        ids = self.media_ids()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=ALBUM_WORKERS) as executor:
+            futures = [executor.submit(self._sync_album, x, ids) for x in albums.values()]
+        # Photos added before an error are in the state too, so that they are not added again
+        self.save_state()
+        for future in futures:
+            future.result()
+        logger.info("Remote %s: updated %s albums", self.name, len(albums))
+
+    def get_checksum(self, name):
+        # Google may re-encode media, so no checksums are recorded or checked for it
+        return None
+
+    def do_updates(self, updates):
+        # Updates can be a stream, photos are handled a window at a time and albums once all photos are in place
+        album_updates = []
+        for window in windows(updates):
+            # Photos moved elsewhere are not moved here, they are only known under one more name
+            moves = [x for x in window if x.action == "mv"]
+            for update in moves:
+                logger.debug("Remote %s: photo %s is known as %s elsewhere", self.name, update.name, update.new_name)
+                self.add_alias(update.new_name, update.name)
+            if moves:
+                self.save_state()
+
+            # Do the uploads as a batch
+            self.scheduler.run(self.put_data, [x for x in window if x.action == "new"], retry=self.retry)
+            self.commit_data()
+            album_updates.extend(x for x in window if x.action not in ("mv", "new"))
+        self.sync_albums(album_updates)
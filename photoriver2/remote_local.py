@@ -1,23 +1,32 @@
 """Remotes implementation - state of a local folder"""
-import concurrent.futures
 import logging
 import os
 import shutil
 import re
+import concurrent.futures
 import datetime
+import threading
+import time
 
-import dateutil
-import dateutil.tz
-import dateutil.utils
-import dateutil.parser
-import requests
-
-from PIL import Image, UnidentifiedImageError
-
-from photoriver2.remote_base import BaseRemote, IMAGE_EXTENSIONS
+from photoriver2 import inotify
+from photoriver2.bandwidth import ThrottledReader
+from photoriver2.checksum import CHUNK_SIZE, copy_hashed, file_checksum
+from photoriver2.fingerprint import FingerprintIndex
+from photoriver2.metrics import METRICS
+from photoriver2.pipeline import windows
+from photoriver2.remote_base import BaseRemote, DataExpired, IMAGE_EXTENSIONS, Update
 
 logger = logging.getLogger(__name__)
 
+WATCH_MASK = (
+    inotify.IN_CLOSE_WRITE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_CREATE
+    | inotify.IN_DELETE
+    | inotify.IN_ONLYDIR
+)
+
 
 def deconflict(path):
     if not os.path.exists(path):
@@ -36,24 +45,96 @@ class LocalRemote(BaseRemote):
     """Remote representing a local folder with photos"""
 
     folder = None
+    has_fingerprints = True
+    _fingerprints = None
 
-    def __init__(self, folder, *args, **kwargs):
+    def __init__(self, folder, *args, chunk_size=CHUNK_SIZE, scan_workers=1, **kwargs):
         self.folder = folder
+        self.chunk_size = chunk_size
+        self.scan_workers = scan_workers
         super().__init__(*args, **kwargs)
 
-    def get_photos(self):
-        logger.info("Getting photos list from %s", self.folder)
+    @property
+    def fingerprints(self):
+        if self._fingerprints is None:
+            self._fingerprints = FingerprintIndex(os.path.join(self.state_dir, self.name + "_fingerprints.json"))
+        return self._fingerprints
+
+    def fingerprint(self, photo):
+        try:
+            return self.fingerprints.get(photo["name"], self._abs(photo["name"]))
+        except OSError:
+            return None
+
+    def detect_moves(self, previous_photos):
+        """Match photos gone since the previous state to new ones by their last known fingerprint"""
+        names = set(x["name"] for x in self.state["photos"])
+        gone = set(x["name"] for x in previous_photos) - names
+        if not gone:
+            return
+        known = {self.fingerprints.cached(x): x for x in gone}
+        known.pop(None, None)
+        if known:
+            for name in names - set(x["name"] for x in previous_photos):
+                old_name = known.pop(self.fingerprint({"name": name}), None)
+                if old_name:
+                    logger.debug("Remote %s: photo %s was moved to %s", self.name, old_name, name)
+                    self.record_move(old_name, name)
+        self.fingerprints.forget(gone)
+
+    def save_state(self):
+        self.fingerprints.save()
+        return super().save_state()
+
+    def _walk(self, path):
+        """os.walk that does not descend into blacklisted folders"""
+        for root, dirs, files in os.walk(path):
+            relative_root = os.path.relpath(root, self.folder)
+            self.blacklist.prune(dirs, relative_root)
+            if self.blacklist:
+                prefix = "" if relative_root == "." else relative_root + "/"
+                files = [x for x in files if not self.blacklist.matches(prefix + x)]
+            yield root, dirs, files
+
+    def _scan(self, path, recursive=True):
+        """Photos in a folder, with its subfolders if recursive"""
         photos = []
-        for root, _, files in os.walk(self.folder):
+        for root, dirs, files in self._walk(path):
+            if not recursive:
+                dirs.clear()
             for afile in files:
                 name = os.path.relpath(os.path.join(root, afile), self.folder)
                 if "." in name and name.rsplit(".", 1)[1].upper() in IMAGE_EXTENSIONS:
                     if not os.path.islink(os.path.join(root, afile)):
                         # pylint: disable=cell-var-from-loop,consider-using-with
                         photos.append({"name": name, "filename": os.path.join(root, afile)})
+        return photos
+
+    def get_photos(self):
+        logger.info("Getting photos list from %s", self.folder)
+        if self.scan_workers > 1:
+            # Folders of the top level are walked in parallel, which pays off on network and flash storage
+            dirs = next(self._walk(self.folder), (None, [], None))[1]
+            dirs = [os.path.join(self.folder, x) for x in dirs if not os.path.islink(os.path.join(self.folder, x))]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.scan_workers) as executor:
+                photos = self._scan(self.folder, recursive=False)
+                for part in executor.map(self._scan, dirs):
+                    photos.extend(part)
+        else:
+            photos = self._scan(self.folder)
         logger.info("Getting photos list from %s - done, found %s", self.folder, len(photos))
         return sorted(photos, key=lambda x: x["name"])
 
+    def _read_album(self, path, name):
+        photos = os.listdir(path)
+        # Resolve symlinks in paths of photos in albums
+        photos = [os.path.relpath(os.path.realpath(os.path.join(path, x)), self.folder) for x in photos]
+        photos = [x for x in photos if not self.blacklist.matches(x)]
+        return {
+            "name": name,
+            "photos": sorted(photos),
+        }
+
     def get_albums(self):
         logger.info("Getting albums from %s", self.folder)
         albums = []
@@ -61,29 +142,138 @@ class LocalRemote(BaseRemote):
             dirs = os.scandir(os.path.join(self.folder, "albums"))
             for adir in dirs:
                 logger.debug("Looking into album %s", adir)
-                if not adir.is_dir():
+                if not adir.is_dir() or self.blacklist.matches("albums/" + adir.name):
                     continue
-                photos = os.listdir(adir.path)
-                # Resolve symlinks in paths of photos in albums
-                photos = [os.path.relpath(os.path.realpath(os.path.join(adir.path, x)), self.folder) for x in photos]
-                albums.append(
-                    {
-                        "name": adir.name,
-                        "photos": sorted(photos),
-                    }
-                )
+                albums.append(self._read_album(adir.path, adir.name))
         logger.info("Getting albums from %s - done, found %s", self.folder, len(albums))
         return sorted(albums, key=lambda x: x["name"])
 
+    @staticmethod
+    def _is_photo(name):
+        return "." in name and name.rsplit(".", 1)[1].upper() in IMAGE_EXTENSIONS
+
+    def apply_delta(self, delta):
+        """Apply an incremental change of photo files and album folders to the state"""
+        photos = {x["name"]: x for x in self.state["photos"]}
+        for name in delta["del"]:
+            photos.pop(name, None)
+            self.name_cache.discard(name.strip().strip("/").upper())
+        for name in delta["new"]:
+            photos[name] = {"name": name, "filename": self._abs(name)}
+            self.name_cache.add(name.strip().strip("/").upper())
+        self.state["photos"] = sorted(photos.values(), key=lambda x: x["name"])
+        albums = {x["name"]: x for x in self.state["albums"]}
+        for name in delta["albums"]:
+            path = self._abs(os.path.join("albums", name))
+            if os.path.isdir(path):
+                albums[name] = self._read_album(path, name)
+            else:
+                albums.pop(name, None)
+        self.state["albums"] = sorted(albums.values(), key=lambda x: x["name"])
+        self.save_state()
+
+    def _watch_tree(self, notify, path, delta):
+        """Watch a directory tree, adding photos that are already in it to the delta"""
+        for root, _, files in self._walk(path):
+            notify.add_watch(root, WATCH_MASK)
+            for afile in files:
+                name = os.path.relpath(os.path.join(root, afile), self.folder)
+                if self._is_photo(afile) and not os.path.islink(os.path.join(root, afile)):
+                    delta["new"].add(name)
+
+    def _collect_event(self, notify, delta, directory, mask, afile):
+        path = os.path.join(directory, afile)
+        name = os.path.relpath(path, self.folder)
+        if self.blacklist.matches(name):
+            return
+        created = mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO)
+        removed = mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM)
+        if name.split(os.sep)[0] == "albums":
+            if mask & inotify.IN_ISDIR and created:
+                notify.add_watch(path, WATCH_MASK)
+            if len(name.split(os.sep)) > 1:
+                delta["albums"].add(name.split(os.sep)[1])
+        elif mask & inotify.IN_ISDIR:
+            if created:
+                self._watch_tree(notify, path, delta)
+            elif removed:
+                prefix = name + os.sep
+                delta["del"].update(x["name"] for x in self.state["photos"] if x["name"].startswith(prefix))
+                delta["new"] = set(x for x in delta["new"] if not x.startswith(prefix))
+        elif self._is_photo(afile):
+            if mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO) and not os.path.islink(path):
+                delta["new"].add(name)
+                delta["del"].discard(name)
+            elif removed:
+                delta["del"].add(name)
+                delta["new"].discard(name)
+
+    def watch(self, on_change, quiet_period=30, stop=None, lock=None):
+        """Follow inotify events until stop is set, applying them to the state incrementally
+
+        Directories are registered once at the start. Events get coalesced into a delta of new and deleted photos
+        and changed albums, which is applied and passed to on_change(delta) after quiet_period seconds without events.
+        The state is only read and changed holding lock, shared with syncs of the same remote running meanwhile.
+        """
+        stop = stop or threading.Event()
+        lock = lock or threading.Lock()
+        notify = inotify.Inotify()
+        delta = {"new": set(), "del": set(), "albums": set()}
+        try:
+            for root, _, _ in self._walk(self.folder):
+                notify.add_watch(root, WATCH_MASK)
+            logger.info("Remote %s: watching %s folders for changes", self.name, len(notify.paths))
+            last_event = None
+            while not stop.is_set():
+                events = notify.read_events(timeout=min(quiet_period, 1))
+                for directory, mask, afile in events:
+                    with lock:
+                        if mask & inotify.IN_Q_OVERFLOW:
+                            logger.warning("Remote %s: too many changes at once, rescanning", self.name)
+                            self.get_new_state()
+                            delta = {
+                                "new": set(),
+                                "del": set(),
+                                "albums": set(x["name"] for x in self.state["albums"]),
+                            }
+                            continue
+                        self._collect_event(notify, delta, directory, mask, afile)
+                if events:
+                    last_event = time.monotonic()
+                elif last_event and time.monotonic() - last_event >= quiet_period:
+                    last_event = None
+                    if any(delta.values()):
+                        logger.info(
+                            "Remote %s: %s new, %s deleted photos, %s changed albums",
+                            self.name,
+                            *map(len, delta.values()),
+                        )
+                        with lock:
+                            self.apply_delta(delta)
+                        on_change(delta)
+                        delta = {"new": set(), "del": set(), "albums": set()}
+        finally:
+            notify.close()
+
     def get_data(self, photo):  # TODO: replace with a context manager generator
         return open(photo["filename"], "rb")
 
+    def get_size(self, photo):
+        try:
+            return os.path.getsize(self._abs(photo["name"]))
+        except OSError:
+            return None
+
     def get_fixes(self):
+        # Slow to import and only needed here, runs without fixes do not pay for them
+        import dateutil.tz  # pylint: disable=import-outside-toplevel
+        from PIL import Image, UnidentifiedImageError  # pylint: disable=import-outside-toplevel
+
         fixes = []
         default_tz = dateutil.tz.gettz()
         Image.MAX_IMAGE_PIXELS = 150000000
-        
-        for root, _, files in os.walk(self.folder):
+
+        for root, _, files in self._walk(self.folder):
             for afile in files:
                 if "." in afile and afile.rsplit(".", 1)[1].upper() in IMAGE_EXTENSIONS:
                     full_path = os.path.join(root, afile)
@@ -119,9 +309,8 @@ class LocalRemote(BaseRemote):
                             }
                         )
 
-
         # Files in albums/ should be symlinks
-        for root, _, files in os.walk(os.path.join(self.folder, "albums")):
+        for root, _, files in self._walk(os.path.join(self.folder, "albums")):
             for afile in files:
                 if "." in afile and afile.rsplit(".", 1)[1].upper() in IMAGE_EXTENSIONS:
                     full_path = os.path.join(root, afile)
@@ -135,10 +324,27 @@ class LocalRemote(BaseRemote):
                         )
         return fixes
 
+    def verify(self):
+        problems = []
+        checksums = self.state.get("checksums", {})
+        logger.info("Remote %s: verifying %s of %s photos", self.name, len(checksums), len(self.state["photos"]))
+        for name, checksum in sorted(checksums.items()):
+            try:
+                actual = file_checksum(self._abs(name), chunk_size=self.chunk_size)
+            except OSError as error:
+                problems.append(f"{name}: {error.strerror}")
+                continue
+            if actual != checksum:
+                problems.append(f"{name}: checksum {actual} does not match {checksum}")
+        METRICS.add(self.name, "items", len(checksums))
+        METRICS.add(self.name, "errors", len(problems))
+        return problems
+
     def _abs(self, path):
         return os.path.join(self.folder, path)
 
     def do_fixes(self, fixes):
+        renamed = {}
         for afix in fixes:
             if afix["action"] == "symlink":
                 # Move the file over to new location (making parent folders as needed)
@@ -149,35 +355,161 @@ class LocalRemote(BaseRemote):
                     os.path.relpath(self._abs(afix["to"]), os.path.dirname(self._abs(afix["name"]))),
                     self._abs(afix["name"]),
                 )
+                self.fingerprints.move(afix["name"], afix["to"])
+                self.record_move(afix["name"], afix["to"])
             elif afix["action"] == "rename":
                 os.makedirs(self._abs(os.path.dirname(afix["to"])), exist_ok=True)
                 os.rename(self._abs(afix["name"]), self._abs(afix["to"]))
+                self.fingerprints.move(afix["name"], afix["to"])
+                self.record_move(afix["name"], afix["to"])
+                renamed[afix["name"]] = afix["to"]
+        if renamed:
+            # Photos in albums can be renamed too
+            self._relink_albums(renamed)
 
     def put_data(self, update):
         """Put a photo from other remote into this one"""
         if not os.path.exists(self._abs(update.name)):
-            logger.info("Remote %s: adding photo %s", self.name, update.name)
+            logger.debug("Remote %s: adding photo %s", self.name, update.name)
             os.makedirs(self._abs(os.path.dirname(update.name)), exist_ok=True)
+            # Get the source first so that an expired source does not leave an empty file behind
+            infile = update.data()
             try:
                 with open(self._abs(update.name), "wb") as outfile:
-                    infile = update.data()
-                    outfile.write(infile.read())
+                    size, checksum = copy_hashed(
+                        ThrottledReader(infile, [self.bandwidth]), outfile, chunk_size=self.chunk_size
+                    )
                     infile.close()
-            except (requests.exceptions.HTTPError, OSError, IOError):
+            except OSError:  # requests errors are OSErrors too
+                METRICS.add(self.name, "errors")
                 os.remove(self._abs(update.name))
                 raise
+            expected = update.remote.get_checksum(update.name) if update.remote else None
+            if expected and expected != checksum:
+                logger.error(
+                    "Remote %s: checksum of %s does not match %s, removing it",
+                    self.name,
+                    update.name,
+                    update.remote.name,
+                )
+                METRICS.add(self.name, "errors")
+                os.remove(self._abs(update.name))
+                return
+            self.record_checksum(update.name, checksum)
+            METRICS.add(self.name, "items")
+            METRICS.add(self.name, "bytes", size)
+
+    def commit_data(self):
+        # Keep checksums of photos put outside of do_updates, like by a fan-out push
+        self.save_state()
+
+    def _put_data_or_expired(self, update):
+        """Put a photo, returning the update back if the source data has expired"""
+        try:
+            self.put_data(update)
+        except DataExpired:
+            return update
+        return None
+
+    def _refresh_expired(self, expired):
+        """Refresh source metadata only for the expired updates, dropping photos that are gone"""
+        refreshed = []
+        for source in set(x.remote for x in expired):
+            updates = [x for x in expired if x.remote is source]
+            fresh = {x["name"]: x for x in source.refresh_photos([x.photo for x in updates])}
+            for update in updates:
+                if update.name in fresh:
+                    update.photo = fresh[update.name]
+                    refreshed.append(update)
+                else:
+                    logger.warning("Remote %s: photo %s is gone from %s", self.name, update.name, source.name)
+        return refreshed
 
-    def do_updates(self, updates):
+    def _relink_albums(self, moves):
+        """Point album symlinks of moved photos to their new location, moves are {old: new name}"""
+        targets = {os.path.realpath(self._abs(x)): y for x, y in moves.items()}
+        for root, _, files in self._walk(self._abs("albums")):
+            for afile in files:
+                link = os.path.join(root, afile)
+                target = targets.get(os.path.realpath(link)) if os.path.islink(link) else None
+                if target:
+                    os.remove(link)
+                    os.symlink(os.path.relpath(self._abs(target), root), link)
+
+    def move_photo(self, update):
+        """Apply a "mv" update as a rename, returns False if the photo is not here to be renamed"""
+        old_path, new_path = self._abs(update.name), self._abs(update.new_name)
+        if not os.path.isfile(old_path) or os.path.islink(old_path) or os.path.lexists(new_path):
+            return False
+        logger.debug("Remote %s: moving photo %s to %s", self.name, update.name, update.new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.rename(old_path, new_path)
+        self.fingerprints.move(update.name, update.new_name)
+        self.record_move(update.name, update.new_name)
+        return True
+
+    def _move_photos(self, moves):
+        """Moves are renames, unless the photo to rename is gone meanwhile, returns updates to download instead"""
+        pending = []
+        moved = {"new": set(), "del": set(), "albums": set()}
+        for update in moves:
+            if self.move_photo(update):
+                moved["new"].add(update.new_name)
+                moved["del"].add(update.name)
+                moved["albums"].update(x["name"] for x in self.state["albums"] if update.name in x["photos"])
+            else:
+                pending.append(Update(action="new", photo=update.photo, remote=update.remote))
+        if moved["new"]:
+            self._relink_albums({x.name: x.new_name for x in moves if x.name in moved["del"]})
+            self.apply_delta(moved)
+        return pending
+
+    def _download(self, pending, max_attempts):
+        """Do the downloads as a batch, re-queueing only items whose source data expired, returns the attempts"""
+        attempts = 0
+        while pending:
+            expired = []
+            # Work in windows so that short-lived source data is prepared just before use
+            pending = self.scheduler.order(pending)
+            for window in windows(pending):
+                for source in set(x.remote for x in window):
+                    source.prepare_data([x for x in window if x.remote is source])
+                expired.extend(x for x in self.scheduler.run(self._put_data_or_expired, window, retry=self.retry) if x)
+            attempts += 1
+            if not expired:
+                break
+            if attempts >= max_attempts:
+                logger.error(
+                    "Remote %s: giving up on %s expired downloads: %s",
+                    self.name,
+                    len(expired),
+                    [x.name for x in expired],
+                )
+                METRICS.add(self.name, "errors", len(expired))
+                break
+            logger.info("Remote %s: %s of %s downloads expired, refreshing", self.name, len(expired), len(pending))
+            METRICS.add(self.name, "retries", len(expired))
+            pending = self._refresh_expired(expired)
+        return attempts
 
-        # Do the downloads as a batch
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            list(executor.map(self.put_data, [x for x in updates if x.action == "new"]))
+    def do_updates(self, updates, max_attempts=3):
+        # Updates can be a stream, photos are handled a window at a time and albums once all photos are in place
+        album_updates = []
+        downloaded = False
+        for window in windows(updates):
+            pending = self._move_photos([x for x in window if x.action == "mv"])
+            pending += [x for x in window if x.action == "new"]
+            downloaded = self._download(pending, max_attempts) > 0 or downloaded
+            album_updates.extend(x for x in window if x.action not in ("mv", "new"))
+        if downloaded:
+            # Keep checksums of the new photos
+            self.save_state()
 
-        for update in updates:
+        for update in album_updates:
             if update.action == "new_album":
                 album_path = self._abs(os.path.join("albums", update.name))
                 if not os.path.exists(album_path):
-                    logger.info("Remote %s: creating album %s", self.name, update.name)
+                    logger.debug("Remote %s: creating album %s", self.name, update.name)
                     os.makedirs(album_path)
                     for aphoto in update.photo["photos"]:
                         if not os.path.exists(os.path.join(album_path, os.path.basename(aphoto))):
@@ -192,7 +524,7 @@ class LocalRemote(BaseRemote):
                     if os.path.realpath(os.path.join(album_path, image)) == self._abs(update.name):
                         found = True
                 if not found:
-                    logger.info("Remote %s: adding photos %s to album %s", self.name, update.name, update.album_name)
+                    logger.debug("Remote %s: adding photos %s to album %s", self.name, update.name, update.album_name)
                     link_path = os.path.join(album_path, os.path.basename(update.name))
                     link_path = deconflict(link_path)
                     os.symlink(
@@ -0,0 +1,177 @@
+"""Remotes implementation - photo collections held in memory, for load testing the sync engine"""
+import hashlib
+import io
+import logging
+import random
+import threading
+
+from datetime import datetime, timedelta
+
+from photoriver2.bandwidth import ThrottledReader
+from photoriver2.checksum import copy_hashed
+from photoriver2.metrics import METRICS
+from photoriver2.pipeline import windows
+from photoriver2.remote_base import BaseRemote
+
+logger = logging.getLogger(__name__)
+
+
+def photo_names(photos, start=datetime(2000, 1, 1), days=365 * 20, misplaced=0.1, seed=1):
+    """Deterministic list of (name, EXIF date) for a library of the given size
+
+    Photos are spread evenly over days after start. A misplaced fraction of them is put in an import folder
+    instead of its YYYY/MM/DD location, so that the fixes phase has work to do.
+    """
+    rnd = random.Random(seed)
+    result = []
+    for i in range(photos):
+        date = start + timedelta(seconds=rnd.randrange(days * 24 * 3600))
+        filename = f"IMG_{i:07d}.jpeg"
+        if rnd.random() < misplaced:
+            name = f"import/{i % 100:02d}/{filename}"
+        else:
+            name = f"{date.year:04d}/{date.month:02d}/{date.day:02d}/{filename}"
+        result.append((name, date))
+    return result
+
+
+def date_name(name, date):
+    return f"{date.year:04d}/{date.month:02d}/{date.day:02d}/{name.rsplit('/', 1)[-1]}"
+
+
+class MemoryRemote(BaseRemote):
+    """Remote with photos and albums in dicts, nothing is written to disk"""
+
+    def __init__(self, *args, **kwargs):
+        # Photo data by name, or the key of data generated on demand by generate(), which is kept when renamed
+        self.data = {}
+        # Capture dates of photos by name, used by the fixes phase like EXIF dates
+        self.dates = {}
+        self.albums = {}
+        self.lock = threading.Lock()
+        self.populate()
+        super().__init__(*args, **kwargs)
+
+    def populate(self):
+        """Fill data, dates and albums of a new remote"""
+        return
+
+    def load_old_state(self, state_file):
+        return self.get_new_state()
+
+    def save_state(self):
+        return False
+
+    def generate(self, key):
+        raise KeyError(key)
+
+    def generated_size(self, key):
+        return len(self.generate(key))
+
+    def _read(self, name):
+        data = self.data[name]
+        return self.generate(data) if isinstance(data, str) else data
+
+    def get_photos(self):
+        return [{"name": x} for x in sorted(self.data)]
+
+    def get_albums(self):
+        return [{"name": x, "photos": sorted(y)} for x, y in sorted(self.albums.items())]
+
+    def get_data(self, photo):
+        return io.BytesIO(self._read(photo["name"]))
+
+    def get_size(self, photo):
+        data = self.data.get(photo["name"])
+        if data is None:
+            return None
+        return self.generated_size(data) if isinstance(data, str) else len(data)
+
+    def get_fixes(self):
+        fixes = []
+        for name, date in sorted(self.dates.items()):
+            correct_name = date_name(name, date)
+            if correct_name != name:
+                fixes.append({"action": "rename", "name": name, "to": correct_name})
+        return fixes
+
+    def _rename(self, name, new_name):
+        """Move data, date and album membership of a photo to a new name, holding the lock"""
+        self.data[new_name] = self.data.pop(name)
+        if name in self.dates:
+            self.dates[new_name] = self.dates.pop(name)
+        for photos in self.albums.values():
+            if name in photos:
+                photos.discard(name)
+                photos.add(new_name)
+
+    def do_fixes(self, fixes):
+        for afix in fixes:
+            if afix["action"] != "rename" or afix["name"] not in self.data:
+                continue
+            with self.lock:
+                self._rename(afix["name"], afix["to"])
+            self.record_move(afix["name"], afix["to"])
+
+    def put_data(self, update):
+        """Put a photo from other remote into this one"""
+        if update.name in self.data:
+            return
+        infile = update.data()
+        outfile = io.BytesIO()
+        try:
+            size, checksum = copy_hashed(ThrottledReader(infile, [self.bandwidth]), outfile)
+        finally:
+            infile.close()
+        with self.lock:
+            self.data[update.name] = outfile.getvalue()
+        self.record_checksum(update.name, checksum)
+        METRICS.add(self.name, "items")
+        METRICS.add(self.name, "bytes", size)
+
+    def do_updates(self, updates):
+        album_updates = []
+        for window in windows(updates):
+            for update in [x for x in window if x.action == "mv"]:
+                with self.lock:
+                    if update.name in self.data and update.new_name not in self.data:
+                        self._rename(update.name, update.new_name)
+            self.scheduler.run(self.put_data, [x for x in window if x.action == "new"], retry=self.retry)
+            album_updates.extend(x for x in window if x.action not in ("mv", "new"))
+        for update in album_updates:
+            if update.action == "new_album":
+                self.albums.setdefault(update.name, set()).update(x for x in update.photo["photos"] if x in self.data)
+            elif update.action == "new_album_photo" and update.album_name in self.albums:
+                self.albums[update.album_name].add(update.name)
+        self.get_new_state()
+
+
+class SyntheticRemote(MemoryRemote):
+    """Memory remote starting with a deterministic library of generated photos and albums
+
+    Photo data is only generated when it is read, so that libraries of millions of photos fit in memory.
+    """
+
+    def __init__(self, *args, photos=1000, albums=10, album_size=20, photo_size=64 * 1024, seed=1, **kwargs):
+        self.library = {"photos": photos, "albums": albums, "album_size": album_size, "seed": seed}
+        self.photo_size = photo_size
+        super().__init__(*args, **kwargs)
+
+    def populate(self):
+        names = photo_names(self.library["photos"], seed=self.library["seed"])
+        self.data = {x: x for x, _ in names}
+        self.dates = dict(names)
+        rnd = random.Random(self.library["seed"])
+        for i in range(self.library["albums"]):
+            photos = rnd.sample(names, min(self.library["album_size"], len(names)))
+            self.albums[f"Album {i:04d}"] = set(x for x, _ in photos)
+
+    def generated_size(self, key):
+        """Between a half and one and a half photo_size, always the same for the same key"""
+        seed = hashlib.sha256(key.encode("utf8")).digest()
+        return self.photo_size // 2 + int.from_bytes(seed[:4], "big") % (self.photo_size + 1)
+
+    def generate(self, key):
+        seed = hashlib.sha256(key.encode("utf8")).digest()
+        size = self.generated_size(key)
+        return (seed * (size // len(seed) + 1))[:size]
@@ -0,0 +1,101 @@
+"""Remotes implementation - state of another photoriver2 node, served by its --serve option"""
+import logging
+
+import requests
+
+from photoriver2.bandwidth import LIMITS, ThrottledReader
+from photoriver2.remote_base import BaseRemote
+
+logger = logging.getLogger(__name__)
+
+
+class PeerRemote(BaseRemote):
+    """Remote representing the base of another node, only changes since the last sync are fetched"""
+
+    _photos = None
+    _albums = None
+    checksums = None
+    read_only = True
+
+    def __init__(self, url, *args, timeout=60, **kwargs):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Epoch and generation of the state of the peer that the photos in our state correspond to
+        self.position = None
+        super().__init__(*args, **kwargs)
+
+    def load_old_state(self, state_file):
+        state = super().load_old_state(state_file)
+        self.position = self.position or state.get("peer")
+        return state
+
+    def save_state(self):
+        if self.position:
+            self.state["peer"] = self.position
+        return super().save_state()
+
+    def _fetch_state(self):
+        """Photos and albums of the peer, updated with the changes since the previous sync"""
+        position = self.position or {"epoch": None, "generation": 0}
+        response = self.session.get(
+            self.url + "/state",
+            params={"since": position["generation"], "epoch": position["epoch"]},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        delta = response.json()
+        if delta["full"]:
+            logger.info("Remote %s: got full state of generation %s", self.name, delta["generation"])
+            photos = delta["photos"]
+            albums = delta["albums"]
+        else:
+            logger.info(
+                "Remote %s: got changes from generation %s to %s, %s new and %s removed photos",
+                self.name,
+                position["generation"],
+                delta["generation"],
+                len(delta["added"]),
+                len(delta["removed"]),
+            )
+            changed = set(delta["removed"]) | set(x["name"] for x in delta["added"])
+            photos = [x for x in self.state["photos"] if x["name"] not in changed] + delta["added"]
+            changed = set(delta["removed_albums"]) | set(x["name"] for x in delta["albums"])
+            albums = [x for x in self.state["albums"] if x["name"] not in changed] + delta["albums"]
+        self.position = {"epoch": delta["epoch"], "generation": delta["generation"]}
+        return sorted(photos, key=lambda x: x["name"]), sorted(albums, key=lambda x: x["name"])
+
+    def stream_new_state(self, no_state_cache=False):
+        if no_state_cache:
+            self.position = None
+        self._photos, self._albums = self._fetch_state()
+        return super().stream_new_state(no_state_cache)
+
+    def get_photos(self):
+        return self._photos
+
+    def get_albums(self):
+        return self._albums
+
+    def get_size(self, photo):
+        return photo.get("size")
+
+    def generate_name_cache(self):
+        # Called whenever the state is replaced, checksums recorded by the peer come with its photos
+        self.checksums = {x["name"]: x["checksum"] for x in self.state["photos"] if "checksum" in x}
+        return super().generate_name_cache()
+
+    def get_checksum(self, name):
+        return self.checksums.get(name) or super().get_checksum(name)
+
+    def get_data(self, photo):
+        response = self.session.get(
+            self.url + "/photo", params={"name": photo["name"]}, stream=True, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return ThrottledReader(response.raw, [LIMITS["download"], self.bandwidth])
+
+    def do_updates(self, updates):
+        # The peer pulls from its own side, a node only ever changes its own folders
+        if updates:
+            logger.info("Remote %s: peers are read-only, skipping %s updates", self.name, len(updates))
@@ -0,0 +1,84 @@
+"""Persistent queue of failed transfers with backoff and a dead-letter list"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Retries within one run wait RETRY_WAIT * 2^n seconds
+RUN_RETRIES = 2
+RETRY_WAIT = 1
+# Later runs wait BACKOFF * 2^n seconds after a failure, at most MAX_BACKOFF
+BACKOFF = 5 * 60
+MAX_BACKOFF = 24 * 3600
+# Items failing this many times go to the dead-letter list and are not tried again
+MAX_ATTEMPTS = 10
+
+
+def update_key(update):
+    return f"{getattr(update.remote, 'name', None)}:{update.name}"
+
+
+class RetryQueue:
+    """Failed transfers of a remote, kept in a JSON file between runs"""
+
+    def __init__(self, queue_file):
+        self.queue_file = queue_file
+        self.lock = threading.Lock()
+        self.items = {}
+        self.dead = {}
+        self.changed = False
+        if os.path.exists(queue_file):
+            with open(queue_file) as infile:
+                data = json.load(infile)
+            self.items = data.get("items", {})
+            self.dead = data.get("dead", {})
+
+    def allowed(self, update, now=None):
+        """False for updates in the dead-letter list or still waiting for their backoff"""
+        key = update_key(update)
+        with self.lock:
+            if key in self.dead:
+                return False
+            return key not in self.items or (now or time.time()) >= self.items[key]["next"]
+
+    def failed(self, update, error):
+        """Count a failed attempt, returns False if the update went to the dead-letter list"""
+        key = update_key(update)
+        with self.lock:
+            item = self.items.pop(key, {"action": update.action, "name": update.name, "attempts": 0})
+            item["source"] = getattr(update.remote, "name", None)
+            item["attempts"] += 1
+            item["error"] = f"{type(error).__name__}: {error}"
+            item["next"] = time.time() + min(BACKOFF * 2 ** (item["attempts"] - 1), MAX_BACKOFF)
+            self.changed = True
+            if item["attempts"] >= MAX_ATTEMPTS:
+                self.dead[key] = item
+                return False
+            self.items[key] = item
+            return True
+
+    def succeeded(self, update):
+        key = update_key(update)
+        with self.lock:
+            if self.items.pop(key, None):
+                self.changed = True
+
+    def clear_dead(self):
+        """Give updates in the dead-letter list another chance"""
+        with self.lock:
+            for key, item in self.dead.items():
+                self.items[key] = dict(item, attempts=0, next=0)
+            self.changed = self.changed or bool(self.dead)
+            self.dead = {}
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            with open(self.queue_file + ".tmp", "w") as outfile:
+                json.dump({"items": self.items, "dead": self.dead}, outfile, indent=1)
+            os.replace(self.queue_file + ".tmp", self.queue_file)
+            self.changed = False
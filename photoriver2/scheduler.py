@@ -0,0 +1,148 @@
+"""Size-aware scheduling of photo transfers"""
+import concurrent.futures
+import logging
+import time
+
+from photoriver2.concurrency import ConcurrencyController
+from photoriver2.metrics import METRICS
+from photoriver2.progress import PROGRESS
+from photoriver2.retry import RETRY_WAIT, RUN_RETRIES
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("newest", "small-first", "interleaved", "name")
+# Files from this size on go to the large file lane
+LARGE_SIZE = 32 * 1024 * 1024
+
+
+def order(items, policy, size_of, name_of):
+    """Order items for transfer according to the policy
+
+    newest - most recent first, names start with YYYY/MM/DD so the order of names is the order of dates
+    small-first - smallest first, files of unknown size count as small
+    interleaved - in name order, alternating small and large files
+    name - in name order
+    """
+    if policy not in POLICIES:
+        raise RuntimeError(f"Unknown transfer schedule {policy}, use one of {', '.join(POLICIES)}")
+    items = sorted(items, key=name_of)
+    if policy == "newest":
+        return items[::-1]
+    if policy == "small-first":
+        return sorted(items, key=lambda x: size_of(x) or 0)
+    if policy == "interleaved":
+        small = [x for x in items if (size_of(x) or 0) < LARGE_SIZE]
+        large = [x for x in items if (size_of(x) or 0) >= LARGE_SIZE]
+        result = []
+        for i in range(max(len(small), len(large))):
+            result.extend(x[i] for x in (small, large) if i < len(x))
+        return result
+    return items
+
+
+def update_size(update):
+    if update.photo is None or update.remote is None:
+        return None
+    return update.remote.get_size(update.photo)
+
+
+def update_name(update):
+    return (update.photo or {}).get("created") or update.name
+
+
+class Scheduler:
+    """Runs transfers in a policy order with separate worker lanes for small and large files
+
+    Large files get their own workers, so that a few big videos can not hold all workers while many small photos
+    wait. Without large workers all files share one lane. The number of workers of the small file lane adapts to
+    the measured throughput between min_workers and max_workers.
+    """
+
+    def __init__(
+        self, name, policy="newest", workers=5, min_workers=1, max_workers=10, large_workers=2, large_size=LARGE_SIZE
+    ):
+        if policy not in POLICIES:
+            raise RuntimeError(f"Unknown transfer schedule {policy}, use one of {', '.join(POLICIES)}")
+        self.name = name
+        self.policy = policy
+        self.concurrency = ConcurrencyController(
+            name, min_workers=min_workers, max_workers=max_workers, workers=workers
+        )
+        self.large_workers = large_workers
+        self.large_size = large_size
+
+    def order(self, updates):
+        return order(updates, self.policy, update_size, update_name)
+
+    def _run_lanes(self, func, updates, sizes, progress):
+        """Run func over updates in both lanes, returns {id(update): result}, exceptions are results too"""
+
+        def _run(update):
+            result = func(update)
+            progress.add(sizes[id(update)])
+            return result
+
+        def _run_adaptive(update):
+            with self.concurrency.slot():
+                result = _run(update)
+            self.concurrency.record(sizes[id(update)])
+            return result
+
+        large = [x for x in updates if self.large_workers and (sizes[id(x)] or 0) >= self.large_size]
+        small = [x for x in updates if not self.large_workers or (sizes[id(x)] or 0) < self.large_size]
+        futures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency.max_workers) as small_lane:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(self.large_workers, 1)) as large_lane:
+                futures.update((id(x), large_lane.submit(_run, x)) for x in large)
+                futures.update((id(x), small_lane.submit(_run_adaptive, x)) for x in small)
+        return {x: y.exception() or y.result() for x, y in futures.items()}
+
+    def run(self, func, updates, retry=None):
+        """Call func(update) for all updates, returns the results
+
+        Without a retry queue the first error is raised. With one, failed updates are retried a few times with
+        backoff, then recorded in the queue with None as their result, and updates the queue holds back are skipped.
+        The queue counts one failure per run, however often an update was tried in it.
+        """
+        if retry is not None:
+            held = [x for x in updates if not retry.allowed(x)]
+            if held:
+                logger.info("Remote %s: skipping %s transfers waiting in the retry queue", self.name, len(held))
+            updates = [x for x in updates if retry.allowed(x)]
+        if not updates:
+            return []
+        sizes = {id(x): update_size(x) for x in updates}
+        updates = order(updates, self.policy, lambda x: sizes[id(x)], update_name)
+        # Transfers of all windows of a phase add up to one progress report
+        progress = PROGRESS.get(self.name, METRICS.current_phase)
+        progress.expect(len(updates), sum(x or 0 for x in sizes.values()))
+        results = self._run_lanes(func, updates, sizes, progress)
+        if retry is None:
+            for result in results.values():
+                if isinstance(result, Exception):
+                    raise result
+            return [results[id(x)] for x in updates]
+
+        failed = [x for x in updates if isinstance(results[id(x)], Exception)]
+        for attempt in range(RUN_RETRIES):
+            if not failed:
+                break
+            for update in failed:
+                logger.warning("Remote %s: transfer of %s failed: %s", self.name, update.name, results[id(update)])
+            METRICS.add(self.name, "retries", len(failed))
+            time.sleep(RETRY_WAIT * 2 ** attempt)
+            results.update(self._run_lanes(func, failed, sizes, progress))
+            failed = [x for x in failed if isinstance(results[id(x)], Exception)]
+        for update in updates:
+            result = results[id(update)]
+            if not isinstance(result, Exception):
+                retry.succeeded(update)
+            elif retry.failed(update, result):
+                logger.warning(
+                    "Remote %s: transfer of %s failed, trying again in a later run: %s", self.name, update.name, result
+                )
+            else:
+                logger.error("Remote %s: giving up on transfer of %s: %s", self.name, update.name, result)
+                METRICS.add(self.name, "errors")
+        retry.save()
+        return [None if isinstance(results[id(x)], Exception) else results[id(x)] for x in updates]
@@ -12,7 +12,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/aigarius/photoriver2",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["tests", "benchmarks"]),
     install_requires=["requests"],
     classifiers=[
         "Programming Language :: Python :: 3",
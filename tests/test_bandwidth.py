@@ -0,0 +1,59 @@
+"""Test bandwidth limits"""
+import threading
+import time
+
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+
+from photoriver2.bandwidth import ThrottledReader, TokenBucket, parse_rate
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("", None),
+        ("0", None),
+        ("unlimited", None),
+        ("500", 500),
+        ("500K", 500 * 1024),
+        ("2MB/s", 2 * 1024 ** 2),
+        ("1.5G", 1.5 * 1024 ** 3),
+    ],
+)
+def test_parse_rate(text, expected):
+    assert parse_rate(text) == expected
+
+
+def test_parse_rate_invalid():
+    with pytest.raises(RuntimeError):
+        parse_rate("fast")
+
+
+def test_schedule():
+    bucket = TokenBucket("10M,08:00-23:00=1M,23:30-06:00=0")
+    assert bucket.rate(datetime(2021, 1, 1, 12, 0)) == 1024 ** 2
+    assert bucket.rate(datetime(2021, 1, 1, 23, 10)) == 10 * 1024 ** 2
+    assert bucket.rate(datetime(2021, 1, 1, 23, 45)) is None
+    assert bucket.rate(datetime(2021, 1, 1, 2, 0)) is None
+    assert TokenBucket().rate() is None
+
+
+def test_shared_rate():
+    """Threads reading through one bucket share its rate"""
+    bucket = TokenBucket("100K")
+
+    def _read():
+        reader = ThrottledReader(BytesIO(b"x" * 100 * 1024), [bucket, None])
+        while reader.read(10 * 1024):
+            pass
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=_read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 300K at 100K/s with 100K of burst allowance after an idle period
+    assert 1.5 < time.monotonic() - start < 3.5
@@ -0,0 +1,34 @@
+"""Test the blacklist matcher"""
+import pytest
+
+from photoriver2.blacklist import Blacklist
+
+
+@pytest.mark.parametrize(
+    "patterns,path,expected",
+    [
+        ("", "2019/01/01/IMG1.JPG", False),
+        ("19*,200*,201*,2020*", "2019/01/01/IMG1.JPG", True),
+        ("19*,200*,201*,2020*", "2021/01/01/IMG1.JPG", False),
+        ("2021/01", "2021/01/01/IMG1.JPG", True),
+        ("2021/01", "2021/010/01/IMG1.JPG", False),
+        (" /2021/01/ ,", "2021/01", True),
+        ("*.MOV", "2021/01/01/VID1.MOV", True),
+        ("*.MOV", "2021/01/01/IMG1.JPG", False),
+        ("albums/Private*", "albums/Private stuff", True),
+        ("albums/Private*", "albums/Public", False),
+        ("2021/0[1-3]", "2021/02/01/IMG1.JPG", True),
+    ],
+)
+def test_matches(patterns, path, expected):
+    assert Blacklist(patterns).matches(path) == expected
+
+
+def test_prune():
+    blacklist = Blacklist("201*,2021/01")
+    dirs = ["2019", "2020", "2021", "albums"]
+    blacklist.prune(dirs, ".")
+    assert dirs == ["2020", "2021", "albums"]
+    dirs = ["01", "02"]
+    blacklist.prune(dirs, "2021")
+    assert dirs == ["02"]
@@ -0,0 +1,20 @@
+"""Test checksums computed during transfers"""
+import hashlib
+import os
+
+from io import BytesIO
+
+from photoriver2.checksum import copy_hashed, data_checksum, file_checksum
+
+
+def test_copy_hashed(tmpdir):
+    data = os.urandom(3000)
+    outfile = BytesIO()
+    size, checksum = copy_hashed(BytesIO(data), outfile, chunk_size=1024)
+    assert outfile.getvalue() == data
+    assert size == 3000
+    assert checksum == "sha256:" + hashlib.sha256(data).hexdigest()
+    assert data_checksum(data) == checksum
+    with open(os.path.join(tmpdir, "IMG1.JPG"), "wb") as outfile:
+        outfile.write(data)
+    assert file_checksum(os.path.join(tmpdir, "IMG1.JPG"), chunk_size=1024) == checksum
@@ -0,0 +1,68 @@
+"""Test the adaptive concurrency controller"""
+import threading
+import time
+
+from unittest.mock import patch
+
+import pytest
+
+from photoriver2.concurrency import ConcurrencyController
+
+
+@pytest.fixture(name="clock")
+def fixture_clock():
+    with patch("photoriver2.concurrency.time") as mock_time:
+        mock_time.now = 0.0
+        mock_time.monotonic.side_effect = lambda: mock_time.now
+        yield mock_time
+
+
+def test_bounds():
+    assert ConcurrencyController("local", min_workers=2, max_workers=4, workers=10).limit == 4
+    with pytest.raises(RuntimeError):
+        ConcurrencyController("local", min_workers=5, max_workers=4)
+
+
+def test_errors_halve(clock):
+    controller = ConcurrencyController("local", min_workers=1, max_workers=10, workers=8, interval=1)
+    for _ in range(5):
+        controller.record(1000)
+    controller.throttled()
+    clock.now = 1.0
+    controller.record(1000)
+    assert controller.limit == 4
+
+
+def test_converges(clock):
+    """Throughput peaking at 6 workers makes the controller settle around 6"""
+    controller = ConcurrencyController("local", min_workers=1, max_workers=20, workers=1, interval=1)
+    limits = []
+    for _ in range(40):
+        clock.now += 1
+        workers = controller.limit
+        controller.record(100 * workers if workers <= 6 else 600 - 50 * (workers - 6))
+        limits.append(controller.limit)
+    assert set(limits[-10:]) <= {5, 6, 7}
+
+
+def test_slot_limits_workers():
+    controller = ConcurrencyController("local", workers=2)
+    active = []
+    lock = threading.Lock()
+    running = [0]
+
+    def _work():
+        with controller.slot():
+            with lock:
+                running[0] += 1
+                active.append(running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=_work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(active) == 2
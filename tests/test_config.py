@@ -1,6 +1,11 @@
 """Test config parsing and remote init"""
+import os
+import subprocess
+import sys
 
-from photoriver2.config import parse_config, init_remotes
+import pytest
+
+from photoriver2.config import parse_config, init_remotes, remote_class, remote_options
 
 
 EXAMPLE_CONFIG = """
@@ -45,3 +50,68 @@ def test_init_remotes():
     assert remotes["remote2"].name == "remote2"
     assert remotes["remote1"].folder == "/tmp/1"
     assert remotes["remote2"].folder == "/tmp/2"
+
+
+def test_main_options(tmpdir):
+    with open(os.path.join(tmpdir, "photoriver2.ini"), "w") as outfile:
+        outfile.write("[main]\ndry_run=true\nupload_limit=08:00-23:00=1M\n\n[base]\ntype=local\nfolder=/tmp/1\n")
+    config_data = parse_config(tmpdir)
+    assert config_data["options"] == {"dry_run": True, "upload_limit": "08:00-23:00=1M"}
+    assert list(config_data["remotes"]) == ["base"]
+
+
+def test_lazy_imports():
+    """Dependencies of remote types and phases are not imported by the CLI itself"""
+    code = (
+        "import sys, photoriver2.main; print(sorted(x for x in ('PIL', 'dateutil', 'requests') if x in sys.modules))"
+    )
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, check=True, text=True).stdout == "[]\n"
+
+
+def test_remote_class():
+    assert remote_class("local").__name__ == "LocalRemote"
+    with pytest.raises(RuntimeError):
+        remote_class("ftp")
+
+
+@pytest.mark.parametrize(
+    "options,expected",
+    [
+        ({"type": "local", "folder": "/tmp/1"}, {"folder": "/tmp/1"}),
+        (
+            {"type": "local", "folder": "/tmp/1", "chunk_size": "4M", "scan_workers": "8", "state_backend": "gzip"},
+            {"folder": "/tmp/1", "chunk_size": 4 * 1024 * 1024, "scan_workers": 8, "state_backend": "gzip"},
+        ),
+        (
+            {"type": "google", "token_cache": "t", "page_size": "50", "max_workers": "3", "bandwidth_limit": "1M"},
+            {"token_cache": "t", "page_size": 50, "max_workers": 3, "bandwidth_limit": "1M"},
+        ),
+        ({"type": "ftp"}, RuntimeError),
+        ({"folder": "/tmp/1"}, RuntimeError),
+        ({"type": "local"}, RuntimeError),
+        ({"type": "local", "folder": "/tmp/1", "page_size": "50"}, RuntimeError),
+        ({"type": "local", "folder": "/tmp/1", "scan_workers": "0"}, RuntimeError),
+        ({"type": "local", "folder": "/tmp/1", "chunk_size": "big"}, RuntimeError),
+        ({"type": "local", "folder": "/tmp/1", "state_backend": "sqlite"}, RuntimeError),
+        ({"type": "local", "folder": "/tmp/1", "bandwidth_limit": "fast"}, RuntimeError),
+        ({"type": "local", "folder": "/tmp/1", "min_workers": "5", "max_workers": "2"}, RuntimeError),
+        ({"type": "google", "token_cache": "t", "page_size": "500"}, RuntimeError),
+    ],
+)
+def test_remote_options(options, expected):
+    if expected is RuntimeError:
+        with pytest.raises(RuntimeError):
+            remote_options("remote1", options)
+    else:
+        assert remote_options("remote1", options) == expected
+
+
+def test_init_tuned_remote(tmpdir):
+    config_data = parse_config(
+        tmpdir, "[base]\ntype=local\nfolder=/tmp/1\nchunk_size=64K\nworkers=3\nlarge_workers=0\nstate_backend=gzip\n"
+    )
+    remote = init_remotes(config_data)["base"]
+    assert remote.chunk_size == 64 * 1024
+    assert remote.scheduler.concurrency.limit == 3
+    assert remote.scheduler.large_workers == 0
+    assert remote.state_file == os.path.join(tmpdir, "base_state.json.gz")
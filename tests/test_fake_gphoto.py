@@ -0,0 +1,90 @@
+"""End-to-end Google remote tests against the fake Google Photos Library server"""
+import os
+
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+from benchmarks.fake_gphoto import FakeGPhoto, Library, write_token_cache
+from photoriver2.gphoto_api import GPhoto
+from photoriver2.remote_google import GoogleRemote
+from photoriver2.remote_local import LocalRemote
+
+
+def _library(photos=10, albums=1):
+    library = Library()
+    ids = [
+        library.add_item(f"IMG{x}.JPG", f"data{x}".encode("utf8"), datetime(2021, 2, 15) + timedelta(days=x))
+        for x in range(photos)
+    ]
+    for i in range(albums):
+        library.add_album(f"Album{i}", ids[i::2])
+    return library
+
+
+def _google(server, tmpdir):
+    write_token_cache(os.path.join(tmpdir, "token.cache"))
+    return GoogleRemote(
+        token_cache=os.path.join(tmpdir, "token.cache"),
+        name="gphoto",
+        state_dir=tmpdir,
+        api_url=server.api_url,
+        token_uri=server.token_uri,
+    )
+
+
+@pytest.fixture(name="local")
+def fixture_local(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "base"))
+    return LocalRemote(os.path.join(tmpdir, "base"), name="base", state_dir=tmpdir)
+
+
+def test_pull(tmpdir, local):
+    with FakeGPhoto(_library(), page_size=3) as server:
+        remote = _google(server, tmpdir)
+        assert len(remote.state["photos"]) == 10
+        assert remote.state["albums"][0]["photos"][0] == "2021/02/15/IMG0.JPG"
+        local.do_updates(local.get_merge_updates(remote))
+    assert os.listdir(os.path.join(tmpdir, "base", "2021", "02", "20")) == ["IMG5.JPG"]
+    with open(os.path.join(tmpdir, "base", "2021", "02", "20", "IMG5.JPG"), "rb") as infile:
+        assert infile.read() == b"data5"
+    assert len(os.listdir(os.path.join(tmpdir, "base", "albums", "Album0"))) == 5
+    # Media URLs are fetched in one batch, not per photo
+    assert server.requests["mediaItems:batchGet"] == 1
+    assert "mediaItems" not in server.requests
+
+
+def test_pull_expired_urls(tmpdir, local):
+    with FakeGPhoto(_library(photos=3, albums=0)) as server:
+        remote = _google(server, tmpdir)
+        server.url_ttl = -1
+        remote.prepare_data(local.get_merge_updates(remote))
+        server.url_ttl = 3600
+        local.do_updates(local.get_merge_updates(remote))
+    assert len(local.get_photos()) == 3
+    assert server.requests["mediaItems:batchGet"] == 2
+
+
+def test_push(tmpdir, local, monkeypatch):
+    monkeypatch.setattr(GPhoto, "quota_wait", 0.01)
+    with open(os.path.join(tmpdir, "base", "IMG1.JPG"), "wb") as outfile:
+        outfile.write(b"data1")
+    with open(os.path.join(tmpdir, "base", "IMG2.JPG"), "wb") as outfile:
+        outfile.write(b"data2")
+    local.get_new_state()
+    with FakeGPhoto(quota_errors=2) as server:
+        remote = _google(server, tmpdir)
+        remote.do_updates(remote.get_merge_updates(local))
+        assert sorted(x["filename"] for x in server.library.items.values()) == ["IMG1.JPG", "IMG2.JPG"]
+        assert sorted(server.library.data.values()) == [b"data1", b"data2"]
+        assert server.requests["uploads"] == 4
+        assert server.requests["mediaItems:batchCreate"] == 1
+
+
+def test_requires_auth(tmpdir):
+    with FakeGPhoto(_library()) as server:
+        remote = _google(server, tmpdir)
+        remote.api.token = "wrong"
+        with pytest.raises(requests.exceptions.HTTPError):
+            remote.api.get_albums()
@@ -0,0 +1,101 @@
+"""Test the fan-out push of base photos to several remotes"""
+import json
+import os
+
+from io import BytesIO
+from unittest.mock import Mock, patch
+
+from photoriver2.fanout import Tee, fan_out_push
+from photoriver2.remote_local import LocalRemote
+
+
+def test_tee():
+    tee = Tee(BytesIO(b"0123456789"), 3, chunk_size=3, depth=10)
+    tee.readers[2].close()
+    tee.pump()
+    assert tee.readers[0].read() == b"0123456789"
+    assert tee.readers[1].read(4) == b"0123"
+    assert tee.readers[1].read() == b"456789"
+    assert tee.readers[1].read() == b""
+
+
+def test_tee_error():
+    source = Mock()
+    source.read.side_effect = OSError("bad disk")
+    tee = Tee(source, 1)
+    try:
+        tee.pump()
+    except OSError:
+        pass
+    try:
+        tee.readers[0].read()
+        assert False, "Read error was not passed on to readers"
+    except OSError:
+        pass
+    source.close.assert_called_once()
+
+
+def test_fan_out_push(tmpdir):
+    for folder in ("base", "1", "2"):
+        os.makedirs(os.path.join(tmpdir, folder))
+    for name in ("2020/01/a.jpeg", "2020/01/b.jpeg"):
+        os.makedirs(os.path.join(tmpdir, "base", os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(tmpdir, "base", name), "w") as outfile:
+            outfile.write(name * 1000)
+    os.makedirs(os.path.join(tmpdir, "2", "2020/01"))
+    with open(os.path.join(tmpdir, "2", "2020/01/a.jpeg"), "w") as outfile:
+        outfile.write("2020/01/a.jpeg" * 1000)
+
+    base = LocalRemote(os.path.join(tmpdir, "base"), name="base", state_dir=tmpdir)
+    base.get_data = Mock(wraps=base.get_data)
+    remotes = {x: LocalRemote(os.path.join(tmpdir, x), name=x, state_dir=tmpdir) for x in ("1", "2")}
+    fan_out_push(base, remotes)
+
+    assert base.get_data.call_count == 2
+    for folder in ("1", "2"):
+        for name in ("2020/01/a.jpeg", "2020/01/b.jpeg"):
+            with open(os.path.join(tmpdir, folder, name)) as infile:
+                assert infile.read() == name * 1000
+    # Checksums of the pushed photos are saved for --verify
+    with open(os.path.join(tmpdir, "1_state.json")) as infile:
+        assert sorted(json.load(infile)["checksums"]) == ["2020/01/a.jpeg", "2020/01/b.jpeg"]
+
+
+def test_fan_out_skips_read_only(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "base", "2020/01"))
+    with open(os.path.join(tmpdir, "base", "2020/01/a.jpeg"), "w") as outfile:
+        outfile.write("a")
+    base = LocalRemote(os.path.join(tmpdir, "base"), name="base", state_dir=tmpdir)
+    peer = Mock(read_only=True)
+    assert fan_out_push(base, {"peer": peer}) == {}
+    peer.get_merge_updates.assert_not_called()
+    peer.put_data.assert_not_called()
+
+
+@patch("photoriver2.scheduler.RETRY_WAIT", 0)
+def test_fan_out_failures(tmpdir):
+    """A failed transfer does not stop the others, it is retried and recorded in the retry queue of its remote"""
+    for name in ("2020/01/a.jpeg", "2020/01/b.jpeg"):
+        os.makedirs(os.path.join(tmpdir, "base", os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(tmpdir, "base", name), "w") as outfile:
+            outfile.write(name)
+    base = LocalRemote(os.path.join(tmpdir, "base"), name="base", state_dir=tmpdir)
+    remotes = {x: LocalRemote(os.path.join(tmpdir, x), name=x, state_dir=tmpdir) for x in ("1", "2")}
+    put_data = remotes["1"].put_data
+    calls = []
+
+    def _flaky(update):
+        calls.append(update.name)
+        if update.name == "2020/01/a.jpeg" and calls.count(update.name) == 1:
+            raise OSError("disk hiccup")
+        put_data(update)
+
+    remotes["1"].put_data = _flaky
+    remotes["2"].put_data = Mock(side_effect=OSError("disk full"))
+    fan_out_push(base, remotes)
+
+    assert calls.count("2020/01/a.jpeg") == 2
+    for name in ("2020/01/a.jpeg", "2020/01/b.jpeg"):
+        assert os.path.exists(os.path.join(tmpdir, "1", name))
+    assert sorted(remotes["2"].retry.items) == ["base:2020/01/a.jpeg", "base:2020/01/b.jpeg"]
+    assert os.path.exists(os.path.join(tmpdir, "2_retry.json"))
@@ -0,0 +1,43 @@
+"""Test content fingerprints and their index"""
+import os
+
+from unittest.mock import patch
+
+from photoriver2.fingerprint import PARTIAL_SIZE, FingerprintIndex, fingerprint
+
+
+def test_fingerprint(tmpdir):
+    path = os.path.join(tmpdir, "IMG1.JPG")
+    with open(path, "wb") as outfile:
+        outfile.write(b"a" * PARTIAL_SIZE * 3)
+    first = fingerprint(path)
+    assert first.startswith(f"{PARTIAL_SIZE * 3}:")
+    # The tail is part of the fingerprint
+    with open(path, "r+b") as outfile:
+        outfile.seek(PARTIAL_SIZE * 3 - 1)
+        outfile.write(b"b")
+    assert fingerprint(path) != first
+
+
+def test_index(tmpdir):
+    path = os.path.join(tmpdir, "IMG1.JPG")
+    with open(path, "wb") as outfile:
+        outfile.write(b"data1")
+    index = FingerprintIndex(os.path.join(tmpdir, "index.json"))
+    value = index.get("IMG1.JPG", path)
+    index.save()
+
+    # Unchanged files are not read again, also after reloading the index
+    index = FingerprintIndex(os.path.join(tmpdir, "index.json"))
+    with patch("photoriver2.fingerprint.fingerprint") as mock_fingerprint:
+        assert index.get("IMG1.JPG", path) == value
+        mock_fingerprint.assert_not_called()
+    with open(path, "wb") as outfile:
+        outfile.write(b"data22")
+    assert index.get("IMG1.JPG", path) != value
+
+    index.move("IMG1.JPG", "2020/IMG1.JPG")
+    assert index.cached("IMG1.JPG") is None
+    assert index.cached("2020/IMG1.JPG") is not None
+    index.forget(["2020/IMG1.JPG"])
+    assert index.cached("2020/IMG1.JPG") is None
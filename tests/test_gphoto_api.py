@@ -1,11 +1,12 @@
 """Verify Google Photo API functionality"""
 
 from datetime import date
+from io import BytesIO
 from unittest.mock import patch, Mock, call
 
 import pytest
 
-from photoriver2.gphoto_api import GPhoto, URL_PHOTOS
+from photoriver2.gphoto_api import GPhoto, URL_MEDIA, URL_PHOTOS
 
 
 def _get_obj():
@@ -29,12 +30,7 @@ def test_init():
         (
             [{"mediaItems": [{"id": "123", "filename": "IMG1.JPG"}]}],
             [
-                {
-                    "description": "IMG1.JPG",
-                    "filename": "IMG1.JPG",
-                    "id": "123",
-                    "raw": {"filename": "IMG1.JPG", "id": "123"},
-                },
+                {"id": "123", "filename": "IMG1.JPG", "created": None, "mime_type": None},
             ],
         ),
         (
@@ -43,18 +39,8 @@ def test_init():
                 {"mediaItems": [{"id": "124", "filename": "IMG2.JPG"}]},
             ],
             [
-                {
-                    "description": "IMG1.JPG",
-                    "filename": "IMG1.JPG",
-                    "id": "123",
-                    "raw": {"filename": "IMG1.JPG", "id": "123"},
-                },
-                {
-                    "description": "IMG2.JPG",
-                    "filename": "IMG2.JPG",
-                    "id": "124",
-                    "raw": {"filename": "IMG2.JPG", "id": "124"},
-                },
+                {"id": "123", "filename": "IMG1.JPG", "created": None, "mime_type": None},
+                {"id": "124", "filename": "IMG2.JPG", "created": None, "mime_type": None},
             ],
         ),
     ],
@@ -66,6 +52,38 @@ def test_get_photos(inputs, photos):
         assert list(obj.get_photos()) == photos
 
 
+def test_get_photos_slim():
+    """Only fields needed for sync are kept from the API payload"""
+    obj = _get_obj()
+    entry = {
+        "id": "123",
+        "filename": "IMG1.JPG",
+        "description": "Holiday",
+        "productUrl": "purl",
+        "baseUrl": "burl",
+        "mimeType": "image/jpeg",
+        "mediaMetadata": {"creationTime": "2021-02-15T15:32:12Z", "width": "4000", "photo": {"cameraMake": "Foo"}},
+    }
+    with patch.object(obj, "_load_new_data", Mock(return_value={"mediaItems": [entry]})):
+        assert list(obj.get_photos()) == [
+            {"id": "123", "filename": "IMG1.JPG", "created": "2021-02-15T15:32:12Z", "mime_type": "image/jpeg"}
+        ]
+
+
+@patch("photoriver2.gphoto_api.requests")
+def test_read_photo_fetches_url(mock_requests):
+    obj = _get_obj()
+    mock_requests.get.side_effect = [
+        Mock(status_code=200, text='{"id": "123", "filename": "IMG1.JPG", "baseUrl": "burl"}'),
+        Mock(status_code=200, raw=BytesIO(b"data")),
+    ]
+    assert obj.read_photo({"id": "123"}).read() == b"data"
+    assert mock_requests.get.call_args_list == [
+        call(URL_MEDIA + "/123", headers=obj.headers),
+        call("burl=d", headers=obj.headers, stream=True),
+    ]
+
+
 @pytest.mark.parametrize(
     "kwargs,calls",
     [
@@ -135,3 +153,17 @@ def test_get_albums(inputs, albums):
     _new_data = Mock(side_effect=inputs)
     with patch.object(obj, "_load_new_data", _new_data):
         assert obj.get_albums() == albums
+
+
+def test_token_refresh():
+    obj = _get_obj()
+    assert obj.headers == {"Authorization": "Bearer foo_token_foo"}
+
+    def _refresh():
+        obj.token = "new_token"
+        return True
+
+    obj.token_time -= 3600
+    with patch.object(obj, "_refresh_token", Mock(side_effect=_refresh)) as refresh:
+        assert obj.headers == {"Authorization": "Bearer new_token"}
+        refresh.assert_called_once()
@@ -0,0 +1,115 @@
+"""Test the sync orchestration helpers"""
+import os
+import signal
+import threading
+
+from unittest.mock import Mock, patch
+
+import pytest
+
+from photoriver2.config import init_remotes, parse_config
+from photoriver2.main import parse_args, refresh_states, run_daemon, run_sync, run_verify, _drop_failed
+from photoriver2.pipeline import WINDOW_SIZE
+from photoriver2.remote_memory import MemoryRemote, SyntheticRemote
+
+
+def _remote():
+    remote = Mock()
+    remote.get_new_state.return_value = {"photos": [], "albums": []}
+    return remote
+
+
+def test_refresh_states():
+    remotes = {"base": _remote(), "other": _remote(), "broken": _remote()}
+    remotes["broken"].get_new_state.side_effect = OSError("disk gone")
+    failed = refresh_states(remotes, no_state_cache=True)
+    assert list(failed) == ["broken"]
+    for remote in remotes.values():
+        remote.get_new_state.assert_called_once_with(no_state_cache=True)
+
+
+def test_refresh_states_subset():
+    remotes = {"base": _remote(), "other": _remote()}
+    assert refresh_states(remotes, ["other"]) == {}
+    remotes["base"].get_new_state.assert_not_called()
+    assert refresh_states(remotes, []) == {}
+
+
+def test_drop_failed():
+    remotes = {"base": Mock(), "other": Mock()}
+    _drop_failed(remotes, {"other": OSError()})
+    assert list(remotes) == ["base"]
+    with pytest.raises(RuntimeError):
+        _drop_failed(remotes, {"base": OSError()})
+
+
+def test_run_daemon():
+    """Runs keep going after failures until SIGTERM, with remotes kept in memory"""
+    remotes = {"base": Mock()}
+    calls = []
+
+    def _run_sync(run_remotes, options):
+        calls.append(run_remotes)
+        if len(calls) == 1:
+            raise OSError("temporary failure")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    handler = signal.getsignal(signal.SIGTERM)
+    try:
+        with patch("photoriver2.main.run_sync", Mock(side_effect=_run_sync)):
+            run_daemon(remotes, Mock(interval=0, watch=False))
+    finally:
+        signal.signal(signal.SIGTERM, handler)
+    assert calls == [remotes, remotes]
+
+
+def test_run_verify():
+    remotes = {"base": _remote(), "other": _remote()}
+    remotes["base"].verify.return_value = ["IMG1.JPG: checksum x does not match y"]
+    remotes["other"].verify.return_value = []
+    assert run_verify(remotes) == {"base": ["IMG1.JPG: checksum x does not match y"], "other": []}
+
+
+def test_sync_memory_remotes(tmpdir):
+    """The whole pipeline runs on remotes configured in memory"""
+    with open(os.path.join(tmpdir, "photoriver2.ini"), "w") as outfile:
+        outfile.write("[base]\ntype=synthetic\nphotos=200\nalbums=3\nalbum_size=5\nphoto_size=1K\n\n")
+        outfile.write("[mirror]\ntype=memory\n")
+    remotes = init_remotes(parse_config(tmpdir))
+    with patch("sys.argv", ["photoriver2"]):
+        options = parse_args()
+    run_sync(remotes, options)
+    base, mirror = remotes["base"], remotes["mirror"]
+    assert not [x for x in base.data if x.startswith("import/")]
+    assert sorted(mirror.data) == sorted(base.data)
+    assert mirror.get_albums() == base.get_albums()
+    name = sorted(base.data)[0]
+    assert mirror.get_data({"name": name}).read() == base.get_data({"name": name}).read()
+
+
+def test_streaming_pull():
+    """Transfers from a remote start while it is still being listed"""
+    transferred = threading.Event()
+
+    class _Base(MemoryRemote):
+        def put_data(self, update):
+            super().put_data(update)
+            transferred.set()
+
+    class _Slow(SyntheticRemote):
+        listed_before_transfer = None
+
+        def iter_photos(self):
+            for i, photo in enumerate(self.get_photos()):
+                if i == WINDOW_SIZE * 2 and self.listed_before_transfer is not None:
+                    # Later pages only come once the first ones are being transferred
+                    self.listed_before_transfer = transferred.wait(5)
+                yield photo
+
+    remotes = {"base": _Base(name="base"), "slow": _Slow(name="slow", photos=WINDOW_SIZE * 3, albums=0)}
+    remotes["slow"].listed_before_transfer = False
+    with patch("sys.argv", ["photoriver2", "--pull-only"]):
+        run_sync(remotes, parse_args())
+    assert remotes["slow"].listed_before_transfer
+    assert sorted(remotes["base"].data) == sorted(remotes["slow"].data)
+    assert len(remotes["slow"].state["photos"]) == WINDOW_SIZE * 3
@@ -0,0 +1,63 @@
+"""Test run metrics collection and export"""
+import json
+import os
+import threading
+
+from photoriver2.metrics import Metrics
+
+
+def test_phases():
+    metrics = Metrics()
+    with metrics.phase("pull", "gphoto"):
+        metrics.add("base", "items")
+        metrics.add("base", "bytes", 1000)
+        metrics.add("gphoto", "api_calls", 3)
+    metrics.add("base", "errors")
+    summary = {(x["remote"], x["phase"]): x for x in metrics.summary()}
+    assert summary[("base", "pull")]["items"] == 1
+    assert summary[("base", "pull")]["bytes"] == 1000
+    assert summary[("gphoto", "pull")]["api_calls"] == 3
+    assert summary[("gphoto", "pull")]["seconds"] > 0
+    assert summary[("base", "init")]["errors"] == 1
+
+
+def test_parallel_phases():
+    """Phases of refresh threads overlap without changing the phase of the main thread or of each other"""
+    metrics = Metrics()
+    both = threading.Barrier(2)
+
+    def _refresh(name):
+        with metrics.phase("state", name):
+            both.wait()
+            metrics.add(name, "items")
+            both.wait()
+
+    with metrics.phase("fixes", "base"):
+        threads = [threading.Thread(target=_refresh, args=(x,)) for x in ("one", "two")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert metrics.current_phase == "fixes"
+        # Workers without a phase of their own count to the phase of the main thread
+        worker = threading.Thread(target=metrics.add, args=("base", "items"))
+        worker.start()
+        worker.join()
+    assert metrics.current_phase == "init"
+    summary = {(x["remote"], x["phase"]): x for x in metrics.summary()}
+    assert summary[("one", "state")]["items"] == summary[("two", "state")]["items"] == 1
+    assert summary[("base", "fixes")]["items"] == 1
+
+
+def test_write(tmpdir):
+    metrics = Metrics()
+    with metrics.phase("push", "gphoto"):
+        metrics.add("gphoto", "bytes", 42)
+    metrics.write(os.path.join(tmpdir, "metrics"))
+    with open(os.path.join(tmpdir, "metrics", "photoriver2.prom")) as infile:
+        text = infile.read()
+    assert 'photoriver2_phase_bytes{remote="gphoto",phase="push"} 42\n' in text
+    assert "# TYPE photoriver2_phase_seconds gauge\n" in text
+    with open(os.path.join(tmpdir, "metrics", "photoriver2_metrics.json")) as infile:
+        assert json.load(infile)["phases"][0]["bytes"] == 42
+    assert sorted(os.listdir(os.path.join(tmpdir, "metrics"))) == ["photoriver2.prom", "photoriver2_metrics.json"]
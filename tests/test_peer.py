@@ -0,0 +1,120 @@
+"""Test syncing between two nodes through the peer server"""
+import os
+import threading
+
+import pytest
+import requests
+
+from photoriver2.peer import StateHistory, serve
+from photoriver2.remote_local import LocalRemote
+from photoriver2.remote_peer import PeerRemote
+
+
+def _write(folder, name, data):
+    os.makedirs(os.path.dirname(os.path.join(folder, name)), exist_ok=True)
+    with open(os.path.join(folder, name), "wb") as outfile:
+        outfile.write(data)
+
+
+@pytest.fixture(name="nodes")
+def fixture_nodes(tmpdir):
+    """Node one serves its base folder, node two has its own base folder and node one as a peer"""
+    _write(str(tmpdir.join("one")), "2020/01/01/a.jpg", b"a" * 1000)
+    _write(str(tmpdir.join("one")), "2020/01/02/b.jpg", b"b" * 10)
+    os.makedirs(str(tmpdir.join("two")))
+    os.makedirs(str(tmpdir.join("state_one")))
+    os.makedirs(str(tmpdir.join("state_two")))
+    one = LocalRemote(str(tmpdir.join("one")), name="base", state_dir=str(tmpdir.join("state_one")))
+    server = serve(one, "127.0.0.1:0")
+    url = "http://%s:%s" % server.server_address[:2]
+    two = LocalRemote(str(tmpdir.join("two")), name="base", state_dir=str(tmpdir.join("state_two")))
+    peer = PeerRemote(url, name="one", state_dir=str(tmpdir.join("state_two")))
+    yield one, two, peer, url
+    server.shutdown()
+    server.server_close()
+
+
+def test_sync_from_peer(nodes, tmpdir):
+    one, two, peer, _ = nodes
+    assert [x["name"] for x in peer.state["photos"]] == ["2020/01/01/a.jpg", "2020/01/02/b.jpg"]
+    assert peer.get_size(peer.state["photos"][0]) == 1000
+    two.do_updates(two.get_merge_updates(peer))
+    with open(str(tmpdir.join("two", "2020/01/01/a.jpg")), "rb") as infile:
+        assert infile.read() == b"a" * 1000
+
+    # Only changes are sent after the first sync
+    _write(str(tmpdir.join("one")), "2020/01/03/c.jpg", b"c" * 10)
+    os.remove(str(tmpdir.join("one", "2020/01/02/b.jpg")))
+    one.get_new_state()
+    params = {"since": peer.position["generation"], "epoch": peer.position["epoch"]}
+    assert peer.session.get(peer.url + "/state", params=params).json() == {
+        "epoch": peer.position["epoch"],
+        "generation": peer.position["generation"] + 1,
+        "full": False,
+        "added": [{"name": "2020/01/03/c.jpg", "size": 10}],
+        "removed": ["2020/01/02/b.jpg"],
+        "albums": [],
+        "removed_albums": [],
+    }
+    peer.get_new_state()
+    assert [x["name"] for x in peer.state["photos"]] == ["2020/01/01/a.jpg", "2020/01/03/c.jpg"]
+    # The position survives a restart of this node
+    assert PeerRemote(peer.url, name="one", state_dir=peer.state_dir).position == peer.position
+
+
+def test_unknown_generation(nodes):
+    _, _, peer, url = nodes
+    delta = requests.get(url + "/state", params={"since": 5, "epoch": "other"}).json()
+    assert delta["full"] and len(delta["photos"]) == 2
+    assert requests.get(url + "/state", params={"since": "x"}).status_code == 400
+
+
+def test_ranges(nodes):
+    _, _, _, url = nodes
+    params = {"name": "2020/01/01/a.jpg"}
+    response = requests.get(url + "/photo", params=params, headers={"Range": "bytes=990-"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 990-999/1000"
+    assert response.content == b"a" * 10
+    response = requests.get(url + "/photo", params=params, headers={"Range": "bytes=-5"})
+    assert response.content == b"a" * 5
+    assert requests.get(url + "/photo", params=params, headers={"Range": "bytes=2000-"}).status_code == 416
+    assert len(requests.get(url + "/photo", params=params).content) == 1000
+    # Only photos of the served state can be read
+    assert requests.get(url + "/photo", params={"name": "../state_one/base_state.json"}).status_code == 404
+
+
+def test_serve_local_only(tmpdir):
+    remote = LocalRemote(str(tmpdir), name="base", state_dir=str(tmpdir))
+    server = serve(remote, "0")
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_republish_changed(nodes, tmpdir):
+    one, _, peer, url = nodes
+    _write(str(tmpdir.join("one")), "2020/01/01/a.jpg", b"a" * 500)
+    one.get_new_state()
+    params = {"since": peer.position["generation"], "epoch": peer.position["epoch"]}
+    delta = requests.get(url + "/state", params=params).json()
+    assert delta["added"] == [{"name": "2020/01/01/a.jpg", "size": 500}]
+    assert delta["removed"] == []
+    peer.get_new_state()
+    assert peer.get_size(peer.state["photos"][0]) == 500
+
+
+def test_history_lock(tmpdir):
+    _write(str(tmpdir.join("photos")), "2020/01/01/a.jpg", b"a" * 10)
+    remote = LocalRemote(str(tmpdir.join("photos")), name="base", state_dir=str(tmpdir))
+    lock = threading.Lock()
+    history = StateHistory(remote, state_lock=lock)
+    assert history.delta()["generation"] == 1
+    # A running sync keeps the last generation served
+    _write(str(tmpdir.join("photos")), "2020/01/02/b.jpg", b"b" * 10)
+    with lock:
+        remote.get_new_state()
+        assert history.delta(since=1, epoch=history.epoch)["generation"] == 1
+    assert history.delta(since=1, epoch=history.epoch)["added"] == [{"name": "2020/01/02/b.jpg", "size": 10}]
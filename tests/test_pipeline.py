@@ -0,0 +1,54 @@
+"""Test the bounded streams between sync stages"""
+import threading
+
+import pytest
+
+from photoriver2.pipeline import bounded, windows
+
+
+def test_windows():
+    assert list(windows(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(windows([], 2)) == []
+
+
+def test_bounded():
+    produced = []
+
+    def _produce():
+        for i in range(10):
+            produced.append(i)
+            yield i
+
+    stream = bounded(_produce(), depth=2)
+    assert next(stream) == 0
+    threading.Event().wait(0.2)
+    # The producer runs ahead of the consumer, but not by more than the depth
+    assert 2 <= len(produced) <= 4
+    assert list(stream) == list(range(1, 10))
+
+
+def test_bounded_error():
+    def _produce():
+        yield 1
+        raise OSError("listing failed")
+
+    stream = bounded(_produce())
+    assert next(stream) == 1
+    with pytest.raises(OSError):
+        next(stream)
+
+
+def test_bounded_stop():
+    stopped = threading.Event()
+
+    def _produce():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            stopped.set()
+
+    stream = bounded(_produce(), depth=1)
+    next(stream)
+    stream.close()
+    assert stopped.wait(5)
@@ -0,0 +1,62 @@
+"""Test saving and executing sync plans"""
+import os
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from photoriver2.plan import PlanInvalid, build_plan, check_plan, execute_plan, load_plan, save_plan
+from photoriver2.remote_local import LocalRemote
+
+
+def _remotes(tmpdir):
+    for folder in ("base", "other"):
+        os.makedirs(os.path.join(tmpdir, folder, "2020/01"))
+    with open(os.path.join(tmpdir, "other", "2020/01/a.jpeg"), "w") as outfile:
+        outfile.write("a" * 1000)
+    with open(os.path.join(tmpdir, "base", "2020/01/b.jpeg"), "w") as outfile:
+        outfile.write("b" * 3000)
+    return {x: LocalRemote(os.path.join(tmpdir, x), name=x, state_dir=tmpdir) for x in ("base", "other")}
+
+
+def _plan(remotes):
+    return build_plan(
+        remotes,
+        fixes={"base": [], "other": []},
+        pull={"other": remotes["base"].get_merge_updates(remotes["other"])},
+        push={"other": remotes["other"].get_merge_updates(remotes["base"])},
+        rate=1000,
+    )
+
+
+def test_build_plan(tmpdir):
+    plan = _plan(_remotes(tmpdir))
+    assert plan["summary"]["pull/other"] == {"actions": {"new": 1}, "bytes": 1000, "estimated": 0}
+    assert plan["summary"]["push/other"] == {"actions": {"new": 1}, "bytes": 3000, "estimated": 0}
+    assert plan["estimate"] == {"bytes": 4000, "rate": 1000, "seconds": 4}
+
+
+def test_execute_saved_plan(tmpdir):
+    remotes = _remotes(tmpdir)
+    save_plan(_plan(remotes), os.path.join(tmpdir, "plan.json.gz"))
+
+    # A later run loads cached states and executes the plan without replanning
+    remotes = {x: LocalRemote(os.path.join(tmpdir, x), name=x, state_dir=tmpdir) for x in ("base", "other")}
+    plan = load_plan(os.path.join(tmpdir, "plan.json.gz"))
+    check_plan(plan, remotes)
+    assert execute_plan(plan, remotes)
+    for folder in ("base", "other"):
+        for name in ("2020/01/a.jpeg", "2020/01/b.jpeg"):
+            assert os.path.exists(os.path.join(tmpdir, folder, name))
+
+
+def test_check_plan(tmpdir):
+    remotes = _remotes(tmpdir)
+    plan = _plan(remotes)
+    remotes["other"].state["photos"].append({"name": "2020/01/c.jpeg"})
+    with pytest.raises(PlanInvalid):
+        check_plan(plan, remotes)
+    plan = _plan(remotes)
+    plan["created"] = (datetime.now() - timedelta(days=2)).isoformat()
+    with pytest.raises(PlanInvalid):
+        check_plan(plan, remotes)
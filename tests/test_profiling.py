@@ -0,0 +1,35 @@
+"""Test profiling of sync phases"""
+import concurrent.futures
+import json
+import os
+import pstats
+
+from photoriver2.profiling import Profiler
+
+
+def _work(count):
+    return len([str(x) for x in range(count)])
+
+
+def test_disabled():
+    profiler = Profiler()
+    with profiler.phase("pull", "base"):
+        _work(10)
+    assert profiler.results == []
+
+
+def test_phase(tmpdir):
+    profiler = Profiler(str(tmpdir))
+    with profiler.phase("pull", "base"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(_work, [10000, 10000]))
+    assert sorted(os.listdir(tmpdir)) == ["profile_summary.json", "pull-base.alloc.txt", "pull-base.prof"]
+    stats = pstats.Stats(os.path.join(tmpdir, "pull-base.prof"))
+    # Work done in worker threads is part of the profile
+    assert any(x[2] == "_work" for x in stats.stats)
+    with open(os.path.join(tmpdir, "profile_summary.json")) as infile:
+        summary = json.load(infile)
+    assert summary[0]["phase"] == "pull"
+    assert summary[0]["remote"] == "base"
+    assert summary[0]["peak_rss_kb"] > 0
+    assert summary[0]["traced_peak_bytes"] > 0
@@ -0,0 +1,64 @@
+"""Test progress reports and the summary table"""
+import logging
+
+from unittest.mock import patch
+
+from photoriver2.progress import Progress, ProgressReports, summary_table
+
+
+def test_progress(caplog):
+    caplog.set_level(logging.INFO, logger="photoriver2.progress")
+    progress = Progress("base", "pull", interval=0)
+    progress.expect(4, 4 * 2 ** 20)
+    with patch("photoriver2.progress.time.monotonic", return_value=progress.started + 2):
+        progress.add(2 ** 20)
+    assert "base pull: 1/4 items, 1.0/4.0 MiB (0.5 MiB/s), ETA 0:00:06" in caplog.text
+    # Totals grow with every window of a streamed pull
+    progress.expect(4)
+    with patch("photoriver2.progress.time.monotonic", return_value=progress.started + 2):
+        progress.add(2 ** 20)
+    assert "base pull: 2/8 items, 2.0/4.0 MiB (1.0 MiB/s), ETA 0:00:02" in caplog.text
+
+
+def test_progress_rate_limited(caplog):
+    caplog.set_level(logging.INFO, logger="photoriver2.progress")
+    progress = Progress("base", "listing", interval=10)
+    for _ in range(100):
+        progress.add()
+    assert caplog.text == ""
+    progress.finish()
+    assert "base listing: 100 items" in caplog.text
+    assert "ETA" not in caplog.text
+
+
+def test_reports(caplog):
+    caplog.set_level(logging.INFO, logger="photoriver2.progress")
+    reports = ProgressReports()
+    assert reports.get("base", "pull") is reports.get("base", "pull")
+    reports.get("base", "pull").add(10)
+    reports.get("other", "listing").add()
+    reports.finish("pull")
+    assert "base pull" in caplog.text
+    assert "other listing" not in caplog.text
+    assert reports.get("base", "pull").done_items == 0
+    updates = [{"action": "new"}, {"action": "new"}, {"action": "mv"}]
+    assert list(reports.counted(updates, "google", "pull", key=lambda x: x["action"])) == updates
+    assert reports.actions == {("google", "pull"): {"new": 2, "mv": 1}}
+    reports.reset()
+    assert reports.actions == {}
+
+
+def test_summary_table():
+    metrics = [
+        {"remote": "base", "phase": "state", "seconds": 1.5, "items": 10, "bytes": 0, "errors": 0},
+        {"remote": "google", "phase": "pull", "seconds": 30.0, "items": 5, "bytes": 3 * 2 ** 20, "errors": 1},
+    ]
+    table = summary_table(metrics, {("google", "pull"): {"new": 4, "mv": 1}, ("local", "fixes"): {"rename": 2}})
+    lines = table.split("\n")
+    assert lines[0].split() == ["Remote", "Phase", "Actions", "Items", "MiB", "Errors", "Seconds"]
+    assert lines[2].split() == ["base", "state", "-", "10", "0.0", "0", "1.5"]
+    assert lines[3].split() == ["google", "pull", "mv:1", "new:4", "5", "3.0", "1", "30.0"]
+    assert lines[4].split() == ["local", "fixes", "rename:2", "0", "0.0", "0", "0.0"]
+    # Columns line up
+    column = lines[0].index("Items")
+    assert [x[column:].split()[0] for x in lines[2:]] == ["10", "5", "0"]
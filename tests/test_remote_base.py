@@ -1,10 +1,11 @@
 """Test the remote base class"""
+import gzip
 import os
 import tempfile
 
 import pytest
 
-from photoriver2.remote_base import BaseRemote
+from photoriver2.remote_base import MAX_MOVE_AGE, BaseRemote
 
 
 def test_init():
@@ -138,3 +139,71 @@ def test_get_merge_updates(state_our, state_their, expected):
     obj2.new_state = state_our
 
     assert obj2.get_merge_updates(obj1) == expected
+
+
+class _ListRemote(BaseRemote):
+    photos = []
+
+    def get_photos(self):
+        return [{"name": x} for x in self.photos]
+
+    def get_albums(self):
+        return []
+
+
+def test_state_saved_only_on_change(tmpdir):
+    obj = _ListRemote(state_dir=tmpdir)
+    state_file = os.path.join(tmpdir, "local_state.json")
+    os.utime(state_file, (0, 0))
+    obj.get_new_state()
+    assert os.stat(state_file).st_mtime == 0
+    obj.photos = ["IMG001"]
+    obj.get_new_state()
+    assert os.stat(state_file).st_mtime != 0
+    assert obj.find_photo("img001")
+
+    # Loading the saved state does not need another write either
+    obj = _ListRemote(state_dir=tmpdir)
+    obj.photos = ["IMG001"]
+    assert not obj.save_state()
+
+
+def test_gzip_state(tmpdir):
+    with gzip.open(os.path.join(tmpdir, "remote_state.json.gz"), "wt") as outfile:
+        outfile.write('{"photos": [{"name": "Photo1"}], "albums": []}')
+    obj = BaseRemote(name="remote", state_dir=tmpdir, state_backend="gzip")
+    assert obj.state == {"photos": [{"name": "Photo1"}], "albums": []}
+    assert not obj.save_state()
+    obj.state["albums"].append({"name": "Album1", "photos": ["Photo1"]})
+    assert obj.save_state()
+    assert BaseRemote(name="remote", state_dir=tmpdir, state_backend="gzip").state == obj.state
+
+
+def test_record_move(tmpdir):
+    obj = _ListRemote(state_dir=tmpdir)
+    obj.record_move("a", "b")
+    obj.record_move("x", "c")
+    obj.record_move("b", "c")
+    assert obj.state["moves"] == {"a": "c", "b": "c", "x": "c"}
+    # Moving back forgets the move to the old name
+    obj.record_move("c", "a")
+    assert obj.state["moves"] == {"b": "a", "c": "a", "x": "a"}
+    assert obj.move_index[1]["a"] == {"b", "c", "x"}
+
+    # Old moves are forgotten, moves of states without times start to age now
+    obj.state["moved_at"]["x"] -= MAX_MOVE_AGE + 1
+    del obj.state["moved_at"]["b"]
+    obj.get_new_state()
+    assert obj.state["moves"] == {"b": "a", "c": "a"}
+    assert set(obj.state["moved_at"]) == {"b", "c"}
+
+
+def test_switch_state_backend(tmpdir):
+    obj = _ListRemote(name="remote", state_dir=tmpdir)
+    obj.photos = ["IMG001"]
+    obj.get_new_state()
+    obj = _ListRemote(name="remote", state_dir=tmpdir, state_backend="gzip")
+    assert obj.state["photos"] == [{"name": "IMG001"}]
+    assert obj.save_state()
+    assert os.listdir(tmpdir) == ["remote_state.json.gz"]
+    assert _ListRemote(name="remote", state_dir=tmpdir, state_backend="gzip").state == obj.state
@@ -1,38 +1,32 @@
 """Basic Google Remote testing"""
+import json
+import os
 
 from unittest.mock import patch, Mock
 
+from photoriver2.remote_base import BaseRemote, Update
 from photoriver2.remote_google import GoogleRemote
+from photoriver2.remote_memory import MemoryRemote
 
 
 @patch("photoriver2.remote_google.GPhoto")
-def test_get_albums(mock_api):
+def test_get_albums(mock_api, tmpdir):
     mock_api_obj = Mock()
     mock_api.return_value = mock_api_obj
     mock_api_obj.get_albums.return_value = [{"name": "Album1", "id": "barfoo"}]
     mock_api_obj.get_photos.return_value = [
         {
-            "description": "IMG1.JPG",
             "filename": "IMG1.JPG",
             "id": "123",
-            "raw": {
-                "filename": "IMG1.JPG",
-                "id": "123",
-                "mediaMetadata": {"creationTime": "2021-02-15T15:32:12.045123456Z"},
-            },
+            "created": "2021-02-15T15:32:12.045123456Z",
         },
         {
-            "description": "IMG2.JPG",
             "filename": "IMG2.JPG",
             "id": "124",
-            "raw": {
-                "filename": "IMG2.JPG",
-                "id": "124",
-                "mediaMetadata": {"creationTime": "2021-02-16T15:32:14.045123456Z"},
-            },
+            "created": "2021-02-16T15:32:14.045123456Z",
         },
     ]
-    remote = GoogleRemote(".config")
+    remote = GoogleRemote(".config", state_dir=tmpdir)
     data = remote.get_albums()
     assert data == [{"id": "barfoo", "name": "Album1", "photos": ["2021/02/15/IMG1.JPG", "2021/02/16/IMG2.JPG"]}]
     mock_api_obj.get_albums.assert_called()
@@ -40,57 +34,168 @@ def test_get_albums(mock_api):
 
 
 @patch("photoriver2.remote_google.GPhoto")
-def test_get_photos(mock_api):
+def test_get_photos(mock_api, tmpdir):
     mock_api_obj = Mock()
     mock_api.return_value = mock_api_obj
+    mock_api_obj.get_albums.return_value = []
     mock_api_obj.get_photos.return_value = [
         {
-            "description": "IMG1.JPG",
             "filename": "IMG1.JPG",
             "id": "123",
-            "raw": {
-                "filename": "IMG1.JPG",
-                "id": "123",
-                "mediaMetadata": {"creationTime": "2021-02-15T15:32:12Z"},
-            },
+            "created": "2021-02-15T15:32:12Z",
         },
         {
-            "description": "IMG2.JPG",
             "filename": "IMG2.JPG",
             "id": "124",
-            "raw": {
-                "filename": "IMG2.JPG",
-                "id": "124",
-                "mediaMetadata": {"creationTime": "2021-02-16T15:32:14Z"},
-            },
+            "created": "2021-02-16T15:32:14Z",
         },
     ]
-    remote = GoogleRemote(".config")
+    remote = GoogleRemote(".config", state_dir=tmpdir)
     data = remote.get_photos()
-    for entry in data:
-        del entry["modified"]
     assert data == [
+        {"filename": "IMG1.JPG", "id": "123", "created": "2021-02-15T15:32:12Z", "name": "2021/02/15/IMG1.JPG"},
+        {"filename": "IMG2.JPG", "id": "124", "created": "2021-02-16T15:32:14Z", "name": "2021/02/16/IMG2.JPG"},
+    ]
+    mock_api_obj.get_photos.assert_called_with(archived=True)
+
+
+@patch("photoriver2.remote_google.GPhoto")
+def test_refresh_photos(mock_api, tmpdir):
+    mock_api_obj = Mock()
+    mock_api.return_value = mock_api_obj
+    mock_api_obj.get_albums.return_value = []
+    mock_api_obj.get_photos.return_value = [
+        {"filename": "IMG1.JPG", "id": "123", "created": "2021-02-15T15:32:12Z"},
+        {"filename": "IMG2.JPG", "id": "124", "created": "2021-02-16T15:32:14Z"},
+    ]
+    mock_api_obj.get_photos_by_id.return_value = [
+        {"filename": "IMG2.JPG", "id": "124", "created": "2021-02-16T15:32:14Z", "base_url": "new"},
+    ]
+    remote = GoogleRemote(".config", state_dir=tmpdir)
+    fresh = remote.refresh_photos([{"id": "124"}, {"id": "125"}])
+    mock_api_obj.get_photos_by_id.assert_called_once_with(["124", "125"])
+    assert [x["name"] for x in fresh] == ["2021/02/16/IMG2.JPG"]
+    assert remote.media_urls["124"][0] == "new"
+
+
+@patch("photoriver2.remote_google.GPhoto")
+def test_slim_old_state(mock_api, tmpdir):
+    """State files with full API payloads get slimmed on load"""
+    with open(os.path.join(tmpdir, "local_state.json"), "w") as outfile:
+        json.dump(
+            {
+                "photos": [
+                    {
+                        "name": "2021/02/15/IMG1.JPG",
+                        "filename": "IMG1.JPG",
+                        "id": "123",
+                        "description": "IMG1.JPG",
+                        "modified": "2021-02-15T15:32:12",
+                        "raw": {"mimeType": "image/jpeg", "mediaMetadata": {"creationTime": "2021-02-15T15:32:12Z"}},
+                    }
+                ],
+                "albums": [],
+            },
+            outfile,
+        )
+    remote = GoogleRemote(".config", state_dir=tmpdir)
+    assert remote.state["photos"] == [
         {
-            "description": "IMG1.JPG",
+            "name": "2021/02/15/IMG1.JPG",
             "filename": "IMG1.JPG",
             "id": "123",
-            "name": "2021/02/15/IMG1.JPG",
-            "raw": {
-                "filename": "IMG1.JPG",
-                "id": "123",
-                "mediaMetadata": {"creationTime": "2021-02-15T15:32:12Z"},
-            },
-        },
-        {
-            "description": "IMG2.JPG",
-            "filename": "IMG2.JPG",
-            "id": "124",
-            "name": "2021/02/16/IMG2.JPG",
-            "raw": {
-                "filename": "IMG2.JPG",
-                "id": "124",
-                "mediaMetadata": {"creationTime": "2021-02-16T15:32:14Z"},
+            "created": "2021-02-15T15:32:12Z",
+            "mime_type": "image/jpeg",
+        }
+    ]
+    mock_api.return_value.get_photos.assert_not_called()
+
+
+@patch("photoriver2.remote_google.GPhoto")
+def test_moves_become_aliases(mock_api, tmpdir):
+    """Photos moved in base are not uploaded again, their new name becomes an alias"""
+    mock_api.return_value.get_albums.return_value = []
+    mock_api.return_value.get_photos.return_value = [
+        {"filename": "IMG1.JPG", "id": "123", "created": "2021-02-15T15:32:12Z"}
+    ]
+    remote = GoogleRemote(".config", state_dir=tmpdir)
+    with open(os.path.join(tmpdir, "base_state.json"), "w") as outfile:
+        json.dump(
+            {
+                "photos": [{"name": "2021/02/16/IMG1.JPG"}],
+                "albums": [],
+                "moves": {"2021/02/15/IMG1.JPG": "2021/02/16/IMG1.JPG"},
             },
-        },
+            outfile,
+        )
+    base = BaseRemote(name="base", state_dir=tmpdir)
+
+    updates = remote.get_merge_updates(base)
+    assert [(x.action, x.name, x.new_name) for x in updates] == [("mv", "2021/02/15/IMG1.JPG", "2021/02/16/IMG1.JPG")]
+    remote.do_updates(updates)
+    mock_api.return_value.upload_media.assert_not_called()
+    assert not remote.get_merge_updates(base)
+    assert not base.get_merge_updates(remote)
+    # Aliases survive a state refresh and a reload
+    remote.get_new_state()
+    assert GoogleRemote(".config", state_dir=tmpdir).state["aliases"] == {"2021/02/16/IMG1.JPG": "2021/02/15/IMG1.JPG"}
+
+
+@patch("photoriver2.remote_google.GPhoto")
+def test_sync_albums(mock_api, tmpdir):
+    """Albums get photos the library has by their media IDs, only missing photos are uploaded"""
+    api = mock_api.return_value
+    api.get_albums.return_value = [{"name": "Old", "id": "old"}]
+    api.get_photos.return_value = [{"filename": "IMG1.JPG", "id": "123", "created": "2021-02-15T15:32:12Z"}]
+    api.upload_media.side_effect = lambda name, data: (name, "token-" + name[-8:])
+    api.create_media.side_effect = lambda batch: [
+        {"uploadToken": x[1], "mediaItem": {"id": "id-" + x[0][-8:]}} for x in batch
+    ]
+    api.create_album.return_value = {"id": "trip"}
+    remote = GoogleRemote(".config", state_dir=tmpdir)
+    base = MemoryRemote(name="base", state_dir=tmpdir)
+    names = ["2021/02/15/IMG1.JPG", "2021/02/15/IMG2.JPG", "2021/02/15/IMG3.JPG"]
+    base.data = {x: b"data" for x in names}
+    base.albums = {"Old": set(names[:2]), "Trip": set(names[:2])}
+    base.get_new_state()
+
+    updates = [x for x in remote.get_merge_updates(base) if x.name != names[2]]
+    assert sorted(x.action for x in updates) == ["new", "new_album", "new_album_photo"]
+    remote.do_updates(updates)
+    # IMG2 is uploaded once for the pull and then added to both albums by its ID
+    api.upload_media.assert_called_once_with(names[1], data=b"data")
+    api.create_album.assert_called_once_with("Trip")
+    assert sorted(x.args for x in api.add_to_album.call_args_list) == [
+        ("old", ["id-IMG2.JPG"]),
+        ("trip", ["123", "id-IMG2.JPG"]),
     ]
-    mock_api_obj.get_photos.assert_called_with()
+    assert {"name": "Trip", "id": "trip", "photos": names[:2]} in remote.state["albums"]
+    # Created media and album photos are in the state, so nothing gets added again
+    assert remote.uploaded == {}
+    assert remote.find_photo(names[1])
+    assert [x["photos"] for x in remote.state["albums"] if x["name"] == "Old"] == [names[:2]]
+    assert [(x.action, x.name) for x in remote.get_merge_updates(base)] == [("new", names[2])]
+
+    # Photos of an album that are not in the library yet get uploaded first
+    api.add_to_album.reset_mock()
+    remote.sync_albums([Update(action="new_album_photo", name=names[2], remote=base, album_name="Trip")])
+    api.upload_media.assert_called_with(names[2], data=b"data")
+    api.add_to_album.assert_called_once_with("trip", ["id-IMG3.JPG"])
+
+
+@patch("photoriver2.remote_google.GPhoto")
+def test_sync_albums_batches(mock_api, tmpdir):
+    api = mock_api.return_value
+    api.get_albums.return_value = []
+    api.get_photos.return_value = []
+    api.create_album.side_effect = lambda name: {"id": name.lower()}
+    remote = GoogleRemote(".config", state_dir=tmpdir)
+    names = [f"2021/02/15/IMG{i}.JPG" for i in range(120)]
+    remote.uploaded = {x.upper(): str(i) for i, x in enumerate(names)}
+    base = MemoryRemote(name="base", state_dir=tmpdir)
+    remote.sync_albums(
+        [Update(action="new_album", photo={"name": f"Album{i}", "photos": names}, remote=base) for i in range(3)]
+    )
+    api.upload_media.assert_not_called()
+    assert api.create_album.call_count == 3
+    assert sorted(len(x.args[1]) for x in api.add_to_album.call_args_list) == [20, 20, 20, 50, 50, 50, 50, 50, 50]
@@ -1,10 +1,15 @@
 """Test the local file remote class"""
 import os
+import sys
+import threading
+import time
 
-from unittest.mock import mock_open
+from io import BytesIO
+from unittest.mock import Mock, mock_open
 
 import pytest
 
+from photoriver2.remote_base import DataExpired, Update
 from photoriver2.remote_local import LocalRemote, deconflict
 
 
@@ -223,6 +228,34 @@ def test_do_merge_int(tmpdir):
         infile.close()
 
 
+def test_do_updates_expired(tmpdir):
+    """Only the expired item gets refreshed and re-queued, done items are not fetched again"""
+    os.makedirs(os.path.join(tmpdir, "photos"))
+    obj = LocalRemote(os.path.join(tmpdir, "photos"), state_dir=tmpdir)
+    other = Mock()
+    other.name = "other"
+
+    def _get_data(photo):
+        if photo.get("expired"):
+            raise DataExpired
+        return BytesIO(photo["name"].encode("utf-8"))
+
+    other.get_data.side_effect = _get_data
+    other.refresh_photos.side_effect = lambda photos: [{"name": x["name"]} for x in photos]
+    other.get_checksum.return_value = None
+    other.get_size.return_value = None
+    updates = [
+        Update(action="new", photo={"name": "2021/01/a.jpeg"}, remote=other),
+        Update(action="new", photo={"name": "2021/01/b.jpeg", "expired": True}, remote=other),
+    ]
+    obj.do_updates(updates)
+    other.refresh_photos.assert_called_once_with([{"name": "2021/01/b.jpeg", "expired": True}])
+    assert other.get_data.call_count == 3
+    for name in ("2021/01/a.jpeg", "2021/01/b.jpeg"):
+        with open(os.path.join(tmpdir, "photos", name), "rb") as infile:
+            assert infile.read() == name.encode("utf-8")
+
+
 def test_deconflict(tmpdir):
     assert deconflict(os.path.join(tmpdir, "image.jpeg")) == os.path.join(tmpdir, "image.jpeg")
     with open(os.path.join(tmpdir, "image.jpeg"), "w"):
@@ -237,3 +270,189 @@ def test_deconflict(tmpdir):
 
 
 # test_load_config
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_watch(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "photos"))
+    _setup_tmpdir(os.path.join(tmpdir, "photos"))
+    obj = LocalRemote(os.path.join(tmpdir, "photos"), state_dir=tmpdir)
+    deltas = []
+    stop = threading.Event()
+
+    def _on_change(delta):
+        deltas.append(delta)
+        stop.set()
+
+    watcher = threading.Thread(target=obj.watch, args=(_on_change,), kwargs={"quiet_period": 0.2, "stop": stop})
+    watcher.start()
+    time.sleep(0.2)
+    os.makedirs(os.path.join(tmpdir, "photos", "2021/03"))
+    with open(os.path.join(tmpdir, "photos", "2021/03/new.jpeg"), "w") as outfile:
+        outfile.write("new")
+    os.remove(os.path.join(tmpdir, "photos", "2020/01/49934.jpeg"))
+    os.symlink("../../2021/03/new.jpeg", os.path.join(tmpdir, "photos", "albums/Spring/new.jpeg"))
+    watcher.join(10)
+    assert not watcher.is_alive()
+
+    assert deltas == [{"new": {"2021/03/new.jpeg"}, "del": {"2020/01/49934.jpeg"}, "albums": {"Spring"}}]
+    assert obj.find_photo("2021/03/new.jpeg")
+    assert not obj.find_photo("2020/01/49934.jpeg")
+    assert obj.find_album("Spring")["photos"] == ["2020/01/49935.jpeg", "2020/01/49936.jpeg", "2021/03/new.jpeg"]
+
+
+def test_blacklist(tmpdir, monkeypatch):
+    _setup_tmpdir(tmpdir)
+    listed = []
+    real_walk = os.walk
+
+    def _walk(path):
+        for root, dirs, afiles in real_walk(path):
+            listed.append(os.path.relpath(root, tmpdir))
+            yield root, dirs, afiles
+
+    monkeypatch.setattr(os, "walk", _walk)
+    obj = LocalRemote(tmpdir, blacklist="Archived,2020/02", state_dir=tmpdir)
+    assert [x["name"] for x in obj.state["photos"]] == [
+        "2020/01/49934.jpeg",
+        "2020/01/49935.jpeg",
+        "2020/01/49936.jpeg",
+    ]
+    assert obj.state["albums"] == [
+        {"name": "Autumn", "photos": []},
+        {"name": "Spring", "photos": ["2020/01/49935.jpeg", "2020/01/49936.jpeg"]},
+    ]
+    # Blacklisted folders are never listed
+    assert not [x for x in listed if x.startswith("Archived") or x.startswith("2020/02")]
+
+    other = LocalRemote(os.path.join(tmpdir, "Archived"), name="other", state_dir=tmpdir)
+    other.state = {"photos": [{"name": "2020/02/IMG1.JPG"}, {"name": "2020/03/IMG1.JPG"}], "albums": []}
+    assert [x.name for x in obj.get_merge_updates(other)] == ["2020/03/IMG1.JPG"]
+
+
+def test_moves(tmpdir):
+    """A photo moved in one remote gets renamed, not copied, in the other"""
+    for folder in ("1", "2"):
+        _setup_tmpdir(os.path.join(tmpdir, folder))
+    obj1 = LocalRemote(os.path.join(tmpdir, "1"), name="one", state_dir=tmpdir)
+    obj2 = LocalRemote(os.path.join(tmpdir, "2"), name="two", state_dir=tmpdir)
+    obj1.do_fixes([{"action": "rename", "name": "2020/01/49935.jpeg", "to": "2021/49935.jpeg"}])
+    obj1.get_new_state()
+    assert obj1.find_album("Spring")["photos"] == ["2020/01/49936.jpeg", "2021/49935.jpeg"]
+
+    updates = obj2.get_merge_updates(obj1)
+    assert [(x.action, x.name, x.new_name) for x in updates] == [
+        ("mv", "2020/01/49935.jpeg", "2021/49935.jpeg"),
+        ("new_album_photo", "2021/49935.jpeg", None),
+    ]
+    for update in updates:
+        update.remote = None  # Data is not read from the other remote
+    obj2.do_updates(updates)
+    with open(os.path.join(tmpdir, "2", "2021/49935.jpeg")) as infile:
+        assert infile.read() == "2020/01/49935.jpeg"
+    assert not os.path.exists(os.path.join(tmpdir, "2", "2020/01/49935.jpeg"))
+    assert obj2.find_album("Spring")["photos"] == ["2020/01/49936.jpeg", "2021/49935.jpeg"]
+    assert os.path.exists(os.path.join(tmpdir, "2", "albums/Spring/49935.jpeg"))
+    assert obj2.state["moves"] == {"2020/01/49935.jpeg": "2021/49935.jpeg"}
+    assert not obj2.get_merge_updates(obj1)
+
+
+def test_moves_detected(tmpdir):
+    """Photos renamed outside of sync are recorded as moves, if their fingerprint was known"""
+    _setup_tmpdir(tmpdir)
+    obj = LocalRemote(tmpdir, state_dir=tmpdir)
+    obj.fingerprint({"name": "2020/01/49935.jpeg"})
+    os.rename(os.path.join(tmpdir, "2020/01/49935.jpeg"), os.path.join(tmpdir, "2020/02/49937.jpeg"))
+    obj.get_new_state()
+    assert obj.state["moves"] == {"2020/01/49935.jpeg": "2020/02/49937.jpeg"}
+    # Moves are kept in later states
+    obj.get_new_state()
+    assert obj.state["moves"] == {"2020/01/49935.jpeg": "2020/02/49937.jpeg"}
+
+
+def test_checksums(tmpdir):
+    """Checksums get recorded while copying, checked against the source and used to verify the copies"""
+    _setup_tmpdir(os.path.join(tmpdir, "1"))
+    os.makedirs(os.path.join(tmpdir, "2"))
+    obj1 = LocalRemote(os.path.join(tmpdir, "1"), name="one", state_dir=tmpdir)
+    obj2 = LocalRemote(os.path.join(tmpdir, "2"), name="two", state_dir=tmpdir)
+    obj2.do_updates([x for x in obj2.get_merge_updates(obj1) if x.action == "new"])
+    assert len(obj2.state["checksums"]) == 5
+    assert obj2.verify() == []
+    # Checksums are saved and kept in new states
+    obj2 = LocalRemote(os.path.join(tmpdir, "2"), name="two", state_dir=tmpdir)
+    obj2.get_new_state()
+    assert len(obj2.state["checksums"]) == 5
+
+    with open(os.path.join(tmpdir, "2", "2020/01/49934.jpeg"), "w") as outfile:
+        outfile.write("bitrot")
+    os.remove(os.path.join(tmpdir, "2", "2020/01/49935.jpeg"))
+    problems = obj2.verify()
+    assert len(problems) == 2
+    assert problems[0].startswith("2020/01/49934.jpeg: checksum")
+
+    # A copy not matching the checksum of its source is removed
+    obj3 = LocalRemote(os.path.join(tmpdir, "3"), name="three", state_dir=tmpdir)
+    for name in ("2020/01/49934.jpeg", "2020/01/49936.jpeg"):
+        obj3.put_data(
+            Update(action="new", photo={"name": name, "filename": os.path.join(tmpdir, "2", name)}, remote=obj2)
+        )
+    assert os.listdir(os.path.join(tmpdir, "3", "2020", "01")) == ["49936.jpeg"]
+
+
+def test_scan_workers(tmpdir):
+    _setup_tmpdir(tmpdir)
+    os.symlink(os.path.join(tmpdir, "2020"), os.path.join(tmpdir, "linked"))
+    photos = LocalRemote(tmpdir, state_dir=tmpdir, scan_workers=4).get_photos()
+    assert [{"name": x["name"]} for x in photos] == expected_photos
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_watch_lock(tmpdir):
+    """Deltas wait for a sync holding the lock"""
+    os.makedirs(os.path.join(tmpdir, "photos"))
+    _setup_tmpdir(os.path.join(tmpdir, "photos"))
+    obj = LocalRemote(os.path.join(tmpdir, "photos"), state_dir=tmpdir)
+    stop = threading.Event()
+    lock = threading.Lock()
+    watcher = threading.Thread(
+        target=obj.watch, args=(lambda delta: stop.set(),), kwargs={"quiet_period": 0.2, "stop": stop, "lock": lock}
+    )
+    watcher.start()
+    time.sleep(0.2)
+    with lock:
+        os.remove(os.path.join(tmpdir, "photos", "2020/01/49934.jpeg"))
+        time.sleep(1)
+        assert obj.find_photo("2020/01/49934.jpeg")
+    watcher.join(10)
+    assert not watcher.is_alive()
+    assert not obj.find_photo("2020/01/49934.jpeg")
+
+
+def test_merge_updates_stream(tmpdir):
+    """New photos are yielded while other is listed, unless this remote has a photo of their size"""
+    _setup_tmpdir(os.path.join(tmpdir, "1"))
+    os.makedirs(os.path.join(tmpdir, "1", "2000"))
+    with open(os.path.join(tmpdir, "1", "2000/new.jpeg"), "w") as outfile:
+        outfile.write("xyz")
+    os.makedirs(os.path.join(tmpdir, "2", "2019"))
+    with open(os.path.join(tmpdir, "2", "2019/old.jpeg"), "w") as outfile:
+        outfile.write("abc")
+    obj1 = LocalRemote(os.path.join(tmpdir, "1"), name="one", state_dir=tmpdir)
+    obj2 = LocalRemote(os.path.join(tmpdir, "2"), name="two", state_dir=tmpdir)
+    listed = []
+
+    def _listing():
+        for photo in obj1.state["photos"]:
+            listed.append(photo["name"])
+            yield photo
+
+    seen = []
+    for update in obj2.iter_merge_updates(obj1, _listing()):
+        seen.append((update.name, len(listed)))
+    photos = len(obj1.state["photos"])
+    # Photos go on right after they were listed, the one of a size obj2 has waits for the end
+    assert listed[0] == "2000/new.jpeg"
+    assert seen[0] == (listed[1], 2)
+    assert ("2000/new.jpeg", photos) in seen
+    assert sorted(x for x, _ in seen if x.endswith(".jpeg")) == sorted(listed)
@@ -0,0 +1,60 @@
+"""Test the in-memory and synthetic remotes"""
+from photoriver2.metrics import Metrics
+from photoriver2.remote_base import Update
+from photoriver2.remote_memory import MemoryRemote, SyntheticRemote
+
+
+def test_synthetic():
+    obj = SyntheticRemote(name="synthetic", photos=100, albums=2, album_size=10, photo_size=1000)
+    assert len(obj.state["photos"]) == 100
+    assert [len(x["photos"]) for x in obj.state["albums"]] == [10, 10]
+    assert obj.state == SyntheticRemote(name="synthetic", photos=100, albums=2, album_size=10, photo_size=1000).state
+    for photo in obj.state["photos"][:10]:
+        data = obj.get_data(photo).read()
+        assert 500 <= len(data) <= 1500
+        assert obj.get_size(photo) == len(data)
+
+
+def test_fixes():
+    obj = SyntheticRemote(name="synthetic", photos=100, albums=5, album_size=50)
+    fixes = obj.get_fixes()
+    assert fixes and all(x["name"].startswith("import/") for x in fixes)
+    data = obj.get_data({"name": fixes[0]["name"]}).read()
+    obj.do_fixes(fixes)
+    obj.get_new_state()
+    assert obj.get_fixes() == []
+    assert obj.get_data({"name": fixes[0]["to"]}).read() == data
+    assert obj.state["moves"][fixes[0]["name"]] == fixes[0]["to"]
+    assert not [x for album in obj.state["albums"] for x in album["photos"] if x.startswith("import/")]
+
+
+def test_do_updates():
+    source = SyntheticRemote(name="synthetic", photos=20, albums=1, album_size=5)
+    obj = MemoryRemote(name="memory")
+    updates = obj.get_merge_updates(source)
+    assert sorted(x.action for x in updates) == ["new"] * 20 + ["new_album"]
+    obj.do_updates(updates)
+    assert obj.state["photos"] == source.state["photos"]
+    assert obj.state["albums"] == source.state["albums"]
+    assert obj.get_checksum(source.state["photos"][0]["name"]).startswith("sha256:")
+    obj.do_updates([Update(action="mv", remote=source, name="missing", new_name="other")])
+    assert obj.get_merge_updates(source) == []
+
+
+def test_moves_and_metrics(tmpdir, monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr("photoriver2.remote_memory.METRICS", metrics)
+    source = SyntheticRemote(name="synthetic", photos=20, albums=1, album_size=5, state_dir=tmpdir)
+    obj = MemoryRemote(name="memory", state_dir=tmpdir)
+    obj.do_updates(obj.get_merge_updates(source))
+    summary = metrics.summary()[0]
+    assert summary["items"] == 20
+    assert summary["bytes"] == sum(source.get_size(x) for x in source.state["photos"])
+
+    # Moves take the capture date and album membership along
+    name = source.state["albums"][0]["photos"][0]
+    obj.dates[name] = source.dates[name]
+    obj.do_updates([Update(action="mv", remote=source, name=name, new_name="moved/" + name)])
+    assert obj.dates["moved/" + name] == source.dates[name]
+    assert "moved/" + name in obj.state["albums"][0]["photos"]
+    assert name not in obj.state["albums"][0]["photos"]
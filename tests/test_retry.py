@@ -0,0 +1,44 @@
+"""Test the persistent retry queue"""
+from unittest.mock import Mock
+
+from photoriver2.remote_base import Update
+from photoriver2.retry import BACKOFF, MAX_ATTEMPTS, RetryQueue
+
+
+def _update(name="2020/01/01/a.jpg"):
+    source = Mock()
+    source.name = "google"
+    return Update(action="new", photo={"name": name}, remote=source)
+
+
+def test_backoff(tmpdir):
+    queue = RetryQueue(str(tmpdir.join("local_retry.json")))
+    update = _update()
+    assert queue.allowed(update)
+    assert queue.failed(update, IOError("broken"))
+    item = queue.items["google:2020/01/01/a.jpg"]
+    assert item["attempts"] == 1 and item["error"] == "OSError: broken"
+    assert not queue.allowed(update)
+    first = item["next"]
+    assert queue.allowed(update, now=first + 1)
+    assert queue.allowed(_update("2020/01/01/b.jpg"))
+    queue.failed(update, IOError("broken"))
+    assert queue.items["google:2020/01/01/a.jpg"]["next"] - first >= BACKOFF
+    queue.succeeded(update)
+    assert queue.items == {} and queue.allowed(update)
+
+
+def test_dead_letter(tmpdir):
+    queue = RetryQueue(str(tmpdir.join("local_retry.json")))
+    update = _update()
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert queue.failed(update, IOError("broken"))
+    assert not queue.failed(update, IOError("broken"))
+    assert not queue.allowed(update, now=float("inf"))
+    queue.save()
+
+    queue = RetryQueue(str(tmpdir.join("local_retry.json")))
+    assert list(queue.dead) == ["google:2020/01/01/a.jpg"]
+    queue.clear_dead()
+    assert queue.dead == {} and queue.allowed(update)
+    assert queue.items["google:2020/01/01/a.jpg"]["attempts"] == 0
@@ -0,0 +1,84 @@
+"""Test size-aware transfer scheduling"""
+import threading
+import time
+
+from unittest.mock import Mock
+
+import pytest
+
+from photoriver2.remote_base import Update
+from photoriver2.retry import RetryQueue
+from photoriver2.scheduler import LARGE_SIZE, Scheduler, order
+
+SIZES = {
+    "2020/01/01/a.jpg": 100,
+    "2020/01/02/b.mov": LARGE_SIZE * 2,
+    "2021/01/01/c.jpg": 50,
+    "2019/01/01/d.mov": LARGE_SIZE,
+}
+
+
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        ("name", ["2019/01/01/d.mov", "2020/01/01/a.jpg", "2020/01/02/b.mov", "2021/01/01/c.jpg"]),
+        ("newest", ["2021/01/01/c.jpg", "2020/01/02/b.mov", "2020/01/01/a.jpg", "2019/01/01/d.mov"]),
+        ("small-first", ["2021/01/01/c.jpg", "2020/01/01/a.jpg", "2019/01/01/d.mov", "2020/01/02/b.mov"]),
+        ("interleaved", ["2020/01/01/a.jpg", "2019/01/01/d.mov", "2021/01/01/c.jpg", "2020/01/02/b.mov"]),
+    ],
+)
+def test_order(policy, expected):
+    assert order(list(SIZES), policy, SIZES.get, lambda x: x) == expected
+
+
+def test_unknown_policy():
+    with pytest.raises(RuntimeError):
+        Scheduler("local", policy="random")
+
+
+def test_lanes():
+    """Small files do not wait for large ones"""
+    source = Mock()
+    source.get_size.side_effect = lambda photo: SIZES[photo["name"]]
+    updates = [Update(action="new", photo={"name": x}, remote=source) for x in SIZES]
+    done = []
+    release = threading.Event()
+
+    def _transfer(update):
+        if SIZES[update.name] >= LARGE_SIZE:
+            release.wait(5)
+        done.append(update.name)
+        if len(done) == 2:
+            release.set()
+        return update.name
+
+    start = time.monotonic()
+    results = Scheduler("local", workers=1, large_workers=1).run(_transfer, updates)
+    assert time.monotonic() - start < 5
+    assert sorted(results) == sorted(SIZES)
+    assert done[:2] == ["2021/01/01/c.jpg", "2020/01/01/a.jpg"]
+
+
+def test_poison_item(tmpdir, monkeypatch):
+    """A failing transfer is retried and queued without blocking the others"""
+    monkeypatch.setattr("photoriver2.scheduler.RETRY_WAIT", 0)
+    source = Mock()
+    source.name = "google"
+    source.get_size.side_effect = lambda photo: SIZES[photo["name"]]
+    updates = [Update(action="new", photo={"name": x}, remote=source) for x in SIZES]
+    calls = []
+
+    def _transfer(update):
+        calls.append(update.name)
+        if update.name == "2020/01/01/a.jpg":
+            raise IOError("broken")
+        return update.name
+
+    retry = RetryQueue(str(tmpdir.join("local_retry.json")))
+    results = Scheduler("local").run(_transfer, updates, retry=retry)
+    assert sorted(x for x in results if x) == ["2019/01/01/d.mov", "2020/01/02/b.mov", "2021/01/01/c.jpg"]
+    assert calls.count("2020/01/01/a.jpg") == 3
+    # All tries of a run count as one failure
+    assert RetryQueue(str(tmpdir.join("local_retry.json"))).items["google:2020/01/01/a.jpg"]["attempts"] == 1
+    # Waiting for its backoff in the next run
+    assert Scheduler("local").run(_transfer, updates[:1], retry=retry) == []
@@ -0,0 +1,21 @@
+"""Test the synthetic library generator used by benchmarks"""
+import os
+
+from benchmarks.synthetic import make_google_state, make_library
+from photoriver2.remote_local import LocalRemote
+
+
+def test_make_library(tmpdir):
+    names = make_library(os.path.join(tmpdir, "base"), photos=50, albums=3, album_size=5)
+    obj = LocalRemote(os.path.join(tmpdir, "base"), state_dir=tmpdir)
+    assert sorted(names) == [x["name"] for x in obj.state["photos"]]
+    assert [len(x["photos"]) for x in obj.state["albums"]] == [5, 5, 5]
+    # Only photos in the import folder are not in their YYYY/MM/DD location
+    assert sorted(x["name"] for x in obj.get_fixes()) == sorted(x for x in names if x.startswith("import/"))
+
+
+def test_make_google_state(tmpdir):
+    names = [f"2020/01/01/IMG{x}.jpeg" for x in range(100)]
+    state = make_google_state(os.path.join(tmpdir, "google_state.json"), names, overlap=0.5, extra=0.2)
+    assert 30 < len([x for x in state["photos"] if x["name"] in names]) < 70
+    assert len([x for x in state["photos"] if x["name"] not in names]) == 20